@@ -0,0 +1,313 @@
+"""Офлайн-бенчмарк бота: синтетическое дерево материалов и прогон обновлений.
+
+Не нужны ни токен, ни сеть: обновления подаются прямо в диспетчер, а Bot
+работает через сессию-заглушку с ответами FakeTelegramAPI. Каждый размер
+дерева замеряется в отдельном процессе, чтобы пик RSS относился только к
+нему (см. РАЗВЕРТЫВАНИЕ.md, «Бенчмарк»).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Sequence
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
+from aiogram.enums import ParseMode
+from aiogram.types import Update
+
+import bot as academy
+from fake_telegram import (
+    CALLBACK_DATA,
+    FakeTelegramAPI,
+    message_update,
+    navigation_callbacks,
+    percentile,
+    synthetic_updates,
+)
+
+# ===== СИНТЕТИЧЕСКОЕ ДЕРЕВО =====
+
+TITLE_WORDS = [
+    "Введение", "Базовый", "Средний", "Продвинутый", "Атака", "Фишинг", "Команды",
+    "Система", "Пользователь", "Сеть", "Пароли", "Wi-Fi", "Nmap", "Metasploit", "Linux",
+]
+TEXT_WORDS = [
+    "kali", "linux", "команды", "атака", "фишинг", "система", "nmap", "пользователь",
+    "сканирование", "порт", "пароль", "сеть", "уязвимость", "эксплойт", "терминал",
+    "права", "процесс", "файл", "пакет", "маршрутизатор", "защита", "журнал",
+]
+
+
+def generate_tree(
+    root: Path, files: int, depth: int = 3, fanout: int = 10, file_size: int = 1024, seed: int = 0,
+) -> None:
+    """Создаёт files уроков в дереве глубины depth по fanout подпапок на уровень.
+
+    Файлы раскладываются по листовым папкам по кругу, размер текста каждого
+    около file_size байт.
+    """
+    rnd = random.Random(seed)
+    leaves = max(1, fanout) ** depth
+    root.mkdir(parents=True, exist_ok=True)
+    for n in range(files):
+        leaf, parts = n % leaves, []
+        for level in range(depth):
+            leaf, k = divmod(leaf, fanout)
+            parts.append(f"{k + 1:02d}. {TITLE_WORDS[(k + level) % len(TITLE_WORDS)]}")
+        folder = root.joinpath(*parts)
+        folder.mkdir(parents=True, exist_ok=True)
+        title = " ".join(rnd.sample(TITLE_WORDS, 2))
+        words: List[str] = []
+        size = 0
+        while size < file_size:
+            word = rnd.choice(TEXT_WORDS)
+            words.append(word)
+            size += len(word.encode("utf-8")) + 1
+        (folder / f"{n // leaves + 1:03d}. {title}.txt").write_text(" ".join(words), encoding="utf-8")
+
+
+# ===== ЗАГЛУШКА BOT =====
+
+class BenchSession(BaseSession):
+    """Сессия без сети: ответы на методы Bot API берутся из FakeTelegramAPI"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.api = FakeTelegramAPI()
+
+    async def make_request(self, bot: Bot, method: Any, timeout: Optional[int] = None) -> Any:
+        name = method.__api_method__
+        self.api.calls[name] += 1
+        params = {
+            key: value for key in ("chat_id", "message_id", "text")
+            if (value := getattr(method, key, None)) is not None
+        }
+        content = json.dumps({"ok": True, "result": self.api.result_for(name, params)})
+        return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    async def stream_content(self, *args: Any, **kwargs: Any) -> AsyncGenerator[bytes, None]:
+        """Скачивание файлов в сценариях не встречается: отдаёт пустой файл"""
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+# ===== ЗАМЕРЫ =====
+
+def peak_rss_mb() -> float:
+    """Пик RSS процесса (ru_maxrss: КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(scenario: str, files: int, latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    return {
+        "scenario": scenario,
+        "files": files,
+        "ops": len(latencies),
+        "ops_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def time_calls(scenario: str, files: int, fn: Callable[[Any], Any], args: Sequence[Any]) -> Dict[str, Any]:
+    """Последовательные синхронные вызовы fn(arg) для каждого arg"""
+    latencies: List[float] = []
+    started_at = time.perf_counter()
+    for arg in args:
+        started = time.perf_counter()
+        fn(arg)
+        latencies.append(time.perf_counter() - started)
+    return summarize(scenario, files, latencies, time.perf_counter() - started_at)
+
+
+async def replay(
+    scenario: str, files: int, dp: Dispatcher, bot: Bot, updates: List[Dict[str, Any]], concurrency: int,
+) -> Dict[str, Any]:
+    """Прогоняет обновления через диспетчер concurrency потоками"""
+    latencies: List[float] = []
+    queue = iter(updates)
+
+    async def worker() -> None:
+        for raw in queue:
+            update = Update.model_validate(raw, context={"bot": bot})
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(scenario, files, latencies, time.perf_counter() - started_at)
+
+
+async def measure_watcher(
+    files: int, info_root: Path, bot: Bot, rounds: int, seed: int, timeout: float = 30.0,
+) -> Dict[str, Any]:
+    """Время от появления файла на диске до его попадания в снимок каталога"""
+    rnd = random.Random(seed)
+    dirs = sorted(academy.content_catalog.dirs)
+    task = asyncio.create_task(academy.watch_info_changes(bot, interval_seconds=1))
+    await asyncio.sleep(0.5)
+    latencies: List[float] = []
+    started_at = time.perf_counter()
+    try:
+        for round_no in range(rounds):
+            rel_dir = rnd.choice(dirs)
+            name = f"999. Новый урок {round_no}.txt"
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            started = time.perf_counter()
+            (info_root / rel).write_text("новый урок kali linux", encoding="utf-8")
+            while rel not in academy.content_catalog.files:
+                if time.perf_counter() - started > timeout:
+                    logging.warning("Наблюдатель не увидел %s за %.0f с", rel, timeout)
+                    break
+                await asyncio.sleep(0.005)
+            else:
+                latencies.append(time.perf_counter() - started)
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    return summarize("watch_info_changes (новый файл)", files, latencies, time.perf_counter() - started_at)
+
+
+async def run_size(files: int, options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Все сценарии для дерева из files уроков"""
+    rows: List[Dict[str, Any]] = []
+    workdir = Path(tempfile.mkdtemp(prefix="academy_bench_")).resolve()
+    try:
+        info_root = workdir / academy.INFO_DIR_NAME
+        started = time.perf_counter()
+        generate_tree(info_root, files, options["depth"], options["fanout"], options["file_size"], options["seed"])
+        logging.info("Дерево из %s файлов создано за %.1f с", files, time.perf_counter() - started)
+
+        # Состояние только в памяти: настоящий state.sqlite3 бенчмарк не трогает
+        os.environ["STATE_BACKEND"] = "memory"
+        academy.INFO_ROOT = info_root
+        started = time.perf_counter()
+        await academy.prepare_runtime()
+        elapsed = time.perf_counter() - started
+        rows.append(summarize("prepare_runtime (снимок + индекс)", files, [elapsed], elapsed))
+
+        dirs = sorted(academy.content_catalog.dirs)
+        calls = [dirs[i % len(dirs)] for i in range(options["ops"])]
+        rows.append(time_calls("list_dir", files, academy.list_dir, calls))
+
+        def build_cold(rel_dir: str) -> None:
+            academy.keyboard_cache.clear()
+            academy.build_dir_keyboard(rel_dir)
+
+        rows.append(time_calls("build_dir_keyboard (без кэша)", files, build_cold, calls))
+        for rel_dir in dirs:
+            academy.build_dir_keyboard(rel_dir)
+        rows.append(time_calls("build_dir_keyboard (кэш)", files, academy.build_dir_keyboard, calls))
+
+        session = BenchSession()
+        bot = Bot(token="123456:BENCH", session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        dp = academy.create_dispatcher()
+        rnd = random.Random(options["seed"])
+
+        # Каждый запрос от своего чата: без подавления дребезга и вытеснения
+        queries = [
+            rnd.choice(TEXT_WORDS + [word.lower() for word in TITLE_WORDS])[:rnd.randint(3, 12)]
+            for _ in range(options["searches"])
+        ]
+        academy.search_cache.clear()
+        updates = [message_update(i + 1, 10_000_000 + i, query) for i, query in enumerate(queries)]
+        rows.append(await replay("on_text_search", files, dp, bot, updates, options["concurrency"]))
+
+        callbacks = list(CALLBACK_DATA) + navigation_callbacks(info_root)
+        updates = synthetic_updates(options["updates"], options["chats"], options["seed"], callbacks)
+        rows.append(await replay("смешанный поток обновлений", files, dp, bot, updates, options["concurrency"]))
+
+        rows.append(await measure_watcher(files, info_root, bot, options["watch_rounds"], options["seed"]))
+
+        await academy.shutdown_runtime()
+        await session.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+
+def run_size_process(files: int, options: Dict[str, Any]) -> List[Dict[str, Any]]:
+    logging.basicConfig(level=logging.INFO if options["verbose"] else logging.WARNING)
+    return asyncio.run(run_size(files, options))
+
+
+# ===== ОТЧЁТ =====
+
+COLUMNS = [
+    ("scenario", "сценарий", 36), ("files", "файлов", 8), ("ops", "операций", 9),
+    ("ops_per_second", "оп/с", 10), ("p50_ms", "p50, мс", 10), ("p99_ms", "p99, мс", 10),
+    ("peak_rss_mb", "пик RSS, МБ", 12),
+]
+
+
+def format_report(rows: List[Dict[str, Any]]) -> str:
+    lines = ["".join(title.ljust(width) for _, title, width in COLUMNS)]
+    for row in rows:
+        lines.append("".join(str(row[key]).ljust(width) for key, _, width in COLUMNS))
+    return "\n".join(lines)
+
+
+# ===== ТОЧКА ВХОДА =====
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10,1000,100000", help="размеры дерева в файлах через запятую")
+    parser.add_argument("--depth", type=int, default=3, help="глубина дерева папок")
+    parser.add_argument("--fanout", type=int, default=10, help="подпапок на каждом уровне")
+    parser.add_argument("--file-size", type=int, default=1024, help="размер урока в байтах")
+    parser.add_argument("--ops", type=int, default=2000, help="вызовов list_dir и build_dir_keyboard")
+    parser.add_argument("--searches", type=int, default=500, help="поисковых запросов")
+    parser.add_argument("--updates", type=int, default=2000, help="обновлений в смешанном потоке")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--watch-rounds", type=int, default=5, help="новых файлов для замера наблюдателя")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="вывести строки отчёта в JSON")
+    parser.add_argument("--output", default="", help="дополнительно записать отчёт в файл")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    options = {
+        "depth": args.depth, "fanout": args.fanout, "file_size": args.file_size, "ops": args.ops,
+        "searches": args.searches, "updates": args.updates, "chats": args.chats,
+        "concurrency": args.concurrency, "watch_rounds": args.watch_rounds, "seed": args.seed,
+        "verbose": args.verbose,
+    }
+    rows: List[Dict[str, Any]] = []
+    context = multiprocessing.get_context("spawn")
+    for files in (int(size) for size in args.sizes.split(",") if size.strip()):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            rows.extend(pool.submit(run_size_process, files, options).result())
+
+    report = json.dumps(rows, ensure_ascii=False, indent=2) if args.json else format_report(rows)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
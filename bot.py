@@ -1,613 +1,4092 @@
+import argparse
 import asyncio
+import base64
+import bisect
+import ctypes
+import ctypes.util
+import functools
+import hashlib
+import heapq
+import html
+import json
 import logging
+import math
+import multiprocessing
 import os
+import random
+import re
+import secrets
+import signal
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
 from pathlib import Path
-from typing import Dict, List, Tuple
+from queue import Full as QueueFull
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # Windows: выбор ведущего процесса недоступен
+    fcntl = None
+
+from aiohttp import web
 from dotenv import load_dotenv
 
-from aiogram import Bot, Dispatcher, F, Router
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+    TelegramObject,
+    Update,
+)
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 # ===== КОНФИГУРАЦИЯ =====
 APP_ROOT = Path(__file__).resolve().parent
 INFO_DIR_NAME = "Информация"
 INFO_ROOT = APP_ROOT / INFO_DIR_NAME
 
+T = TypeVar("T")
+
+
+def env_int(name: str, default: int) -> int:
+    """Целое значение из переменной окружения (или значение по умолчанию)"""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning("Некорректное значение %s=%r, используется %s", name, value, default)
+        return default
+
 # ===== ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ =====
+ADMIN_IDS: set[int] = set()  # Кому доступны служебные команды (ADMIN_IDS в .env)
 subscribers: set[int] = set()  # Подписчики на уведомления
-known_files: set[str] = set()  # Известные файлы для отслеживания
-user_progress: Dict[int, Dict[str, bool]] = {}  # Прогресс изучения пользователей
 user_content_messages: Dict[int, List[int]] = {}  # ID сообщений с контентом для очистки
 
 # ===== УПРОЩЕННЫЕ ЭМОДЗИ =====
+EMOJI_RULES_PATH = APP_ROOT / "emoji_rules.json"
+
+# Правила по приоритету: первое правило, чьё слово есть в названии, выигрывает
+DEFAULT_EMOJI_RULES: List[Tuple[str, List[str]]] = [
+    ("🟢", ["базовый", "введение", "что такое"]),
+    ("🟡", ["средний", "атака", "человек"]),
+    ("🔴", ["продвинутый", "фишинг", "взлом"]),
+    ("🔵", ["команды", "система", "оборудование", "пользователь"]),
+]
+
+
+class KeywordAutomaton:
+    """Автомат Ахо–Корасик: все ключевые слова ищутся за один проход по строке"""
+
+    NO_MATCH = sys.maxsize
+
+    def __init__(self, keywords: Mapping[str, int]) -> None:
+        # keywords: слово -> номер правила; в состоянии хранится лучший (меньший) номер
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._rule: List[int] = [self.NO_MATCH]
+        for word, rule in keywords.items():
+            state = 0
+            for ch in word:
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._rule.append(self.NO_MATCH)
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            self._rule[state] = min(self._rule[state], rule)
+
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(ch, 0) if state else 0
+                self._rule[child] = min(self._rule[child], self._rule[self._fail[child]])
+                queue.append(child)
+
+    def first_rule(self, text: str) -> Optional[int]:
+        """Номер самого приоритетного правила, слово которого входит в text"""
+        best = self.NO_MATCH
+        state = 0
+        for ch in text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            if self._rule[state] < best:
+                best = self._rule[state]
+                if best == 0:
+                    break
+        return None if best == self.NO_MATCH else best
+
+
+class EmojiClassifier:
+    """Эмодзи по названию раздела или урока.
+
+    Правила компилируются в один автомат, результат запоминается для
+    каждого названия, так что клавиатура платит словарным поиском.
+    """
+
+    def __init__(self, rules: List[Tuple[str, List[str]]]) -> None:
+        self.configure(rules)
+
+    def configure(self, rules: List[Tuple[str, List[str]]]) -> None:
+        keywords: Dict[str, int] = {}
+        for index, (_, words) in enumerate(rules):
+            for word in words:
+                keywords.setdefault(word.lower(), index)
+        self._emojis = [emoji for emoji, _ in rules]
+        self._automaton = KeywordAutomaton(keywords)
+        self._memo: Dict[str, str] = {}
+
+    def load(self, path: Path) -> None:
+        """Правила из JSON: {"rules": [{"emoji": "🟢", "keywords": ["базовый", ...]}, ...]}"""
+        if not path.exists():
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            rules = [(str(rule["emoji"]), [str(word) for word in rule["keywords"]]) for rule in data["rules"]]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning("Не удалось загрузить %s, используются встроенные правила: %s", path, e)
+            return
+        self.configure(rules)
+        logging.info("Загружено правил эмодзи: %d", len(rules))
+
+    def classify(self, name: str) -> str:
+        emoji = self._memo.get(name)
+        if emoji is None:
+            name_lower = name.lower()
+            rule = self._automaton.first_rule(name_lower)
+            if rule is not None:
+                emoji = self._emojis[rule]
+            else:
+                emoji = "📁" if "dir" in name_lower else "📘"
+            if len(self._memo) >= 65536:
+                self._memo.clear()
+            self._memo[name] = emoji
+        return emoji
+
+
+emoji_classifier = EmojiClassifier(DEFAULT_EMOJI_RULES)
+
+
 def get_emoji(name: str) -> str:
     """Получить эмодзи для раздела или контента"""
-    name_lower = name.lower()
-    if any(word in name_lower for word in ["базовый", "введение", "что такое"]):
-        return "🟢"
-    elif any(word in name_lower for word in ["средний", "атака", "человек"]):
-        return "🟡"
-    elif any(word in name_lower for word in ["продвинутый", "фишинг", "взлом"]):
-        return "🔴"
-    elif any(word in name_lower for word in ["команды", "система", "оборудование", "пользователь"]):
-        return "🔵"
-    elif any(word in name_lower for word in ["введение", "что такое"]):
-        return "👋"
-    elif any(word in name_lower for word in ["команды", "система"]):
-        return "⚡"
-    elif any(word in name_lower for word in ["атака", "фишинг"]):
-        return "🎯"
-    else:
-        return "📁" if "dir" in name_lower else "📘"
+    return emoji_classifier.classify(name)
+
+
+def callback_id(kind: str, rel_path: str, salt: int = 0) -> str:
+    """Короткий детерминированный id пути: 12 символов base64url от хэша (вид, путь)"""
+    key = f"{kind}\0{rel_path}" if not salt else f"{kind}\0{rel_path}\0{salt}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=9).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii")
 
 
 class PathRegistry:
-    """Регистрирует относительные пути и выдаёт короткие id для callback_data."""
+    """Выдаёт короткие id путей для callback_data без хранения состояния.
 
-    def __init__(self) -> None:
-        self._id_to_path: Dict[str, Tuple[str, str]] = {}
-        self._path_to_id: Dict[Tuple[str, str], str] = {}
-        self._counter: int = 0
+    id вычисляется из (вид, путь), поэтому одинаков в любом процессе и после
+    перезапуска, а обратное разрешение — словарь текущего снимка каталога.
+    """
 
     def get_id(self, kind: str, rel_path: str) -> str:
-        key = (kind, rel_path)
-        if key in self._path_to_id:
-            return self._path_to_id[key]
-        self._counter += 1
-        assigned_id = str(self._counter)
-        self._path_to_id[key] = assigned_id
-        self._id_to_path[assigned_id] = (kind, rel_path)
-        return assigned_id
+        assigned_id = content_catalog.ids_by_path.get((kind, rel_path))
+        return assigned_id if assigned_id is not None else callback_id(kind, rel_path)
 
     def resolve(self, assigned_id: str) -> Tuple[str, str]:
-        return self._id_to_path[assigned_id]
+        return content_catalog.paths_by_id[assigned_id]
 
 
 
 
-# ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
+# ===== КАТАЛОГ КОНТЕНТА =====
 
-def ensure_info_root() -> None:
-    """Проверяет существование папки с информацией"""
-    if not INFO_ROOT.exists() or not INFO_ROOT.is_dir():
-        raise FileNotFoundError(
-            f"Папка '{INFO_DIR_NAME}' не найдена рядом с файлом: {APP_ROOT}"
-        )
+@dataclass(frozen=True)
+class FileEntry:
+    """Файл урока в снимке каталога"""
+    name: str
+    stem: str
+    rel_path: str
+    parent: str
+    size: int
+    mtime_ns: int
 
 
-def list_dir(rel_dir: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
-    """Получает список папок и .txt файлов в указанной директории"""
-    base = (INFO_ROOT / rel_dir).resolve()
-    if INFO_ROOT not in base.parents and base != INFO_ROOT:
-        raise PermissionError("Выход за пределы корневой папки Информация запрещён")
+@dataclass(frozen=True)
+class DirEntry:
+    """Папка в снимке каталога: отсортированные подпапки и .txt файлы"""
+    name: str
+    rel_path: str
+    parent: Optional[str]
+    dirs: Tuple[Tuple[str, str], ...]
+    files: Tuple[Tuple[str, str], ...]
+    total_files: int = 0
+    mtime_ns: int = 0
 
-    dir_items: List[Tuple[str, str]] = []
-    file_items: List[Tuple[str, str]] = []
-    for entry in sorted(base.iterdir(), key=lambda p: (not p.is_dir(), p.name.lower())):
-        if entry.is_dir():
-            dir_items.append((entry.name, str((Path(rel_dir) / entry.name).as_posix())))
-        else:
-            if entry.suffix.lower() == ".txt":
-                file_items.append((entry.stem, str((Path(rel_dir) / entry.name).as_posix())))
-    return dir_items, file_items
 
+def is_inside_root(root: Path, path: str) -> bool:
+    """Остаётся ли путь после разрешения ссылок внутри root"""
+    try:
+        Path(path).resolve().relative_to(Path(root).resolve())
+    except (ValueError, OSError, RuntimeError):
+        return False
+    return True
 
-def read_text_file(rel_path: str) -> str:
-    """Читает содержимое .txt файла"""
-    file_path = (INFO_ROOT / rel_path).resolve()
-    if INFO_ROOT not in file_path.parents and file_path != INFO_ROOT:
-        raise PermissionError("Выход за пределы корневой папки Информация запрещён")
-    with open(file_path, "r", encoding="utf-8") as f:
-        return f.read()
 
+def _depth(rel_path: str) -> int:
+    return rel_path.count("/") + 1 if rel_path else 0
 
 
+def _drop_subtree(rel_dir: str, dirs: Dict[str, DirEntry], files: Dict[str, FileEntry]) -> None:
+    """Удаляет папку и всё вложенное из изменяемых словарей снимка"""
+    entry = dirs.pop(rel_dir, None)
+    if entry is None:
+        return
+    for _, child_rel in entry.files:
+        files.pop(child_rel, None)
+    for _, child_rel in entry.dirs:
+        _drop_subtree(child_rel, dirs, files)
 
 
+class LessonOrdinals:
+    """Стабильные порядковые номера уроков — позиции битов в прогрессе.
 
+    Номер выдаётся файлу один раз и не переиспользуется, даже если файл удалён:
+    при его возвращении прогресс пользователей восстанавливается.
 
+    При нескольких процессах номера выдаёт только ведущий (assigning=True);
+    остальные лишь загружают их из хранилища, а новые файлы до этого
+    остаются без номера.
+    """
 
-async def clear_user_messages(bot: Bot, chat_id: int) -> None:
-    """Удаляет предыдущие сообщения с контентом при переходе"""
-    ids = user_content_messages.get(chat_id) or []
-    if not ids:
-        return
-    for mid in ids:
-        try:
-            await bot.delete_message(chat_id, mid)
-        except Exception:
-            pass
-    user_content_messages[chat_id] = []
+    def __init__(self) -> None:
+        self._by_path: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.assigning = True
 
+    def __len__(self) -> int:
+        return len(self._by_path)
 
+    def get(self, rel_path: str) -> Optional[int]:
+        return self._by_path.get(rel_path)
 
-def build_dir_keyboard(rel_dir: str, user_id: int = 0) -> InlineKeyboardMarkup:
-    dirs, files = list_dir(rel_dir)
-    rows: List[List[InlineKeyboardButton]] = []
+    def assign(self, rel_paths: Iterable[str]) -> Dict[str, int]:
+        """Номера для путей; новым путям выдаются следующие свободные номера.
 
-    # Директории с цветовой индикацией
-    for display_name, child_rel in dirs:
-        iid = path_registry.get_id("dir", child_rel)
-        emoji = get_emoji(display_name)
-        # Проверяем прогресс изучения
-        progress = ""
-        if user_id and user_id in user_progress:
-            studied_count = sum(1 for f in files if user_progress[user_id].get(f[1], False))
-            total_count = len(files)
-            if total_count > 0:
-                progress = f" ({studied_count}/{total_count})"
-        
-        rows.append([InlineKeyboardButton(
-            text=f"{emoji} {display_name}{progress}", 
-            callback_data=f"open_dir:{iid}"
-        )])
+        Если процесс номера не выдаёт, пути без номера в ответ не попадают.
+        """
+        with self._lock:
+            if self.assigning:
+                for rel in sorted(set(rel_paths) - self._by_path.keys()):
+                    self._by_path[rel] = len(self._by_path)
+            return {rel: self._by_path[rel] for rel in rel_paths if rel in self._by_path}
 
-    # Файлы с индикацией изучения
-    for display_name, child_rel in files:
-        iid = path_registry.get_id("file", child_rel)
-        emoji = get_emoji(display_name)
-        # Индикатор изучения
-        studied = "✅" if user_id and user_progress.get(user_id, {}).get(child_rel, False) else "📖"
-        rows.append([InlineKeyboardButton(
-            text=f"{studied} {emoji} {display_name}", 
-            callback_data=f"open_file:{iid}"
-        )])
+    def load(self, mapping: Mapping[str, int]) -> None:
+        with self._lock:
+            self._by_path = dict(mapping)
 
-    # Навигация
-    nav_row: List[InlineKeyboardButton] = []
-    if rel_dir:
-        parent = str(Path(rel_dir).parent.as_posix()) if Path(rel_dir).parent.as_posix() != "." else ""
-        pid = path_registry.get_id("dir", parent)
-        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"open_dir:{pid}"))
-    home_id = path_registry.get_id("dir", "")
-    nav_row.append(InlineKeyboardButton(text="🏠 Домой", callback_data=f"open_dir:{home_id}"))
-    rows.append(nav_row)
+    def merge(self, mapping: Mapping[str, int]) -> None:
+        """Добавляет номера, выданные другим процессом (при расхождении побеждают они)"""
+        with self._lock:
+            self._by_path.update(mapping)
 
-    # Дополнительные кнопки
-    action_row = []
-    cur_id = path_registry.get_id("dir", rel_dir)
-    action_row.append(InlineKeyboardButton(text="🔄 Обновить", callback_data=f"open_dir:{cur_id}"))
-    action_row.append(InlineKeyboardButton(text="🔍 Поиск", callback_data="search"))
-    action_row.append(InlineKeyboardButton(text="📊 Статистика", callback_data="stats"))
-    rows.append(action_row)
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._by_path)
 
-    return InlineKeyboardMarkup(inline_keyboard=rows)
 
+lesson_ordinals = LessonOrdinals()
 
-def build_home_keyboard(user_id: int = 0) -> InlineKeyboardMarkup:
-    home_id = path_registry.get_id("dir", "")
-    
-    # Статистика для главной страницы
-    stats_text = ""
-    if user_id and user_id in user_progress:
-        total_files = len(scan_all_txt())
-        studied_files = sum(1 for f in user_progress[user_id].values() if f)
-        if total_files > 0:
-            percentage = (studied_files / total_files) * 100
-            stats_text = f"\n📊 Прогресс: {studied_files}/{total_files} ({percentage:.1f}%)"
-    
-    buttons = [
-        [InlineKeyboardButton(text="🚀 Приступить к изучению Kali Linux", callback_data=f"open_dir:{home_id}")],
-        [InlineKeyboardButton(text="🔍 Поиск по материалам", callback_data="search")],
-        [InlineKeyboardButton(text="📊 Моя статистика", callback_data="stats")],
+# Маска папки: (младший номер, биты уроков папки и вложенных, сдвинутые на него)
+DirMask = Tuple[int, int]
 
 
-    ]
-    
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+class ContentCatalog:
+    """Неизменяемый снимок дерева папки Информация.
 
+    Строится один раз обходом диска, после чего навигация читает только память.
+    При изменении контента строится новый снимок и подменяется целиком.
+    """
 
-# ===== ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ =====
-path_registry = PathRegistry()
+    def __init__(self, dirs: Dict[str, DirEntry], files: Dict[str, FileEntry]) -> None:
+        self.dirs: Mapping[str, DirEntry] = MappingProxyType(dirs)
+        self.files: Mapping[str, FileEntry] = MappingProxyType(files)
+        self.ordinals: Mapping[str, int] = MappingProxyType(lesson_ordinals.assign(files))
+        self.dir_masks: Mapping[str, DirMask] = MappingProxyType(self._build_masks())
+        paths_by_id, ids_by_path = self._build_callback_ids()
+        self.paths_by_id: Mapping[str, Tuple[str, str]] = MappingProxyType(paths_by_id)
+        self.ids_by_path: Mapping[Tuple[str, str], str] = MappingProxyType(ids_by_path)
+        digest = hashlib.blake2b(digest_size=8)
+        for rel in sorted(dirs):
+            digest.update(f"{rel}/\n".encode("utf-8"))
+        for rel in sorted(files):
+            entry = files[rel]
+            digest.update(f"{rel}\0{entry.size}\0{entry.mtime_ns}\n".encode("utf-8"))
+        self.version: str = digest.hexdigest()
 
-# ===== ОСНОВНОЙ РОУТЕР =====
-router = Router()
+    def _build_callback_ids(self) -> Tuple[Dict[str, Tuple[str, str]], Dict[Tuple[str, str], str]]:
+        """id для callback_data всех папок и файлов с проверкой коллизий.
 
-# ===== ОБРАБОТЧИКИ КОМАНД =====
+        При совпадении хэшей путь, идущий позже в сортировке, получает id с
+        солью; порядок детерминирован, так что все процессы выдают одинаковые id.
+        """
+        paths_by_id: Dict[str, Tuple[str, str]] = {}
+        ids_by_path: Dict[Tuple[str, str], str] = {}
+        keys = [("dir", rel) for rel in self.dirs] + [("file", rel) for rel in self.files]
+        for key in sorted(keys):
+            salt = 0
+            assigned_id = callback_id(*key)
+            while assigned_id in paths_by_id:
+                logging.error("Коллизия id %s: %s и %s", assigned_id, paths_by_id[assigned_id], key)
+                salt += 1
+                assigned_id = callback_id(*key, salt=salt)
+            paths_by_id[assigned_id] = key
+            ids_by_path[key] = assigned_id
+        return paths_by_id, ids_by_path
 
-@router.message(CommandStart())
-async def on_start(message: Message) -> None:
-    ensure_info_root()
-    subscribers.add(message.chat.id)
-    
-    # Инициализируем прогресс пользователя
-    if message.from_user.id not in user_progress:
-        user_progress[message.from_user.id] = {}
-    
-    greeting = (
-        "🎯 <b>Добро пожаловать в Kali Linux Academy!</b>\n\n"
-        "🔥 <i>Ваш персональный гид по кибербезопасности</i>\n\n"
-        "📚 <b>Что вас ждёт:</b>\n"
-        "🟢 <b>Базовый уровень</b> — основы и введение\n"
-        "🟡 <b>Средний уровень</b> — практические атаки\n"
-        "🔴 <b>Продвинутый уровень</b> — экспертные техники\n\n"
-        "✨ <b>Особенности:</b>\n"
-        "• Автоматические уведомления о новых материалах\n"
-        "• Отслеживание прогресса изучения\n"
-        "• Поиск по всем материалам\n"
-        "• Красивое оформление с цветовой индикацией\n\n"
-        "🚀 <b>Начните изучение прямо сейчас!</b>"
-    )
-    await message.answer(greeting, reply_markup=build_home_keyboard(message.from_user.id))
+    def _build_masks(self) -> Dict[str, DirMask]:
+        """Битовые маски уроков для каждой папки (вместе с вложенными)"""
+        nested: Dict[str, List[int]] = {}
+        for rel_dir in sorted(self.dirs, key=_depth, reverse=True):
+            entry = self.dirs[rel_dir]
+            collected = [self.ordinals[rel] for _, rel in entry.files if rel in self.ordinals]
+            for _, child_rel in entry.dirs:
+                collected.extend(nested.get(child_rel, ()))
+            nested[rel_dir] = collected
+        masks: Dict[str, DirMask] = {}
+        for rel_dir, collected in nested.items():
+            if not collected:
+                masks[rel_dir] = (0, 0)
+                continue
+            low = min(collected)
+            bits = bytearray((max(collected) - low) // 8 + 1)
+            for ordinal in collected:
+                offset = ordinal - low
+                bits[offset >> 3] |= 1 << (offset & 7)
+            masks[rel_dir] = (low, int.from_bytes(bits, "little"))
+        return masks
 
-@router.message(Command("stop"))
-async def on_stop(message: Message) -> None:
-    if message.chat.id in subscribers:
-        subscribers.discard(message.chat.id)
-    await message.answer("Вы отписались от уведомлений о новых материалах.")
+    @classmethod
+    def empty(cls) -> "ContentCatalog":
+        root = DirEntry(name=INFO_DIR_NAME, rel_path="", parent=None, dirs=(), files=(), total_files=0)
+        return cls({"": root}, {})
 
+    @classmethod
+    def build(cls, root: Path) -> "ContentCatalog":
+        """Обходит папку на диске и собирает новый снимок"""
+        dirs: Dict[str, DirEntry] = {}
+        files: Dict[str, FileEntry] = {}
+        cls._scan_dir(root, "", None, dirs, files, recursive=True)
+        return cls(cls._with_totals(dirs), files)
 
-@router.message(Command("home"))
-async def on_home(message: Message) -> None:
-    await on_start(message)
+    def rescan(self, root: Path, rel_dirs: Iterable[str]) -> "ContentCatalog":
+        """Новый снимок, в котором перечитаны только указанные папки.
 
-@router.message(Command("search"))
-async def on_search_command(message: Message) -> None:
-    await message.answer(
-        "🔍 <b>Поиск по материалам</b>\n\n"
-        "Отправьте ключевое слово для поиска по всем файлам.\n"
-        "Например: <code>команды</code>, <code>атака</code>, <code>безопасность</code>",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
-        ])
-    )
+        Каждая папка перечитывается на один уровень: её файлы заново
+        проверяются stat, новые подпапки обходятся целиком, исчезнувшие
+        удаляются вместе с содержимым. Остальное дерево берётся из текущего снимка.
+        """
+        dirs = dict(self.dirs)
+        files = dict(self.files)
+        queue = [(_depth(rel), rel) for rel in set(rel_dirs)]
+        heapq.heapify(queue)
+        done: set[str] = set()
+        while queue:
+            _, rel_dir = heapq.heappop(queue)
+            if rel_dir in done or rel_dir not in dirs:
+                # Неизвестные папки обходит перечитанный родитель
+                continue
+            done.add(rel_dir)
+            old = dirs[rel_dir]
+            for _, child_rel in old.files:
+                files.pop(child_rel, None)
+            try:
+                self._scan_dir(root, rel_dir, old.parent, dirs, files, recursive=False)
+            except (FileNotFoundError, NotADirectoryError):
+                _drop_subtree(rel_dir, dirs, files)
+                if old.parent is not None:
+                    done.discard(old.parent)
+                    heapq.heappush(queue, (_depth(old.parent), old.parent))
+                continue
+            current = {child_rel for _, child_rel in dirs[rel_dir].dirs}
+            for _, child_rel in old.dirs:
+                if child_rel not in current:
+                    _drop_subtree(child_rel, dirs, files)
+        if "" not in dirs:
+            return self.empty()
+        return ContentCatalog(self._with_totals(dirs), files)
 
+    @classmethod
+    def _scan_dir(
+        cls,
+        root: Path,
+        rel_dir: str,
+        parent: Optional[str],
+        dirs: Dict[str, DirEntry],
+        files: Dict[str, FileEntry],
+        recursive: bool,
+    ) -> None:
+        abs_dir = os.path.join(root, rel_dir) if rel_dir else str(root)
+        dir_stat = os.stat(abs_dir)
+        dir_items: List[Tuple[str, str]] = []
+        file_items: List[Tuple[str, str]] = []
+        with os.scandir(abs_dir) as it:
+            entries = sorted(it, key=lambda e: e.name.lower())
+        for entry in entries:
+            child_rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if entry.is_symlink():
+                # Ссылки на папки не обходятся (циклы, повтор дерева), на файлы —
+                # только если ведут внутрь папки Информация
+                if entry.is_dir() or not is_inside_root(root, entry.path):
+                    logging.warning("Пропущена символьная ссылка: %s", child_rel)
+                    continue
+            if entry.is_dir():
+                dir_items.append((entry.name, child_rel))
+                if recursive or child_rel not in dirs:
+                    cls._scan_dir(root, child_rel, rel_dir, dirs, files, recursive=True)
+            elif os.path.splitext(entry.name)[1].lower() == ".txt":
+                try:
+                    st = entry.stat()
+                except OSError:
+                    # Битая ссылка или файл удалён во время обхода
+                    continue
+                stem = os.path.splitext(entry.name)[0]
+                file_items.append((stem, child_rel))
+                files[child_rel] = FileEntry(
+                    name=entry.name,
+                    stem=stem,
+                    rel_path=child_rel,
+                    parent=rel_dir,
+                    size=st.st_size,
+                    mtime_ns=st.st_mtime_ns,
+                )
+        dirs[rel_dir] = DirEntry(
+            name=Path(rel_dir).name if rel_dir else INFO_DIR_NAME,
+            rel_path=rel_dir,
+            parent=parent,
+            dirs=tuple(dir_items),
+            files=tuple(file_items),
+            mtime_ns=dir_stat.st_mtime_ns,
+        )
 
-@router.message(Command("stats"))
-async def on_stats_command(message: Message) -> None:
-    user_id = message.from_user.id
-    if user_id not in user_progress:
-        user_progress[user_id] = {}
-    
-    total_files = len(scan_all_txt())
-    studied_files = sum(1 for f in user_progress[user_id].values() if f)
-    
-    if total_files == 0:
-        await message.answer("📊 Пока нет материалов для изучения.")
-        return
-    
-    percentage = (studied_files / total_files) * 100
-    progress_bar = "🟩" * int(percentage / 10) + "⬜" * (10 - int(percentage / 10))
-    
-    stats_text = (
-        f"📊 <b>Ваша статистика изучения</b>\n\n"
-        f"📚 Изучено материалов: <b>{studied_files}/{total_files}</b>\n"
-        f"📈 Прогресс: <b>{percentage:.1f}%</b>\n\n"
-        f"<code>{progress_bar}</code>\n\n"
-    )
-    
-    if studied_files == total_files:
-        stats_text += "🎉 <b>Поздравляем! Вы изучили все материалы!</b>"
-    elif studied_files > 0:
-        remaining = total_files - studied_files
-        stats_text += f"💪 Осталось изучить: <b>{remaining}</b> материалов"
-    else:
-        stats_text += "🚀 Начните изучение с базовых разделов!"
-    
-    await message.answer(stats_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
-    ]))
+    @staticmethod
+    def _with_totals(dirs: Dict[str, DirEntry]) -> Dict[str, DirEntry]:
+        """Пересчитывает число файлов в каждой папке вместе с вложенными"""
+        totals: Dict[str, int] = {}
+        for rel_dir in sorted(dirs, key=_depth, reverse=True):
+            entry = dirs[rel_dir]
+            total = len(entry.files) + sum(totals.get(child_rel, 0) for _, child_rel in entry.dirs)
+            totals[rel_dir] = total
+            if entry.total_files != total:
+                dirs[rel_dir] = replace(entry, total_files=total)
+        return dirs
 
+    def list_dir(self, rel_dir: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        entry = self.dirs.get(rel_dir)
+        if entry is None:
+            raise FileNotFoundError(f"Раздел не найден: {rel_dir}")
+        return list(entry.dirs), list(entry.files)
 
-# ===== ОБРАБОТЧИКИ CALLBACK =====
 
-@router.callback_query(F.data.startswith("open_dir:"))
-async def on_open_dir(callback: CallbackQuery) -> None:
-    try:
-        assigned_id = callback.data.split(":", 1)[1]
-        kind, rel_path = path_registry.resolve(assigned_id)
-        if kind != "dir":
-            await callback.answer("Это не папка", show_alert=False)
-            return
-        
-        user_id = callback.from_user.id
-        kb = build_dir_keyboard(rel_path, user_id)
-        
-        # Красивый заголовок с эмодзи
-        if rel_path:
-            section_name = Path(rel_path).name
-            emoji = get_emoji(section_name)
-            title = f"{emoji} {section_name}\nРаздел: {rel_path}\n———"
-        else:
-            title = f"🎯 Kali Linux Academy\nГлавное меню\n———"
-        
-        # Очищаем ранее отправленные контент-сообщения
-        await clear_user_messages(callback.message.bot, callback.message.chat.id)
-        
-        # Проверяем, изменился ли контент перед редактированием
-        try:
-            await callback.message.edit_text(title, reply_markup=kb)
-        except Exception as edit_error:
-            if "message is not modified" in str(edit_error):
-                # Сообщение не изменилось, просто отвечаем
-                await callback.answer()
-                return
-            else:
-                raise edit_error
-        await callback.answer()
-    except KeyError:
-        await callback.answer("Ссылка устарела — откройте заново", show_alert=True)
-    except Exception as e:
-        logging.exception("Ошибка при открытии папки: %s", e)
-        await callback.answer("Ошибка при открытии", show_alert=True)
+content_catalog: ContentCatalog = ContentCatalog.empty()
 
 
+def set_catalog(catalog: ContentCatalog) -> None:
+    """Атомарно подменяет текущий снимок каталога"""
+    global content_catalog
+    content_catalog = catalog
+    keyboard_cache.clear()
 
 
-@router.callback_query(F.data.startswith("open_file:"))
-async def on_open_file(callback: CallbackQuery) -> None:
-    try:
-        assigned_id = callback.data.split(":", 1)[1]
-        kind, rel_path = path_registry.resolve(assigned_id)
-        if kind != "file":
-            await callback.answer("Это не файл", show_alert=False)
-            return
-        
-        # Отмечаем файл как изученный
-        user_id = callback.from_user.id
-        if user_id not in user_progress:
-            user_progress[user_id] = {}
-        user_progress[user_id][rel_path] = True
-        
-        text = read_text_file(rel_path)
-        parent_dir = str(Path(rel_path).parent.as_posix()) if Path(rel_path).parent.as_posix() != "." else ""
-        kb = build_dir_keyboard(parent_dir, user_id)
-        
-        # Красивый заголовок с эмодзи
-        file_name = Path(rel_path).name
-        emoji = get_emoji(file_name)
-        header = f"✅ {emoji} {file_name}\nРаздел: {str(Path(rel_path).parent.as_posix() or '/')}\n———"
+def parent_of(rel_path: str) -> str:
+    """Относительный путь родительской папки ("" для корня)"""
+    head, _, _ = rel_path.rpartition("/")
+    return head
 
-        # Сразу отвечаем на callback, чтобы избежать timeout
-        await callback.answer("✅ Материал отмечен как изученный!")
 
-        # Очищаем предыдущие контент-сообщения
-        await clear_user_messages(callback.message.bot, callback.message.chat.id)
+# ===== ПРОГРЕСС ПОЛЬЗОВАТЕЛЕЙ =====
 
-        # Обновляем сообщение заголовком и клавиатурой (HTML)
-        await callback.message.edit_text(header, reply_markup=kb)
+if hasattr(int, "bit_count"):
+    def popcount(value: int) -> int:
+        return value.bit_count()
+else:  # Python < 3.10
+    def popcount(value: int) -> int:
+        return bin(value).count("1")
 
-        # Отправляем содержимое .txt файла как простой текст
-        if len(text) > 4000:
-            # Разбиваем длинный текст на части
-            parts = [text[i:i+4000] for i in range(0, len(text), 4000)]
-        else:
-            parts = [text]
-        
-        sent_ids: List[int] = []
-        for part in parts:
+
+class ProgressTracker:
+    """Прогресс пользователей в виде битсетов по номерам уроков.
+
+    Бит N установлен, если изучен урок с номером N из LessonOrdinals.
+    Изученное в папке — popcount пересечения с маской папки из каталога,
+    так что отметка стоит O(1), а запросы по папкам не перебирают файлы.
+    """
+
+    def __init__(self) -> None:
+        self._bits: Dict[int, int] = {}
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._bits
+
+    def __len__(self) -> int:
+        return len(self._bits)
+
+    def ensure_user(self, user_id: int) -> None:
+        self._bits.setdefault(user_id, 0)
+
+    def is_studied(self, user_id: int, rel_path: str) -> bool:
+        ordinal = lesson_ordinals.get(rel_path)
+        return ordinal is not None and bool(self._bits.get(user_id, 0) >> ordinal & 1)
+
+    def mark_studied(self, user_id: int, rel_path: str) -> bool:
+        """Отмечает файл изученным; True, если отметка новая"""
+        ordinal = lesson_ordinals.get(rel_path)
+        if ordinal is None:
+            ordinal = lesson_ordinals.assign([rel_path]).get(rel_path)
+            if ordinal is None:
+                # Ведущий процесс ещё не выдал номер этому уроку
+                return False
+        bits = self._bits.get(user_id, 0)
+        if bits >> ordinal & 1:
+            return False
+        self._bits[user_id] = bits | (1 << ordinal)
+        return True
+
+    def dir_bits(self, user_id: int, rel_dir: str) -> int:
+        """Биты изученных уроков папки (сдвинутые к началу её маски)"""
+        low, mask = content_catalog.dir_masks.get(rel_dir, (0, 0))
+        return (self._bits.get(user_id, 0) >> low) & mask
+
+    def dir_counts(self, user_id: int, rel_dir: str) -> Tuple[int, int]:
+        """(изучено, всего) файлов в папке вместе с вложенными"""
+        entry = content_catalog.dirs.get(rel_dir)
+        total = entry.total_files if entry is not None else 0
+        if user_id not in self._bits:
+            return 0, total
+        return popcount(self.dir_bits(user_id, rel_dir)), total
+
+    def export_bits(self, user_id: int) -> bytes:
+        """Сериализует битсет пользователя (little-endian)"""
+        bits = self._bits.get(user_id, 0)
+        return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+    def import_bits(self, user_id: int, data: bytes) -> None:
+        self._bits[user_id] = int.from_bytes(data, "little")
+
+    def totals(self, user_id: int) -> Tuple[int, int]:
+        return self.dir_counts(user_id, "")
+
+
+progress_tracker = ProgressTracker()
+
+
+# ===== МЕТРИКИ =====
+
+LabelValues = Tuple[str, ...]
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricCounter:
+    """Монотонный счётчик с метками (формат Prometheus)"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value:g}" for key, value in values]
+
+
+class MetricGauge:
+    """Значение, вычисляемое в момент запроса метрик: {метки: значение}.
+
+    С kind="counter" так же отдаются счётчики, которые уже ведёт сам объект
+    (например, попадания LRUCache).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Tuple[str, ...],
+        read: Callable[[], Mapping[LabelValues, float]],
+        kind: str = "gauge",
+    ) -> None:
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.read = read
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {value:g}" for key, value in sorted(self.read().items())
+        ]
+
+
+class MetricHistogram:
+    """Гистограмма с фиксированными корзинами: наблюдение — bisect и два сложения"""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # метки -> [счётчики корзин (последняя — +Inf), сумма]
+        self._values: Dict[LabelValues, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(label_values)
+            if item is None:
+                item = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            item[0][index] += 1
+            item[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        lines: List[str] = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+
+    def register(self, metric: T) -> T:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+handler_seconds = metrics.register(MetricHistogram(
+    "bot_handler_seconds", "Время выполнения обработчиков", ("handler",)))
+handler_errors = metrics.register(MetricCounter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",)))
+file_reads = metrics.register(MetricCounter(
+    "bot_file_reads_total", "Прочитано файлов уроков с диска"))
+file_read_bytes = metrics.register(MetricCounter(
+    "bot_file_read_bytes_total", "Прочитано байт файлов уроков"))
+search_seconds = metrics.register(MetricHistogram(
+    "bot_search_seconds", "Время выполнения поискового запроса по индексу"))
+content_refresh_seconds = metrics.register(MetricHistogram(
+    "bot_content_refresh_seconds", "Обновление каталога и индекса после изменений в папке"))
+api_requests = metrics.register(MetricCounter(
+    "bot_api_requests_total", "Запросы к Bot API по методу и результату", ("method", "status")))
+api_request_seconds = metrics.register(MetricHistogram(
+    "bot_api_request_seconds", "Время запроса к Bot API (одна попытка)", ("method",)))
+loop_lag_seconds = metrics.register(MetricHistogram(
+    "bot_event_loop_lag_seconds", "Опоздание пробуждения событийного цикла"))
+
+
+def register_cache_metrics(caches: Mapping[str, "LRUCache"]) -> None:
+    """Попадания и промахи кэшей: hit ratio = hits / (hits + misses)"""
+    metrics.register(MetricGauge(
+        "bot_cache_hits_total", "Попадания в кэш", ("cache",),
+        lambda: {(name,): cache.hits for name, cache in caches.items()}, kind="counter"))
+    metrics.register(MetricGauge(
+        "bot_cache_misses_total", "Промахи кэша", ("cache",),
+        lambda: {(name,): cache.misses for name, cache in caches.items()}, kind="counter"))
+    metrics.register(MetricGauge(
+        "bot_cache_bytes", "Объём кэша", ("cache",),
+        lambda: {(name,): cache.size_bytes for name, cache in caches.items()}))
+
+
+# Период замера задержки цикла. Он же — пульс для loop_watchdog, поэтому
+# должен быть заметно меньше порога SLOW_CALLBACK_MS
+LOOP_LAG_INTERVAL = 0.1
+
+
+async def sample_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Замер задержки цикла: насколько позже заказанного просыпается sleep.
+
+    Каждое пробуждение заодно служит пульсом для loop_watchdog.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0.0, loop.time() - started - interval))
+        loop_watchdog.beat()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время и ошибки обработчиков (внутренний middleware: имя обработчика уже известно)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        task = asyncio.current_task()
+        active_handlers[task] = (name, type(event).__name__)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+            active_handlers.pop(task, None)
+
+
+# ===== ЗАВИСАНИЯ СОБЫТИЙНОГО ЦИКЛА =====
+
+# Задача обновления -> (обработчик, тип события): кто сейчас выполняется в цикле
+active_handlers: Dict[Optional[asyncio.Task], Tuple[str, str]] = {}
+loop_stalls = metrics.register(MetricCounter(
+    "bot_loop_stalls_total", "Блокировки событийного цикла дольше порога", ("handler",)))
+
+
+@dataclass
+class StallRecord:
+    """Одна блокировка цикла: когда, сколько, кем и где"""
+    started_at: float
+    duration: float
+    handler: str
+    update_type: str
+    stack: str
+
+
+class LoopWatchdog:
+    """Сторожевой поток: ловит блокировки событийного цикла.
+
+    Цикл отмечает пульс (beat) из sample_loop_lag. Если пульса нет дольше
+    threshold, поток снимает стек потока цикла (sys._current_frames), имя
+    выполняющегося обработчика и тип обновления и кладёт запись в кольцевой
+    буфер; длительность дописывается, когда цикл оживает.
+    """
+
+    def __init__(self, threshold: float = 0.25, history: int = 50, beat_interval: float = LOOP_LAG_INTERVAL) -> None:
+        self.threshold = threshold
+        self.beat_interval = beat_interval
+        self.records: "deque[StallRecord]" = deque(maxlen=history)
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def configure(self, threshold: float, history: int) -> None:
+        self.threshold = max(0.01, threshold)
+        self.records = deque(self.records, maxlen=max(1, history))
+
+    def beat(self) -> None:
+        self._beat = time.monotonic()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _capture(self, blocked: float) -> StallRecord:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=25)) if frame is not None else ""
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        handler, update_type = active_handlers.get(task, ("—", "—"))
+        return StallRecord(time.time() - blocked, blocked, handler, update_type, stack)
+
+    def _watch(self) -> None:
+        current: Optional[StallRecord] = None
+        stalled_since = 0.0
+        while not self._stop.wait(max(0.01, self.threshold / 4)):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.beat_interval
+            if blocked > self.threshold:
+                if current is None or beat != stalled_since:
+                    current = self._capture(blocked)
+                    stalled_since = beat
+                    self.records.append(current)
+                    loop_stalls.inc(current.handler)
+                    logging.warning(
+                        "Событийный цикл заблокирован %.0f мс: %s (%s)",
+                        blocked * 1000, current.handler, current.update_type,
+                    )
+                current.duration = blocked
+                self.max_lag = max(self.max_lag, blocked)
+            else:
+                current = None
+
+    def report(self, limit: int = 5, stack_lines: int = 8) -> str:
+        """Последние блокировки для админ-команды"""
+        records = list(self.records)[-limit:]
+        lines = [
+            f"Порог: {self.threshold * 1000:.0f} мс, записей: {len(self.records)}, "
+            f"максимум: {self.max_lag * 1000:.0f} мс"
+        ]
+        for record in reversed(records):
+            when = time.strftime("%H:%M:%S", time.localtime(record.started_at))
+            stack = "\n".join(record.stack.rstrip().splitlines()[-stack_lines:])
+            lines.append(
+                f"\n{when} — {record.duration * 1000:.0f} мс, {record.handler} ({record.update_type})\n{stack}"
+            )
+        return "\n".join(lines)
+
+
+loop_watchdog = LoopWatchdog()
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Локальный HTTP-сервер с /metrics"""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info("Метрики: http://%s:%s/metrics", host, port)
+    return runner
+
+
+# ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
+
+def ensure_info_root() -> None:
+    """Проверяет существование папки с информацией"""
+    if not INFO_ROOT.exists() or not INFO_ROOT.is_dir():
+        raise FileNotFoundError(
+            f"Папка '{INFO_DIR_NAME}' не найдена рядом с файлом: {APP_ROOT}"
+        )
+
+
+def list_dir(rel_dir: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """Получает список папок и .txt файлов в указанной директории (из снимка каталога)"""
+    return content_catalog.list_dir(rel_dir)
+
+
+def read_text_file(rel_path: str) -> str:
+    """Читает содержимое .txt файла"""
+    file_path = (INFO_ROOT / rel_path).resolve()
+    if INFO_ROOT not in file_path.parents and file_path != INFO_ROOT:
+        raise PermissionError("Выход за пределы корневой папки Информация запрещён")
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+        file_read_bytes.inc(amount=os.fstat(f.fileno()).st_size)
+    file_reads.inc()
+    return text
+
+
+
+
+
+
+
+
+# ===== ПОИСКОВЫЙ ИНДЕКС =====
+
+TOKEN_RE = re.compile(r"\w+")
+PHRASE_RE = re.compile(r'"([^"]+)"|«([^»]+)»')
+CYRILLIC_RE = re.compile(r"[а-яё]")
+
+# Окончания для облегчённого стемминга, длинные проверяются первыми.
+# «ому»/«ему» нет: иначе «систему» теряла бы «ем» и расходилась с «система»
+RU_ENDINGS = sorted({
+    "иями", "ями", "ами", "иях", "ях", "ах", "ов", "ев", "ей", "ий", "ый", "ой", "ая", "яя",
+    "ое", "ее", "ые", "ие", "ом", "ем", "ам", "ям", "ую", "юю", "их", "ых", "ым", "им",
+    "ого", "его", "ыми", "ими", "ться", "тся", "ешь", "ет", "ют", "ут", "ит",
+    "ат", "ят", "ать", "ять", "ить", "еть", "ыть",
+    "ия", "ию", "ии", "ией", "ием", "иям",
+    "ость", "ости", "остью", "остей", "остям", "остями", "остях",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+}, key=len, reverse=True)
+EN_SUFFIXES = ("ations", "ation", "ments", "ment", "ings", "ing", "ies", "sses", "ed", "es", "ly", "s")
+MIN_STEM = 3
+FILE_TITLE_BOOST = 2.0  # слово запроса в имени файла
+DIR_TITLE_BOOST = 1.0  # слово запроса в названии папки
+PREFIX_EXPANSION_LIMIT = 64
+
+
+@functools.lru_cache(maxsize=65536)
+def stem(term: str) -> str:
+    """Основа слова: отбрасывает типичное окончание (русское или английское)"""
+    term = term.lower().replace("ё", "е")
+    if CYRILLIC_RE.search(term):
+        for ending in RU_ENDINGS:
+            if term.endswith(ending) and len(term) - len(ending) >= MIN_STEM:
+                return term[:-len(ending)]
+        return term
+    if not term.isascii() or not term.isalpha():
+        return term
+    for suffix in EN_SUFFIXES:
+        if not term.endswith(suffix) or len(term) - len(suffix) < MIN_STEM:
+            continue
+        if suffix == "ies":
+            return term[:-3] + "y"
+        if suffix == "sses":
+            return term[:-2]
+        if suffix == "s" and term.endswith(("ss", "us", "is")):
+            return term
+        base = term[:-len(suffix)]
+        # scanning -> scan, stopped -> stop
+        if suffix in ("ing", "ed") and len(base) > MIN_STEM and base[-1] == base[-2] and base[-1] not in "lsz":
+            base = base[:-1]
+        return base
+    return term
+
+
+def title_terms(rel_path: str) -> Dict[str, float]:
+    """Основы слов из имени файла и названий папок с весами для буста"""
+    path = Path(rel_path)
+    weights: Dict[str, float] = {}
+    for part in path.parent.parts:
+        for token in TOKEN_RE.findall(part):
+            weights[stem(token)] = DIR_TITLE_BOOST
+    for token in TOKEN_RE.findall(path.stem):
+        weights[stem(token)] = FILE_TITLE_BOOST
+    return weights
+
+
+# Раскладки клавиатуры: один и тот же ряд клавиш в ЙЦУКЕН и QWERTY
+_RU_KEYS = "ёйцукенгшщзхъфывапролджэячсмитьбю"
+_EN_KEYS = "`qwertyuiop[]asdfghjkl;'zxcvbnm,."
+LAYOUT_SWAP = str.maketrans(_RU_KEYS + _EN_KEYS, _EN_KEYS + _RU_KEYS)
+# Похожие по начертанию буквы: «nmар» с кириллическими а и р -> nmap
+_CYR_LOOKALIKE = "аеорсухкмтвн"
+_LAT_LOOKALIKE = "aeopcyxkmtbh"
+TO_LATIN = str.maketrans(_CYR_LOOKALIKE, _LAT_LOOKALIKE)
+TO_CYRILLIC = str.maketrans(_LAT_LOOKALIKE, _CYR_LOOKALIKE)
+FUZZY_MIN_LENGTH = 4
+FUZZY_MIN_SIMILARITY = 0.5
+
+
+def fold_mixed_script(token: str) -> str:
+    """Слово из смеси кириллицы и латиницы приводится к преобладающему алфавиту"""
+    cyrillic = len(CYRILLIC_RE.findall(token))
+    latin = sum(1 for ch in token if "a" <= ch <= "z")
+    if not cyrillic or not latin:
+        return token
+    return token.translate(TO_CYRILLIC if cyrillic > latin else TO_LATIN)
+
+
+def trigrams(term: str) -> set[str]:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Расстояние Дамерау–Левенштейна (перестановка соседних букв — одна правка)"""
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class TrigramIndex:
+    """Триграммы слов словаря для поиска с опечатками.
+
+    trigram -> {слово}. Кандидаты — слова с наибольшим числом общих
+    триграмм; окончательно они сравниваются по сходству триграмм и
+    расстоянию редактирования, поэтому опечатка стоит десятков сравнений
+    коротких слов, а не прохода по файлам.
+    """
+
+    def __init__(self, candidates: int = 50) -> None:
+        self.candidates = candidates
+        self._terms: Dict[str, set[str]] = {}
+
+    def add(self, term: str) -> None:
+        for gram in trigrams(term):
+            self._terms.setdefault(gram, set()).add(term)
+
+    def remove(self, term: str) -> None:
+        for gram in trigrams(term):
+            terms = self._terms.get(gram)
+            if terms is None:
+                continue
+            terms.discard(term)
+            if not terms:
+                del self._terms[gram]
+
+    def similar(self, term: str, limit: int = 3) -> List[Tuple[str, float]]:
+        """До limit слов словаря, похожих на term, со сходством от 0 до 1"""
+        grams = trigrams(term)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._terms.get(gram, ()):
+                if abs(len(candidate) - len(term)) <= 2:
+                    shared[candidate] = shared.get(candidate, 0) + 1
+        best = heapq.nsmallest(self.candidates, shared.items(), key=lambda item: (-item[1], item[0]))
+        scored: List[Tuple[str, float]] = []
+        for candidate, common in best:
+            jaccard = common / (len(grams) + len(trigrams(candidate)) - common)
+            edits = 1 - edit_distance(term, candidate) / max(len(term), len(candidate))
+            similarity = max(jaccard, edits)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((candidate, similarity))
+        return heapq.nsmallest(limit, scored, key=lambda item: (-item[1], item[0]))
+
+
+@dataclass
+class IndexedDocument:
+    """Документ в индексе: текст, смещения токенов и начала строк"""
+    rel_path: str
+    text: str
+    token_offsets: List[int]
+    line_starts: List[int]
+
+
+@dataclass
+class SearchHit:
+    rel_path: str
+    score: float
+    contexts: List[str]
+
+
+@dataclass
+class SearchResults:
+    """Лучшие совпадения и общее число найденных документов"""
+    total: int
+    hits: List[SearchHit]
+
+
+class SearchIndex:
+    """Инвертированный индекс по основам слов с ранжированием BM25.
+
+    stem -> {rel_path -> [номер токена в документе]}: длина списка — частота
+    термина, позиции нужны для фраз в кавычках и контекста. Слова из имени
+    файла и названий папок хранятся отдельно и добавляют к оценке буст.
+    Запрос трогает только постинги своих основ, лучшие k документов
+    выбираются кучей.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Dict[str, List[int]]] = {}
+        self._titles: Dict[str, Dict[str, float]] = {}
+        self._docs: Dict[str, IndexedDocument] = {}
+        self._total_tokens = 0
+        self._vocab: List[str] = []
+        self._vocab_dirty = False
+        self._trigrams = TrigramIndex()
+        # Поиск может идти в отдельном потоке, изменения — в событийном цикле
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, rel_path: str) -> bool:
+        return rel_path in self._docs
+
+    def add_document(self, rel_path: str, text: str) -> None:
+        """Индексирует документ (повторная индексация заменяет старую версию)"""
+        with self._lock:
+            self._add_document(rel_path, text)
+
+    def _add_document(self, rel_path: str, text: str) -> None:
+        if rel_path in self._docs:
+            self._remove_document(rel_path)
+        token_offsets: List[int] = []
+        for position, match in enumerate(TOKEN_RE.finditer(text)):
+            token_offsets.append(match.start())
+            term = stem(match.group())
+            if term not in self._postings and term not in self._titles:
+                self._trigrams.add(term)
+            self._postings.setdefault(term, {}).setdefault(rel_path, []).append(position)
+        for term, weight in title_terms(rel_path).items():
+            if term not in self._postings and term not in self._titles:
+                self._trigrams.add(term)
+            self._titles.setdefault(term, {})[rel_path] = weight
+        line_starts = [0]
+        line_starts.extend(m.end() for m in re.finditer("\n", text))
+        self._docs[rel_path] = IndexedDocument(rel_path, text, token_offsets, line_starts)
+        self._total_tokens += len(token_offsets)
+        self._vocab_dirty = True
+
+    def remove_document(self, rel_path: str) -> None:
+        with self._lock:
+            self._remove_document(rel_path)
+
+    def _remove_document(self, rel_path: str) -> None:
+        doc = self._docs.pop(rel_path, None)
+        if doc is None:
+            return
+        self._total_tokens -= len(doc.token_offsets)
+        for table, terms in (
+            (self._postings, {stem(t) for t in TOKEN_RE.findall(doc.text)}),
+            (self._titles, title_terms(rel_path).keys()),
+        ):
+            for term in terms:
+                postings = table.get(term)
+                if postings is None:
+                    continue
+                postings.pop(rel_path, None)
+                if not postings:
+                    del table[term]
+                    if term not in self._postings and term not in self._titles:
+                        self._trigrams.remove(term)
+        self._vocab_dirty = True
+
+    def _terms_with_prefix(self, prefix: str) -> List[str]:
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings.keys() | self._titles.keys())
+            self._vocab_dirty = False
+        start = bisect.bisect_left(self._vocab, prefix)
+        terms: List[str] = []
+        for term in self._vocab[start:]:
+            if not term.startswith(prefix) or len(terms) >= PREFIX_EXPANSION_LIMIT:
+                break
+            terms.append(term)
+        return terms
+
+    def _idf(self, term: str) -> float:
+        df = max(len(self._postings.get(term, ())), len(self._titles.get(term, ())))
+        return math.log(1 + (len(self._docs) - df + 0.5) / (df + 0.5))
+
+    def _term_scores(self, term: str) -> Dict[str, float]:
+        """BM25-вклад основы в каждый документ, где она встречается, плюс буст заголовка"""
+        idf = self._idf(term)
+        avg_len = self._total_tokens / len(self._docs) if self._docs else 1.0
+        scores: Dict[str, float] = {}
+        for rel_path, positions in self._postings.get(term, {}).items():
+            tf = len(positions)
+            norm = self.K1 * (1 - self.B + self.B * len(self._docs[rel_path].token_offsets) / max(avg_len, 1.0))
+            scores[rel_path] = idf * tf * (self.K1 + 1) / (tf + norm)
+        for rel_path, boost in self._titles.get(term, {}).items():
+            scores[rel_path] = scores.get(rel_path, 0.0) + idf * boost
+        return scores
+
+    def search(self, query: str, limit: int = 5, max_contexts: int = 3) -> SearchResults:
+        """Лучшие limit документов по BM25; последнее слово запроса — префикс.
+
+        Слова в кавычках ("kali linux" или «kali linux») должны идти в документе
+        подряд. Если точных совпадений нет, запрос пробуется в другой раскладке
+        (ghbdtn -> привет), затем с исправлением опечаток по триграммам.
+        При равной оценке порядок определяется путём, поэтому выдача стабильна.
+        """
+        started = time.perf_counter()
+        query = query.lower()
+        swapped = query.translate(LAYOUT_SWAP)
+        results = SearchResults(0, [])
+        with self._lock:
+            for text, fuzzy in ((query, False), (swapped, False), (query, True), (swapped, True)):
+                results = self._search(text, limit, max_contexts, fuzzy)
+                if results.total:
+                    break
+        search_seconds.observe(time.perf_counter() - started)
+        return results
+
+    def _search(self, query: str, limit: int, max_contexts: int, fuzzy: bool) -> SearchResults:
+        tokens = [fold_mixed_script(token) for token in TOKEN_RE.findall(query)]
+        if not tokens or not self._docs:
+            return SearchResults(0, [])
+
+        scores: Dict[str, float] = {}
+        matched: List[str] = []
+        for i, token in enumerate(tokens):
+            base = stem(token)
+            # (основа, вес): точная основа, продолжения последнего слова или похожие слова
+            terms = [(base, 1.0)]
+            if i == len(tokens) - 1 and len(token) >= MIN_STEM:
+                terms += [(term, 1.0) for term in self._terms_with_prefix(base) if term != base]
+            if fuzzy and len(token) >= FUZZY_MIN_LENGTH and not any(
+                    term in self._postings or term in self._titles for term, _ in terms):
+                terms = self._trigrams.similar(base)
+            # Из нескольких вариантов одного слова в документе засчитывается лучший
+            best: Dict[str, float] = {}
+            for term, weight in terms:
+                term_scores = self._term_scores(term)
+                if term_scores:
+                    matched.append(term)
+                for rel_path, score in term_scores.items():
+                    if score * weight > best.get(rel_path, 0.0):
+                        best[rel_path] = score * weight
+            for rel_path, score in best.items():
+                scores[rel_path] = scores.get(rel_path, 0.0) + score
+
+        phrases = [
+            [stem(fold_mixed_script(token)) for token in TOKEN_RE.findall(quoted or guillemets)]
+            for quoted, guillemets in PHRASE_RE.findall(query)
+        ]
+        phrases = [terms for terms in phrases if len(terms) > 1]
+        if phrases:
+            scores = {
+                rel_path: score for rel_path, score in scores.items()
+                if all(self._has_phrase(rel_path, terms) for terms in phrases)
+            }
+
+        top = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        hits = [
+            SearchHit(rel_path, score, self._contexts(rel_path, matched, max_contexts))
+            for rel_path, score in top
+        ]
+        return SearchResults(len(scores), hits)
+
+    def _has_phrase(self, rel_path: str, terms: List[str]) -> bool:
+        """Основы terms стоят в документе подряд (по позициям токенов)"""
+        positions = [self._postings.get(term, {}).get(rel_path) for term in terms]
+        if not all(positions):
+            return False
+        following = [set(p) for p in positions[1:]]
+        return any(
+            all(start + offset in later for offset, later in enumerate(following, start=1))
+            for start in positions[0]
+        )
+
+    def _contexts(self, rel_path: str, terms: List[str], limit: int) -> List[str]:
+        """Строка с совпадением и по одной соседней строке, не длиннее 200 символов"""
+        doc = self._docs[rel_path]
+        line_starts = doc.line_starts
+        positions = sorted({p for term in terms for p in self._postings.get(term, {}).get(rel_path, ())})
+        contexts: List[str] = []
+        seen_lines: set[int] = set()
+        for position in positions:
+            line_no = bisect.bisect_right(line_starts, doc.token_offsets[position]) - 1
+            if line_no in seen_lines:
+                continue
+            seen_lines.add(line_no)
+            first = max(0, line_no - 1)
+            last = min(len(line_starts) - 1, line_no + 1)
+            end = line_starts[last + 1] - 1 if last + 1 < len(line_starts) else len(doc.text)
+            context = doc.text[line_starts[first]:end]
+            contexts.append(context[:200] + "..." if len(context) > 200 else context)
+            if len(contexts) >= limit:
+                break
+        return contexts
+
+
+search_index = SearchIndex()
+
+
+def load_index_changes(old: ContentCatalog, new: ContentCatalog) -> Tuple[List[str], Dict[str, str]]:
+    """Читает с диска только добавленные и изменённые файлы.
+
+    Возвращает (удалённые пути, {путь: текст}); выполняется в пуле ввода-вывода.
+    """
+    removed = [rel for rel in old.files.keys() - new.files.keys() if rel in search_index]
+    texts: Dict[str, str] = {}
+    for rel, entry in new.files.items():
+        previous = old.files.get(rel)
+        if previous is not None and rel in search_index and (
+            previous.size, previous.mtime_ns) == (entry.size, entry.mtime_ns):
+            continue
+        try:
+            texts[rel] = read_text_file(rel)
+        except Exception as e:
+            logging.warning(f"Ошибка индексации файла {rel}: {e}")
+            removed.append(rel)
+    return removed, texts
+
+
+def apply_index_changes(removed: List[str], texts: Dict[str, str]) -> None:
+    """Применяет прочитанные изменения к индексу (в потоке событийного цикла)"""
+    for rel in removed:
+        search_index.remove_document(rel)
+    for rel, text in texts.items():
+        search_index.add_document(rel, text)
+
+
+# ===== ПУЛ ДЛЯ ФАЙЛОВОГО ВВОДА-ВЫВОДА =====
+
+class IOQueueFull(RuntimeError):
+    """Очередь пула ввода-вывода переполнена"""
+
+
+@dataclass
+class IOStats:
+    """Счётчики пула: сколько задач ждали в очереди и сколько выполнялись"""
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    wait_seconds: float = 0.0
+    exec_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+class IOExecutor:
+    """Ограниченный пул потоков для всех обращений к диску.
+
+    Событийный цикл только ждёт результат; если задач в очереди больше
+    max_pending, новая задача сразу отклоняется с IOQueueFull.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 64) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.stats = IOStats()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def configure(self, max_workers: int, max_pending: int) -> None:
+        """Меняет размеры пула (до первого использования или после shutdown)"""
+        self.shutdown()
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+
+    def _ensure_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="io")
+        return self._pool
+
+    def _record(self, waited: float, executed: float, ok: bool) -> None:
+        with self._lock:
+            self.stats.completed += 1
+            if not ok:
+                self.stats.failed += 1
+            self.stats.wait_seconds += waited
+            self.stats.exec_seconds += executed
+            if waited > self.stats.max_wait_seconds:
+                self.stats.max_wait_seconds = waited
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Выполняет блокирующую функцию в пуле и возвращает её результат"""
+        if self._pending >= self.max_pending:
+            self.stats.rejected += 1
+            raise IOQueueFull(f"Очередь ввода-вывода переполнена ({self._pending})")
+        self._pending += 1
+        self.stats.submitted += 1
+        submitted_at = time.perf_counter()
+
+        def job() -> T:
+            started_at = time.perf_counter()
+            ok = False
+            try:
+                result = fn(*args)
+                ok = True
+                return result
+            finally:
+                self._record(started_at - submitted_at, time.perf_counter() - started_at, ok)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._ensure_pool(), job)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+io_executor = IOExecutor()
+metrics.register(MetricGauge(
+    "bot_io_pending", "Задач в очереди пула ввода-вывода", (), lambda: {(): io_executor.pending}))
+
+
+async def refresh_content(changed_dirs: Optional[Iterable[str]] = None) -> Tuple[ContentCatalog, ContentCatalog]:
+    """Перестраивает снимок каталога и индекс вне событийного цикла.
+
+    Если changed_dirs задан, перечитываются только эти папки, иначе всё дерево.
+    Возвращает (старый снимок, новый снимок).
+    """
+    old = content_catalog
+    if changed_dirs is None:
+        new = await io_executor.run(ContentCatalog.build, INFO_ROOT)
+    else:
+        new = await io_executor.run(old.rescan, INFO_ROOT, changed_dirs)
+    if new.version != old.version:
+        removed, texts = await io_executor.run(load_index_changes, old, new)
+        apply_index_changes(removed, texts)
+        set_catalog(new)
+    return old, new
+
+
+
+
+# ===== ОЧИСТКА СООБЩЕНИЙ =====
+
+class MessageCleanupQueue:
+    """Фоновое удаление контент-сообщений пачками через deleteMessages.
+
+    Навигация только ставит id в очередь и не ждёт удаления. Сообщения
+    одного чата удаляются пачками до 100 id за вызов; при временной ошибке
+    пачка повторяется с экспоненциальной задержкой (до max_attempts раз).
+    """
+
+    BATCH_LIMIT = 100
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.deleted = 0
+        self.dropped = 0
+        self._pending: Dict[int, List[int]] = {}
+        self._retries: List[Tuple[float, int, int, List[int]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, bot: Bot, chat_id: int, message_ids: Iterable[int]) -> None:
+        """Ставит сообщения чата на удаление (фоновая задача стартует при первом вызове)"""
+        queued = self._pending.setdefault(chat_id, [])
+        queued.extend(mid for mid in message_ids if mid not in queued)
+        if self._task is None:
+            self.start(bot)
+        self._wakeup.set()
+
+    def start(self, bot: Bot) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run(bot))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self, bot: Bot) -> None:
+        api_lane.set(LANE_CLEANUP)
+        while True:
+            timeout = None
+            if self._retries:
+                timeout = max(0.0, self._retries[0][0] - time.monotonic())
+            if not self._pending:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+            batches: List[Tuple[int, int, List[int]]] = []
+            now = time.monotonic()
+            while self._retries and self._retries[0][0] <= now:
+                _, attempt, chat_id, ids = heapq.heappop(self._retries)
+                batches.append((attempt, chat_id, ids))
+            pending, self._pending = self._pending, {}
+            for chat_id, ids in pending.items():
+                for i in range(0, len(ids), self.BATCH_LIMIT):
+                    batches.append((0, chat_id, ids[i:i + self.BATCH_LIMIT]))
+
+            for attempt, chat_id, ids in batches:
+                await self._delete_batch(bot, chat_id, ids, attempt)
+
+    async def _delete_batch(self, bot: Bot, chat_id: int, ids: List[int], attempt: int) -> None:
+        try:
+            await bot.delete_messages(chat_id, ids)
+            self.deleted += len(ids)
+            return
+        except TelegramRetryAfter as e:
+            delay = float(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            delay = self.base_delay * 2 ** attempt
+            logging.warning("Временная ошибка удаления сообщений в %s: %s", chat_id, e)
+        except Exception as e:
+            # Сообщения уже удалены пользователем или слишком старые — повтор не поможет
+            logging.debug("Не удалось удалить сообщения в %s: %s", chat_id, e)
+            self.dropped += len(ids)
+            return
+        if attempt + 1 >= self.max_attempts:
+            logging.warning("Удаление %d сообщений в %s прекращено после %d попыток", len(ids), chat_id, attempt + 1)
+            self.dropped += len(ids)
+            return
+        heapq.heappush(self._retries, (time.monotonic() + delay, attempt + 1, chat_id, ids))
+
+
+cleanup_queue = MessageCleanupQueue()
+
+
+async def clear_user_messages(bot: Bot, chat_id: int) -> None:
+    """Ставит предыдущие сообщения с контентом в очередь на удаление при переходе"""
+    ids = user_content_messages.get(chat_id) or []
+    if not ids:
+        return
+    cleanup_queue.schedule(bot, chat_id, ids)
+    user_content_messages[chat_id] = []
+    state_writer.mark_messages(chat_id)
+
+
+
+# ===== ХРАНИЛИЩЕ СОСТОЯНИЯ =====
+
+@dataclass
+class StateBatch:
+    """Пачка изменений состояния для одной групповой записи"""
+    subscribers: Dict[int, bool] = field(default_factory=dict)
+    progress: Dict[int, bytes] = field(default_factory=dict)
+    content_messages: Dict[int, List[int]] = field(default_factory=dict)
+    ordinals: Dict[str, int] = field(default_factory=dict)
+    meta: Dict[str, Optional[str]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.subscribers or self.progress or self.content_messages or self.ordinals or self.meta)
+
+
+def merge_progress_bits(stored: Optional[bytes], update: bytes) -> bytes:
+    """Объединение битсетов прогресса (OR): отметки только добавляются"""
+    if not stored:
+        return update
+    bits = int.from_bytes(stored, "little") | int.from_bytes(update, "little")
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+@dataclass
+class StateSnapshot:
+    """Полное состояние, прочитанное из хранилища при запуске"""
+    subscribers: set[int] = field(default_factory=set)
+    progress: Dict[int, bytes] = field(default_factory=dict)
+    content_messages: Dict[int, List[int]] = field(default_factory=dict)
+    ordinals: Dict[str, int] = field(default_factory=dict)
+    meta: Dict[str, str] = field(default_factory=dict)
+
+    def apply(self, batch: StateBatch) -> None:
+        for chat_id, subscribed in batch.subscribers.items():
+            if subscribed:
+                self.subscribers.add(chat_id)
+            else:
+                self.subscribers.discard(chat_id)
+        for user_id, bits in batch.progress.items():
+            self.progress[user_id] = merge_progress_bits(self.progress.get(user_id), bits)
+        for chat_id, ids in batch.content_messages.items():
+            if ids:
+                self.content_messages[chat_id] = list(ids)
+            else:
+                self.content_messages.pop(chat_id, None)
+        self.ordinals.update(batch.ordinals)
+        for key, value in batch.meta.items():
+            if value is None:
+                self.meta.pop(key, None)
+            else:
+                self.meta[key] = value
+
+
+class StateStore:
+    """Хранилище подписчиков, прогресса и служебных данных.
+
+    Методы блокирующие и вызываются из пула ввода-вывода.
+    """
+
+    def load(self) -> StateSnapshot:
+        return StateSnapshot()
+
+    def write_batch(self, batch: StateBatch) -> None:
+        pass
+
+    def load_subscribers(self) -> set[int]:
+        return set()
+
+    def load_ordinals(self) -> Dict[str, int]:
+        return {}
+
+    def read_meta(self, key: str) -> Optional[str]:
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Ничего не сохраняет: состояние живёт до перезапуска"""
+
+
+class SQLiteStateStore(StateStore):
+    """SQLite (WAL); каждая пачка изменений — одна транзакция.
+
+    Файл можно открыть из нескольких процессов: писатели ждут друг друга
+    до busy_timeout, читатели WAL не блокируются. Прогресс сливается с
+    записанным (OR) внутри той же транзакции, так что процесс со старым
+    битсетом не стирает отметки, сделанные другим.
+    """
+
+    def __init__(self, path: Path, busy_timeout: float = 30.0) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS subscribers (chat_id INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS progress (user_id INTEGER PRIMARY KEY, bits BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS content_messages (chat_id INTEGER PRIMARY KEY, ids TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS ordinals (rel_path TEXT PRIMARY KEY, ordinal INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        self._conn.commit()
+
+    def load(self) -> StateSnapshot:
+        with self._lock:
+            snapshot = StateSnapshot()
+            snapshot.subscribers = {row[0] for row in self._conn.execute("SELECT chat_id FROM subscribers")}
+            snapshot.progress = dict(self._conn.execute("SELECT user_id, bits FROM progress"))
+            snapshot.content_messages = {
+                chat_id: json.loads(ids)
+                for chat_id, ids in self._conn.execute("SELECT chat_id, ids FROM content_messages")
+            }
+            snapshot.ordinals = dict(self._conn.execute("SELECT rel_path, ordinal FROM ordinals"))
+            snapshot.meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+            return snapshot
+
+    def write_batch(self, batch: StateBatch) -> None:
+        with self._lock, self._conn:
+            # Блокировка записи сразу: чтение прогресса и запись — одна атомарная операция
+            self._conn.execute("BEGIN IMMEDIATE")
+            progress = list(batch.progress.items())
+            stored: Dict[int, bytes] = {}
+            for start in range(0, len(progress), 500):
+                chunk = [user_id for user_id, _ in progress[start:start + 500]]
+                stored.update(self._conn.execute(
+                    f"SELECT user_id, bits FROM progress WHERE user_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO subscribers (chat_id) VALUES (?)",
+                [(chat_id,) for chat_id, subscribed in batch.subscribers.items() if subscribed],
+            )
+            self._conn.executemany(
+                "DELETE FROM subscribers WHERE chat_id = ?",
+                [(chat_id,) for chat_id, subscribed in batch.subscribers.items() if not subscribed],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO progress (user_id, bits) VALUES (?, ?)",
+                [(user_id, merge_progress_bits(stored.get(user_id), bits)) for user_id, bits in progress],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO content_messages (chat_id, ids) VALUES (?, ?)",
+                [(chat_id, json.dumps(ids)) for chat_id, ids in batch.content_messages.items() if ids],
+            )
+            self._conn.executemany(
+                "DELETE FROM content_messages WHERE chat_id = ?",
+                [(chat_id,) for chat_id, ids in batch.content_messages.items() if not ids],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ordinals (rel_path, ordinal) VALUES (?, ?)",
+                list(batch.ordinals.items()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(key, value) for key, value in batch.meta.items() if value is not None],
+            )
+            self._conn.executemany(
+                "DELETE FROM meta WHERE key = ?",
+                [(key,) for key, value in batch.meta.items() if value is None],
+            )
+
+    def load_subscribers(self) -> set[int]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT chat_id FROM subscribers")}
+
+    def load_ordinals(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT rel_path, ordinal FROM ordinals"))
+
+    def read_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JournalStateStore(StateStore):
+    """Журнал JSON-строк: одна строка на пачку, fsync на каждую запись.
+
+    При загрузке журнал проигрывается; когда записей становится больше
+    compact_after, журнал переписывается одной строкой с полным состоянием.
+    """
+
+    def __init__(self, path: Path, compact_after: int = 10000) -> None:
+        self.path = path
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._state = StateSnapshot()
+        self._records = 0
+        self._file = None
+
+    @staticmethod
+    def _encode(batch: StateBatch) -> str:
+        return json.dumps({
+            "s": {str(k): v for k, v in batch.subscribers.items()},
+            "p": {str(k): v.hex() for k, v in batch.progress.items()},
+            "m": {str(k): v for k, v in batch.content_messages.items()},
+            "o": batch.ordinals,
+            "k": batch.meta,
+        }, ensure_ascii=False)
+
+    @staticmethod
+    def _decode(line: str) -> StateBatch:
+        record = json.loads(line)
+        return StateBatch(
+            subscribers={int(k): bool(v) for k, v in record.get("s", {}).items()},
+            progress={int(k): bytes.fromhex(v) for k, v in record.get("p", {}).items()},
+            content_messages={int(k): list(v) for k, v in record.get("m", {}).items()},
+            ordinals={k: int(v) for k, v in record.get("o", {}).items()},
+            meta=dict(record.get("k", {})),
+        )
+
+    def load(self) -> StateSnapshot:
+        with self._lock:
+            self._state = StateSnapshot()
+            self._records = 0
+            if self.path.exists():
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            self._state.apply(self._decode(line))
+                        except ValueError:
+                            # Недописанная последняя строка после аварийной остановки
+                            logging.warning("Пропущена повреждённая запись журнала %s", self.path)
+                            continue
+                        self._records += 1
+            self._compact()
+            return StateSnapshot(
+                subscribers=set(self._state.subscribers),
+                progress=dict(self._state.progress),
+                content_messages={k: list(v) for k, v in self._state.content_messages.items()},
+                ordinals=dict(self._state.ordinals),
+                meta=dict(self._state.meta),
+            )
+
+    def _compact(self) -> None:
+        full = StateBatch(
+            subscribers={chat_id: True for chat_id in self._state.subscribers},
+            progress=self._state.progress,
+            content_messages=self._state.content_messages,
+            ordinals=self._state.ordinals,
+            meta=dict(self._state.meta),
+        )
+        if self._file is not None:
+            self._file.close()
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self._encode(full) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._records = 1
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write_batch(self, batch: StateBatch) -> None:
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(self._encode(batch) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._state.apply(batch)
+            self._records += 1
+            if self._records > self.compact_after:
+                self._compact()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def open_state_store(backend: str, path: Optional[str]) -> StateStore:
+    """Создаёт хранилище по имени бэкенда: sqlite, journal или memory"""
+    backend = (backend or "sqlite").strip().lower()
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore(Path(path) if path else APP_ROOT / "state.sqlite3")
+    if backend == "journal":
+        return JournalStateStore(Path(path) if path else APP_ROOT / "state.journal")
+    raise RuntimeError(f"Неизвестный STATE_BACKEND: {backend}")
+
+
+class StateWriter:
+    """Отложенная запись состояния (write-behind).
+
+    Обработчики только помечают изменившиеся id; раз в flush_interval секунд
+    (или раньше, если помеченных больше max_dirty) текущие значения
+    собираются в одну пачку и пишутся в хранилище одной групповой записью.
+    """
+
+    def __init__(self, store: StateStore, flush_interval: float = 2.0, max_dirty: int = 1000) -> None:
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self._subscribers: Dict[int, bool] = {}
+        self._progress: set[int] = set()
+        self._messages: set[int] = set()
+        self._meta: Dict[str, Optional[str]] = {}
+        self._ordinals_saved = 0
+        self.meta: Dict[str, str] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def configure(self, store: StateStore, flush_interval: float, max_dirty: int) -> None:
+        self.store = store
+        self.flush_interval = max(0.1, flush_interval)
+        self.max_dirty = max(1, max_dirty)
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._subscribers) + len(self._progress) + len(self._messages) + len(self._meta)
+
+    def _touch(self) -> None:
+        if self.dirty_count >= self.max_dirty and self._wakeup is not None:
+            self._wakeup.set()
+
+    def mark_subscriber(self, chat_id: int, subscribed: bool) -> None:
+        self._subscribers[chat_id] = subscribed
+        self._touch()
+
+    def mark_progress(self, user_id: int) -> None:
+        self._progress.add(user_id)
+        self._touch()
+
+    def mark_messages(self, chat_id: int) -> None:
+        self._messages.add(chat_id)
+        self._touch()
+
+    def set_meta(self, key: str, value: Optional[str]) -> None:
+        """Служебное значение (None — удалить), пишется вместе с очередной пачкой"""
+        if value is None:
+            self.meta.pop(key, None)
+        else:
+            self.meta[key] = value
+        self._meta[key] = value
+        self._touch()
+
+    def restore(self, snapshot: StateSnapshot) -> None:
+        """Переносит загруженное из хранилища состояние в память процесса"""
+        lesson_ordinals.load(snapshot.ordinals)
+        self._ordinals_saved = len(snapshot.ordinals)
+        subscribers.update(snapshot.subscribers)
+        for user_id, data in snapshot.progress.items():
+            progress_tracker.import_bits(user_id, data)
+        user_content_messages.update(snapshot.content_messages)
+        self.meta.update(snapshot.meta)
+
+    def _take_batch(self) -> StateBatch:
+        batch = StateBatch(subscribers=self._subscribers, meta=self._meta)
+        batch.progress = {user_id: progress_tracker.export_bits(user_id) for user_id in self._progress}
+        batch.content_messages = {
+            chat_id: list(user_content_messages.get(chat_id) or ()) for chat_id in self._messages
+        }
+        if lesson_ordinals.assigning and len(lesson_ordinals) > self._ordinals_saved:
+            batch.ordinals = {
+                rel: ordinal for rel, ordinal in lesson_ordinals.snapshot().items()
+                if ordinal >= self._ordinals_saved
+            }
+        self._subscribers = {}
+        self._progress = set()
+        self._messages = set()
+        self._meta = {}
+        return batch
+
+    def _restore_dirty(self, batch: StateBatch) -> None:
+        for chat_id, subscribed in batch.subscribers.items():
+            self._subscribers.setdefault(chat_id, subscribed)
+        self._progress.update(batch.progress)
+        self._messages.update(batch.content_messages)
+        for key, value in batch.meta.items():
+            self._meta.setdefault(key, value)
+
+    async def flush(self) -> None:
+        """Записывает все накопленные изменения одной пачкой"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch = self._take_batch()
+            if not batch:
+                return
+            try:
+                await io_executor.run(self.store.write_batch, batch)
+            except Exception:
+                self._restore_dirty(batch)
+                raise
+            if batch.ordinals:
+                self._ordinals_saved = max(batch.ordinals.values()) + 1
+
+    async def run(self) -> None:
+        """Фоновый цикл периодической записи"""
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.warning("Ошибка записи состояния: %s", e)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись, сбрасывает остаток и закрывает хранилище"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        finally:
+            await io_executor.run(self.store.close)
+
+
+state_writer = StateWriter(MemoryStateStore())
+
+
+
+
+# ===== КЭШ КЛАВИАТУР =====
+
+# Примерная стоимость одного объекта кнопки pydantic сверх его строк
+BUTTON_OVERHEAD = 256
+
+
+class LRUCache:
+    """LRU-кэш с ограничением по примерному объёму записей в байтах.
+
+    Если задан ttl, запись старше ttl секунд считается отсутствующей.
+    """
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024, ttl: Optional[float] = None) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Any, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: Any) -> Optional[Any]:
+        item = self._entries.get(key)
+        if item is not None and self.ttl is not None and time.monotonic() - item[2] > self.ttl:
+            self._entries.pop(key)
+            self._bytes -= item[1]
+            item = None
+        if item is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key: Any, value: Any, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        self._entries[key] = (value, size, time.monotonic())
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+
+keyboard_cache = LRUCache()
+
+
+def estimate_keyboard_size(rows: List[List[InlineKeyboardButton]]) -> int:
+    size = 0
+    for row in rows:
+        for button in row:
+            size += BUTTON_OVERHEAD + len(button.text.encode("utf-8"))
+            size += len(button.callback_data or "")
+    return size
+
+
+def progress_signature(rel_dir: str, user_id: int) -> str:
+    """Компактная подпись прогресса пользователя по папке и всем вложенным"""
+    if not user_id or user_id not in progress_tracker:
+        return "-"
+    bits = progress_tracker.dir_bits(user_id, rel_dir)
+    return hashlib.blake2b(format(bits, "x").encode("ascii"), digest_size=8).hexdigest()
+
+
+def build_dir_keyboard(rel_dir: str, user_id: int = 0) -> InlineKeyboardMarkup:
+    dirs, files = list_dir(rel_dir)
+    cache_key = (content_catalog.version, rel_dir, progress_signature(rel_dir, user_id))
+    cached = keyboard_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    rows: List[List[InlineKeyboardButton]] = []
+
+    # Директории с цветовой индикацией
+    for display_name, child_rel in dirs:
+        iid = path_registry.get_id("dir", child_rel)
+        emoji = get_emoji(display_name)
+        # Проверяем прогресс изучения
+        progress = ""
+        if user_id and user_id in progress_tracker:
+            studied_count, total_count = progress_tracker.dir_counts(user_id, child_rel)
+            if total_count > 0:
+                progress = f" ({studied_count}/{total_count})"
+        
+        rows.append([InlineKeyboardButton(
+            text=f"{emoji} {display_name}{progress}", 
+            callback_data=f"open_dir:{iid}"
+        )])
+
+    # Файлы с индикацией изучения
+    for display_name, child_rel in files:
+        iid = path_registry.get_id("file", child_rel)
+        emoji = get_emoji(display_name)
+        # Индикатор изучения
+        studied = "✅" if user_id and progress_tracker.is_studied(user_id, child_rel) else "📖"
+        rows.append([InlineKeyboardButton(
+            text=f"{studied} {emoji} {display_name}", 
+            callback_data=f"open_file:{iid}"
+        )])
+
+    # Навигация
+    nav_row: List[InlineKeyboardButton] = []
+    if rel_dir:
+        parent = parent_of(rel_dir)
+        pid = path_registry.get_id("dir", parent)
+        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"open_dir:{pid}"))
+    home_id = path_registry.get_id("dir", "")
+    nav_row.append(InlineKeyboardButton(text="🏠 Домой", callback_data=f"open_dir:{home_id}"))
+    rows.append(nav_row)
+
+    # Дополнительные кнопки
+    action_row = []
+    cur_id = path_registry.get_id("dir", rel_dir)
+    action_row.append(InlineKeyboardButton(text="🔄 Обновить", callback_data=f"open_dir:{cur_id}"))
+    action_row.append(InlineKeyboardButton(text="🔍 Поиск", callback_data="search"))
+    action_row.append(InlineKeyboardButton(text="📊 Статистика", callback_data="stats"))
+    rows.append(action_row)
+
+    markup = InlineKeyboardMarkup(inline_keyboard=rows)
+    keyboard_cache.put(cache_key, markup, estimate_keyboard_size(rows))
+    return markup
+
+
+def build_home_keyboard(user_id: int = 0) -> InlineKeyboardMarkup:
+    home_id = path_registry.get_id("dir", "")
+    
+    # Статистика для главной страницы
+    stats_text = ""
+    if user_id and user_id in progress_tracker:
+        studied_files, total_files = progress_tracker.totals(user_id)
+        if total_files > 0:
+            percentage = (studied_files / total_files) * 100
+            stats_text = f"\n📊 Прогресс: {studied_files}/{total_files} ({percentage:.1f}%)"
+    
+    buttons = [
+        [InlineKeyboardButton(text="🚀 Приступить к изучению Kali Linux", callback_data=f"open_dir:{home_id}")],
+        [InlineKeyboardButton(text="🔍 Поиск по материалам", callback_data="search")],
+        [InlineKeyboardButton(text="📊 Моя статистика", callback_data="stats")],
+
+
+    ]
+    
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+# ===== СТРАНИЦЫ УРОКОВ =====
+
+# Telegram считает длину сообщения в кодовых единицах UTF-16 (предел 4096)
+PAGE_LIMIT = 4000
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _split_hard(text: str, limit: int) -> List[str]:
+    """Режет строку без подходящих границ по длине в UTF-16"""
+    parts: List[str] = []
+    current: List[str] = []
+    size = 0
+    for char in text:
+        width = 2 if ord(char) > 0xFFFF else 1
+        if size + width > limit:
+            parts.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += width
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def split_pages(text: str, limit: int = PAGE_LIMIT) -> List[str]:
+    """Делит текст урока на страницы по абзацам, затем по строкам.
+
+    Каждая страница не длиннее limit кодовых единиц UTF-16.
+    """
+    pages: List[str] = []
+    current = ""
+    for block in re.split(r"(?<=\n\n)", text):
+        pieces = [block]
+        if utf16_len(block) > limit:
+            pieces = []
+            for line in block.splitlines(keepends=True):
+                pieces.extend(_split_hard(line, limit) if utf16_len(line) > limit else [line])
+        for piece in pieces:
+            if current and utf16_len(current) + utf16_len(piece) > limit:
+                pages.append(current)
+                current = ""
+            current += piece
+    if current.strip() or not pages:
+        pages.append(current)
+    # Telegram не принимает пустые сообщения
+    return [page if page.strip() else "…" for page in pages]
+
+
+lesson_pages_cache = LRUCache(16 * 1024 * 1024)
+
+
+def load_lesson_pages(rel_path: str) -> Tuple[str, ...]:
+    """Читает файл и делит на страницы (выполняется в пуле ввода-вывода)"""
+    return tuple(split_pages(read_text_file(rel_path)))
+
+
+async def get_lesson_pages(rel_path: str) -> Tuple[str, ...]:
+    """Страницы урока из кэша; ключ включает версию файла (размер и mtime)"""
+    entry = content_catalog.files.get(rel_path)
+    if entry is None:
+        raise KeyError(rel_path)
+    key = (rel_path, entry.size, entry.mtime_ns)
+    pages = lesson_pages_cache.get(key)
+    if pages is None:
+        pages = await io_executor.run(load_lesson_pages, rel_path)
+        lesson_pages_cache.put(key, pages, sum(utf16_len(page) * 2 for page in pages))
+    return pages
+
+
+def build_page_keyboard(file_id: str, page: int, total: int) -> Optional[InlineKeyboardMarkup]:
+    """Кнопки листания страниц урока (None, если страница одна)"""
+    if total <= 1:
+        return None
+    row: List[InlineKeyboardButton] = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="◀️", callback_data=f"page:{file_id}:{page - 1}"))
+    row.append(InlineKeyboardButton(text=f"{page + 1}/{total}", callback_data=f"page:{file_id}:{page}"))
+    if page < total - 1:
+        row.append(InlineKeyboardButton(text="▶️", callback_data=f"page:{file_id}:{page + 1}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+
+# ===== РЕЗУЛЬТАТЫ ПОИСКА =====
+
+SEARCH_PAGE_SIZE = 5
+SEARCH_RESULTS_LIMIT = 50  # сколько лучших совпадений запоминается для листания
+
+# (нормализованный запрос, версия каталога) -> SearchResults
+search_cache = LRUCache(2 * 1024 * 1024, ttl=600)
+# короткий токен из callback_data -> нормализованный запрос
+search_queries = LRUCache(256 * 1024, ttl=3600)
+INLINE_CACHE_TIME = 300  # сколько секунд Telegram может отдавать inline-ответ из своего кэша
+register_cache_metrics({"keyboards": keyboard_cache, "lesson_pages": lesson_pages_cache, "search": search_cache})
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def query_token(query: str) -> str:
+    """Короткий id запроса для кнопок листания (callback_data до 64 байт)"""
+    digest = hashlib.blake2b(query.encode("utf-8"), digest_size=6).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii")
+
+
+def estimate_results_size(results: SearchResults) -> int:
+    return 64 + sum(
+        BUTTON_OVERHEAD + len(hit.rel_path) + sum(len(c) for c in hit.contexts) for hit in results.hits
+    )
+
+
+class SearchScheduler:
+    """Выполнение поисковых запросов вне событийного цикла.
+
+    Одинаковые запросы, пришедшие одновременно, считаются один раз
+    (single-flight); новый запрос пользователя отменяет ожидание его
+    предыдущего — ответ на устаревший запрос уже никому не нужен, а поиск,
+    которого больше никто не ждёт, снимается с очереди. Одновременно
+    выполняется не больше workers поисков, поэтому поток запросов одного
+    пользователя не отнимает время у навигации остальных. Если запросы
+    пользователя идут чаще debounce секунд, каждый следующий ждёт паузы.
+    """
+
+    def __init__(self, workers: int = 2, debounce: float = 0.3) -> None:
+        self.workers = workers
+        self.debounce = debounce
+        self.coalesced = 0
+        self.superseded = 0
+        self.cancelled = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[Tuple[str, str], "asyncio.Future[SearchResults]"] = {}
+        self._waiters: Dict[Tuple[str, str], int] = {}
+        self._latest: Dict[Tuple[str, int], "asyncio.Future[None]"] = {}
+        self._last_query: Dict[Tuple[str, int], float] = {}
+
+    def configure(self, workers: int, debounce: float) -> None:
+        self.shutdown()
+        self.workers = max(1, workers)
+        self.debounce = max(0.0, debounce)
+        self._semaphore = None
+
+    def _ensure_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="search")
+        return self._pool
+
+    def _supersede(self, owner: Tuple[str, int], ticket: Optional["asyncio.Future[None]"]) -> None:
+        previous = self._latest.pop(owner, None)
+        if previous is not None and not previous.done():
+            previous.set_result(None)
+        if ticket is not None:
+            self._latest[owner] = ticket
+
+    def _is_burst(self, owner: Tuple[str, int]) -> bool:
+        now = time.monotonic()
+        burst = now - self._last_query.get(owner, float("-inf")) < self.debounce
+        self._last_query[owner] = now
+        if len(self._last_query) > 10000:
+            self._last_query = {
+                key: seen for key, seen in self._last_query.items() if now - seen < self.debounce
+            }
+        return burst
+
+    def _finish(self, key: Tuple[str, str], future: "asyncio.Future[SearchResults]") -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        search_cache.put(key, future.result(), estimate_results_size(future.result()))
+
+    async def _compute(self, query: str) -> SearchResults:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._ensure_pool(), functools.partial(
+                    search_index.search, query, limit=SEARCH_RESULTS_LIMIT, max_contexts=2,
+                ),
+            )
+
+    def _start(self, key: Tuple[str, str]) -> "asyncio.Future[SearchResults]":
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self.coalesced += 1
+            return shared
+        shared = asyncio.ensure_future(self._compute(key[0]))
+        self._inflight[key] = shared
+        shared.add_done_callback(functools.partial(self._finish, key))
+        return shared
+
+    async def search(self, user_id: int, query: str, channel: str = "message") -> Optional[SearchResults]:
+        """Результаты запроса или None, если пользователь уже отправил новый.
+
+        channel разделяет очереди: inline-запрос не отменяет поиск в чате.
+        """
+        owner = (channel, user_id)
+        key = (query, content_catalog.version)
+        burst = self._is_burst(owner)
+        cached = search_cache.get(key)
+        if cached is not None:
+            self._supersede(owner, None)
+            return cached
+
+        ticket: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._supersede(owner, ticket)
+        try:
+            if burst:
+                await asyncio.wait((ticket,), timeout=self.debounce)
+                if ticket.done():
+                    self.superseded += 1
+                    return None
+            shared = self._start(key)
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            try:
+                await asyncio.wait((shared, ticket), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    del self._waiters[key]
+                    if not shared.done():
+                        # Результат больше никому не нужен
+                        shared.cancel()
+                        self.cancelled += 1
+        finally:
+            if self._latest.get(owner) is ticket:
+                del self._latest[owner]
+        if not shared.done():
+            self.superseded += 1
+            return None
+        return shared.result()
+
+    async def fetch(self, query: str) -> SearchResults:
+        """Результаты запроса без вытеснения — для листания уже показанного поиска.
+
+        Из кэша, а при промахе (вытеснение из LRU, новая версия каталога) —
+        тем же путём, что и search: вне цикла и с общим вычислением.
+        """
+        key = (query, content_catalog.version)
+        cached = search_cache.get(key)
+        if cached is not None:
+            return cached
+        shared = self._start(key)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(shared)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+search_scheduler = SearchScheduler()
+
+
+def remember_query(query: str) -> str:
+    token = query_token(query)
+    search_queries.put(token, query, len(query) + 64)
+    return token
+
+
+def render_search_page(query: str, token: str, results: SearchResults, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Текст и кнопки одной страницы результатов поиска"""
+    total_pages = max(1, -(-len(results.hits) // SEARCH_PAGE_SIZE))
+    page = max(0, min(page, total_pages - 1))
+    start = page * SEARCH_PAGE_SIZE
+    page_hits = results.hits[start:start + SEARCH_PAGE_SIZE]
+
+    response = f"🔍 Результаты поиска по запросу: '{html.escape(query)}'\n\n"
+    buttons: List[List[InlineKeyboardButton]] = []
+    for i, hit in enumerate(page_hits, start=start + 1):
+        file_name = Path(hit.rel_path).name
+        response += f"{i}. {get_emoji(file_name)} {html.escape(file_name)}\n"
+        response += f"Путь: {html.escape(hit.rel_path)}\n"
+        for context in hit.contexts[:2]:  # Показываем максимум 2 контекста
+            response += f"{html.escape(context)}\n"
+        response += "\n"
+        file_id = path_registry.get_id("file", hit.rel_path)
+        buttons.append([InlineKeyboardButton(text=f"📖 {file_name}", callback_data=f"open_file:{file_id}")])
+
+    if results.total > len(results.hits) and page == total_pages - 1:
+        response += f"... и ещё {results.total - len(results.hits)} результатов — уточните запрос\n\n"
+
+    if total_pages > 1:
+        row: List[InlineKeyboardButton] = []
+        if page > 0:
+            row.append(InlineKeyboardButton(text="◀️", callback_data=f"sp:{token}:{page - 1}"))
+        row.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data=f"sp:{token}:{page}"))
+        if page < total_pages - 1:
+            row.append(InlineKeyboardButton(text="▶️", callback_data=f"sp:{token}:{page + 1}"))
+        buttons.append(row)
+    buttons.append([InlineKeyboardButton(text="🏠 Главная", callback_data="home")])
+    return response, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+# ===== ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ =====
+path_registry = PathRegistry()
+
+# ===== ОСНОВНОЙ РОУТЕР =====
+router = Router()
+handler_metrics = HandlerMetricsMiddleware()
+for observer in (router.message, router.callback_query, router.inline_query):
+    observer.middleware(handler_metrics)
+
+# ===== ОБРАБОТЧИКИ КОМАНД =====
+
+@router.message(CommandStart())
+async def on_start(message: Message) -> None:
+    await io_executor.run(ensure_info_root)
+    subscribers.add(message.chat.id)
+    state_writer.mark_subscriber(message.chat.id, True)
+    
+    # Инициализируем прогресс пользователя
+    if message.from_user.id not in progress_tracker:
+        progress_tracker.ensure_user(message.from_user.id)
+        state_writer.mark_progress(message.from_user.id)
+    
+    greeting = (
+        "🎯 <b>Добро пожаловать в Kali Linux Academy!</b>\n\n"
+        "🔥 <i>Ваш персональный гид по кибербезопасности</i>\n\n"
+        "📚 <b>Что вас ждёт:</b>\n"
+        "🟢 <b>Базовый уровень</b> — основы и введение\n"
+        "🟡 <b>Средний уровень</b> — практические атаки\n"
+        "🔴 <b>Продвинутый уровень</b> — экспертные техники\n\n"
+        "✨ <b>Особенности:</b>\n"
+        "• Автоматические уведомления о новых материалах\n"
+        "• Отслеживание прогресса изучения\n"
+        "• Поиск по всем материалам\n"
+        "• Красивое оформление с цветовой индикацией\n\n"
+        "🚀 <b>Начните изучение прямо сейчас!</b>"
+    )
+    await message.answer(greeting, reply_markup=build_home_keyboard(message.from_user.id))
+
+@router.message(Command("stop"))
+async def on_stop(message: Message) -> None:
+    if message.chat.id in subscribers:
+        subscribers.discard(message.chat.id)
+        state_writer.mark_subscriber(message.chat.id, False)
+    await message.answer("Вы отписались от уведомлений о новых материалах.")
+
+
+@router.message(Command("home"))
+async def on_home(message: Message) -> None:
+    await on_start(message)
+
+@router.message(Command("search"))
+async def on_search_command(message: Message) -> None:
+    await message.answer(
+        "🔍 <b>Поиск по материалам</b>\n\n"
+        "Отправьте ключевое слово для поиска по всем файлам.\n"
+        "Например: <code>команды</code>, <code>атака</code>, <code>безопасность</code>\n"
+        "Фраза в кавычках ищется целиком: <code>\"kali linux\"</code>",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
+        ])
+    )
+
+
+@router.message(Command("stats"))
+async def on_stats_command(message: Message) -> None:
+    user_id = message.from_user.id
+    progress_tracker.ensure_user(user_id)
+    studied_files, total_files = progress_tracker.totals(user_id)
+    
+    if total_files == 0:
+        await message.answer("📊 Пока нет материалов для изучения.")
+        return
+    
+    percentage = (studied_files / total_files) * 100
+    progress_bar = "🟩" * int(percentage / 10) + "⬜" * (10 - int(percentage / 10))
+    
+    stats_text = (
+        f"📊 <b>Ваша статистика изучения</b>\n\n"
+        f"📚 Изучено материалов: <b>{studied_files}/{total_files}</b>\n"
+        f"📈 Прогресс: <b>{percentage:.1f}%</b>\n\n"
+        f"<code>{progress_bar}</code>\n\n"
+    )
+    
+    if studied_files == total_files:
+        stats_text += "🎉 <b>Поздравляем! Вы изучили все материалы!</b>"
+    elif studied_files > 0:
+        remaining = total_files - studied_files
+        stats_text += f"💪 Осталось изучить: <b>{remaining}</b> материалов"
+    else:
+        stats_text += "🚀 Начните изучение с базовых разделов!"
+    
+    await message.answer(stats_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
+    ]))
+
+
+@router.message(Command("slow"))
+async def on_slow_command(message: Message) -> None:
+    """Админ-команда: последние блокировки событийного цикла"""
+    if message.from_user is None or message.from_user.id not in ADMIN_IDS:
+        return
+    report = loop_watchdog.report()
+    if len(report) > 3900:
+        report = report[:3900] + "\n..."
+    await message.answer(f"🐢 Блокировки цикла\n<pre>{html.escape(report)}</pre>", parse_mode=ParseMode.HTML)
+
+
+# ===== ОБРАБОТЧИКИ CALLBACK =====
+
+@router.callback_query(F.data.startswith("open_dir:"))
+async def on_open_dir(callback: CallbackQuery) -> None:
+    try:
+        assigned_id = callback.data.split(":", 1)[1]
+        kind, rel_path = path_registry.resolve(assigned_id)
+        if kind != "dir":
+            await callback.answer("Это не папка", show_alert=False)
+            return
+        
+        user_id = callback.from_user.id
+        kb = build_dir_keyboard(rel_path, user_id)
+        
+        # Красивый заголовок с эмодзи
+        if rel_path:
+            section_name = Path(rel_path).name
+            emoji = get_emoji(section_name)
+            title = f"{emoji} {section_name}\nРаздел: {rel_path}\n———"
+        else:
+            title = f"🎯 Kali Linux Academy\nГлавное меню\n———"
+        
+        # Очищаем ранее отправленные контент-сообщения
+        await clear_user_messages(callback.message.bot, callback.message.chat.id)
+        
+        # Проверяем, изменился ли контент перед редактированием
+        try:
+            await callback.message.edit_text(title, reply_markup=kb)
+        except Exception as edit_error:
+            if "message is not modified" in str(edit_error):
+                # Сообщение не изменилось, просто отвечаем
+                await callback.answer()
+                return
+            else:
+                raise edit_error
+        await callback.answer()
+    except KeyError:
+        await callback.answer("Ссылка устарела — откройте заново", show_alert=True)
+    except Exception as e:
+        logging.exception("Ошибка при открытии папки: %s", e)
+        await callback.answer("Ошибка при открытии", show_alert=True)
+
+
+
+
+@router.callback_query(F.data.startswith("open_file:"))
+async def on_open_file(callback: CallbackQuery) -> None:
+    try:
+        assigned_id = callback.data.split(":", 1)[1]
+        kind, rel_path = path_registry.resolve(assigned_id)
+        if kind != "file":
+            await callback.answer("Это не файл", show_alert=False)
+            return
+        
+        # Отмечаем файл как изученный
+        user_id = callback.from_user.id
+        if progress_tracker.mark_studied(user_id, rel_path):
+            state_writer.mark_progress(user_id)
+        
+        pages = await get_lesson_pages(rel_path)
+        parent_dir = parent_of(rel_path)
+        kb = build_dir_keyboard(parent_dir, user_id)
+        
+        # Красивый заголовок с эмодзи
+        file_name = Path(rel_path).name
+        emoji = get_emoji(file_name)
+        header = f"✅ {emoji} {file_name}\nРаздел: {str(Path(rel_path).parent.as_posix() or '/')}\n———"
+
+        # Сразу отвечаем на callback, чтобы избежать timeout
+        await callback.answer("✅ Материал отмечен как изученный!")
+
+        # Очищаем предыдущие контент-сообщения
+        await clear_user_messages(callback.message.bot, callback.message.chat.id)
+
+        # Обновляем сообщение заголовком и клавиатурой (HTML)
+        await callback.message.edit_text(header, reply_markup=kb)
+
+        # Отправляем первую страницу урока; остальные листаются кнопками в том же сообщении
+        try:
+            msg = await callback.message.answer(
+                pages[0], reply_markup=build_page_keyboard(assigned_id, 0, len(pages))
+            )
+        except Exception as e:
+            logging.warning(f"Ошибка отправки текста: {e}")
+        else:
+            # Сохраняем ID отправленного сообщения для последующей очистки
+            user_content_messages[callback.message.chat.id] = [msg.message_id]
+            state_writer.mark_messages(callback.message.chat.id)
+    except KeyError:
+        try:
+            await callback.answer("Ссылка устарела — откройте заново", show_alert=True)
+        except:
+            pass  # Игнорируем ошибки callback
+    except Exception as e:
+        logging.exception("Ошибка при открытии файла: %s", e)
+        try:
+            await callback.answer("Ошибка при открытии", show_alert=True)
+        except:
+            pass
+
+
+@router.callback_query(F.data.startswith("page:"))
+async def on_open_page(callback: CallbackQuery) -> None:
+    try:
+        _, assigned_id, page_str = callback.data.split(":", 2)
+        kind, rel_path = path_registry.resolve(assigned_id)
+        if kind != "file":
+            await callback.answer("Это не файл", show_alert=False)
+            return
+
+        pages = await get_lesson_pages(rel_path)
+        page = max(0, min(int(page_str), len(pages) - 1))
+        try:
+            await callback.message.edit_text(
+                pages[page], reply_markup=build_page_keyboard(assigned_id, page, len(pages))
+            )
+        except Exception as edit_error:
+            if "message is not modified" not in str(edit_error):
+                raise edit_error
+        await callback.answer()
+    except KeyError:
+        await callback.answer("Ссылка устарела — откройте заново", show_alert=True)
+    except Exception as e:
+        logging.exception("Ошибка при листании урока: %s", e)
+        await callback.answer("Ошибка при открытии", show_alert=True)
+
+
+@router.callback_query(F.data.startswith("sp:"))
+async def on_search_page(callback: CallbackQuery) -> None:
+    try:
+        _, token, page_str = callback.data.split(":", 2)
+        query = search_queries.get(token)
+        if query is None:
+            await callback.answer("Результаты поиска устарели — повторите запрос", show_alert=True)
+            return
+
+        text, kb = render_search_page(query, token, await search_scheduler.fetch(query), int(page_str))
+        try:
+            await callback.message.edit_text(text, reply_markup=kb, parse_mode=ParseMode.HTML)
+        except Exception as edit_error:
+            if "message is not modified" not in str(edit_error):
+                raise edit_error
+        await callback.answer()
+    except Exception as e:
+        logging.exception("Ошибка при листании результатов поиска: %s", e)
+        await callback.answer("Ошибка при открытии", show_alert=True)
+
+
+# ===== ОБРАБОТЧИКИ СПЕЦИАЛЬНЫХ КНОПОК =====
+
+@router.callback_query(F.data == "search")
+async def on_search_callback(callback: CallbackQuery) -> None:
+    await clear_user_messages(callback.message.bot, callback.message.chat.id)
+    await callback.message.edit_text(
+        "🔍 <b>Поиск по материалам</b>\n\n"
+        "Отправьте ключевое слово для поиска по всем файлам.\n"
+        "Например: <code>команды</code>, <code>атака</code>, <code>безопасность</code>\n"
+        "Фраза в кавычках ищется целиком: <code>\"kali linux\"</code>",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
+        ]),
+        parse_mode=ParseMode.HTML
+    )
+    await callback.answer()
+
+@router.callback_query(F.data == "stats")
+async def on_stats_callback(callback: CallbackQuery) -> None:
+    await clear_user_messages(callback.message.bot, callback.message.chat.id)
+    user_id = callback.from_user.id
+    progress_tracker.ensure_user(user_id)
+    studied_files, total_files = progress_tracker.totals(user_id)
+    
+    if total_files == 0:
+        await callback.message.edit_text("📊 Пока нет материалов для изучения.")
+        return
+    
+    percentage = (studied_files / total_files) * 100
+    progress_bar = "🟩" * int(percentage / 10) + "⬜" * (10 - int(percentage / 10))
+    
+    stats_text = (
+        f"📊 <b>Ваша статистика изучения</b>\n\n"
+        f"📚 Изучено материалов: <b>{studied_files}/{total_files}</b>\n"
+        f"📈 Прогресс: <b>{percentage:.1f}%</b>\n\n"
+        f"<code>{progress_bar}</code>\n\n"
+    )
+    
+    if studied_files == total_files:
+        stats_text += "🎉 <b>Поздравляем! Вы изучили все материалы!</b>"
+    elif studied_files > 0:
+        remaining = total_files - studied_files
+        stats_text += f"💪 Осталось изучить: <b>{remaining}</b> материалов"
+    else:
+        stats_text += "🚀 Начните изучение с базовых разделов!"
+    
+    await callback.message.edit_text(stats_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
+    ]), parse_mode=ParseMode.HTML)
+    await callback.answer()
+
+
+
+@router.callback_query(F.data == "home")
+async def on_home_callback(callback: CallbackQuery) -> None:
+    await clear_user_messages(callback.message.bot, callback.message.chat.id)
+    user_id = callback.from_user.id
+    progress_tracker.ensure_user(user_id)
+    
+    greeting = (
+        "🎯 <b>Добро пожаловать в Kali Linux Academy!</b>\n\n"
+        "🔥 <i>Ваш персональный гид по кибербезопасности</i>\n\n"
+        "📚 <b>Что вас ждёт:</b>\n"
+        "🟢 <b>Базовый уровень</b> — основы и введение\n"
+        "🟡 <b>Средний уровень</b> — практические атаки\n"
+        "🔴 <b>Продвинутый уровень</b> — экспертные техники\n\n"
+        "✨ <b>Особенности:</b>\n"
+        "• Автоматические уведомления о новых материалах\n"
+        "• Отслеживание прогресса изучения\n"
+        "• Поиск по всем материалам\n"
+        "• Красивое оформление с цветовой индикацией\n\n"
+        "🚀 <b>Начните изучение прямо сейчас!</b>"
+    )
+    await callback.message.edit_text(greeting, reply_markup=build_home_keyboard(user_id), parse_mode=ParseMode.HTML)
+    await callback.answer()
+
+
+# ===== ПОИСК ПО ТЕКСТУ =====
+
+@router.message()
+async def on_text_search(message: Message) -> None:
+    if not message.text or message.text.startswith('/'):
+        return
+    
+    search_term = normalize_query(message.text)
+    if len(search_term) < 2:
+        await message.answer("🔍 Введите минимум 2 символа для поиска.")
+        return
+    
+    results = await search_scheduler.search(message.from_user.id, search_term)
+    if results is None:
+        # Пользователь уже отправил следующий запрос — отвечаем только на него
+        return
+    
+    if not results.hits:
+        await message.answer(
+            f"🔍 По запросу '{html.escape(search_term)}' ничего не найдено.\n\n"
+            "Попробуйте другие ключевые слова или проверьте правописание.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
+            ]),
+        )
+        return
+    
+    # Первая страница результатов; остальные листаются кнопками из кэша
+    text, kb = render_search_page(search_term, remember_query(search_term), results, 0)
+    await message.answer(text, reply_markup=kb, parse_mode=ParseMode.HTML)
+
+
+# ===== INLINE-РЕЖИМ =====
+
+INLINE_PAGE_SIZE = 20
+
+
+def build_inline_results(
+    results: SearchResults, offset: int, bot_username: Optional[str],
+) -> List[InlineQueryResultArticle]:
+    """Карточки уроков для ответа на inline-запрос"""
+    kb = None
+    if bot_username:
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🤖 Открыть академию", url=f"https://t.me/{bot_username}")]
+        ])
+    articles: List[InlineQueryResultArticle] = []
+    for hit in results.hits[offset:offset + INLINE_PAGE_SIZE]:
+        file_name = Path(hit.rel_path).name
+        snippet = " ".join(hit.contexts[0].split()) if hit.contexts else ""
+        text = f"{get_emoji(file_name)} <b>{html.escape(Path(hit.rel_path).stem)}</b>\nПуть: {html.escape(hit.rel_path)}"
+        if snippet:
+            text += f"\n\n{html.escape(snippet)}"
+        articles.append(InlineQueryResultArticle(
+            id=path_registry.get_id("file", hit.rel_path),
+            title=f"{get_emoji(file_name)} {Path(hit.rel_path).stem}",
+            description=snippet[:120] or hit.rel_path,
+            input_message_content=InputTextMessageContent(message_text=text),
+            reply_markup=kb,
+        ))
+    return articles
+
+
+@router.inline_query()
+async def on_inline_query(inline_query: InlineQuery, bot: Bot) -> None:
+    query = normalize_query(inline_query.query)
+    if len(query) < 2:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    results = await search_scheduler.search(inline_query.from_user.id, query, channel="inline")
+    if results is None:
+        # Пользователь уже напечатал следующий символ — этот ответ не нужен
+        return
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    next_offset = offset + INLINE_PAGE_SIZE
+    me = await bot.me()
+    await inline_query.answer(
+        build_inline_results(results, offset, me.username),
+        cache_time=INLINE_CACHE_TIME,
+        next_offset=str(next_offset) if next_offset < len(results.hits) else "",
+    )
+
+
+# ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ МОНИТОРИНГА =====
+
+def scan_all_txt() -> set[str]:
+    """Все .txt файлы в папке Информация (из снимка каталога)"""
+    return set(content_catalog.files)
+
+
+@dataclass(frozen=True)
+class ContentEvent:
+    """Изменение в папке Информация: add, modify, delete, rename или overflow"""
+    kind: str
+    rel_path: str
+    is_dir: bool = False
+    old_path: Optional[str] = None
+
+
+def coalesce_events(events: List[ContentEvent]) -> List[ContentEvent]:
+    """Схлопывает серию событий по одному пути в итоговое изменение"""
+    result: "OrderedDict[str, ContentEvent]" = OrderedDict()
+    for event in events:
+        if event.kind == "overflow":
+            return [event]
+        if event.kind == "rename" and event.old_path is not None:
+            moved = result.pop(event.old_path, None)
+            if moved is not None and moved.kind == "add":
+                event = ContentEvent("add", event.rel_path, event.is_dir)
+        previous = result.get(event.rel_path)
+        if previous is not None:
+            if previous.kind == "add" and event.kind == "modify":
+                continue
+            if previous.kind == "add" and event.kind == "delete":
+                del result[event.rel_path]
+                continue
+            if previous.kind == "delete" and event.kind == "add":
+                event = ContentEvent("modify", event.rel_path, event.is_dir)
+            del result[event.rel_path]
+        result[event.rel_path] = event
+    return list(result.values())
+
+
+def affected_dirs(events: List[ContentEvent]) -> Optional[set[str]]:
+    """Папки, которые нужно перечитать; None — нужен полный обход"""
+    dirs: set[str] = set()
+    for event in events:
+        if event.kind == "overflow":
+            return None
+        dirs.add(parent_of(event.rel_path) if event.rel_path else "")
+        if event.is_dir:
+            dirs.add(event.rel_path)
+        if event.old_path is not None:
+            dirs.add(parent_of(event.old_path))
+    return dirs
+
+
+class InotifyWatcher:
+    """Рекурсивное наблюдение через inotify (Linux) с подавлением дребезга.
+
+    Ядро присылает события на каждую папку; новые папки ставятся на
+    наблюдение сразу. События копятся, пока не наступит пауза debounce
+    секунд, затем схлопываются и отдаются одной пачкой.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (
+        IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    )
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, root: Path, debounce: float = 0.5) -> None:
+        self.root = root
+        self.debounce = debounce
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = -1
+        self._wd_to_dir: Dict[int, str] = {}
+        self._pending: List[ContentEvent] = []
+        self._moves: Dict[int, Tuple[str, bool]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._queue: "asyncio.Queue[List[ContentEvent]]" = asyncio.Queue()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def available() -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            return hasattr(libc, "inotify_init1")
+        except OSError:
+            return False
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 не удался")
+        self._watch_tree("")
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._fd >= 0:
+            if self._loop is not None:
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = -1
+
+    def _watch_tree(self, rel_dir: str) -> None:
+        """Ставит наблюдение на папку и все вложенные"""
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else str(self.root)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(abs_dir), self.WATCH_MASK)
+        if wd < 0:
+            logging.warning("inotify: не удалось наблюдать %s (errno %s)", abs_dir, ctypes.get_errno())
+            return
+        self._wd_to_dir[wd] = rel_dir
+        try:
+            with os.scandir(abs_dir) as it:
+                children = [entry.name for entry in it if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return
+        for name in children:
+            self._watch_tree(f"{rel_dir}/{name}" if rel_dir else name)
+
+    def _unwatch_tree(self, rel_dir: str) -> None:
+        """Снимает наблюдение с папки, ушедшей за пределы дерева, и вложенных"""
+        prefix = rel_dir + "/"
+        for wd, watched in list(self._wd_to_dir.items()):
+            if watched == rel_dir or watched.startswith(prefix):
+                del self._wd_to_dir[wd]
+                if self._fd >= 0:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            self._handle(wd, mask, cookie, name)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(self.debounce, self._flush)
+
+    def _handle(self, wd: int, mask: int, cookie: int, name: str) -> None:
+        if mask & self.IN_Q_OVERFLOW:
+            self._pending.append(ContentEvent("overflow", ""))
+            return
+        if mask & self.IN_IGNORED:
+            self._wd_to_dir.pop(wd, None)
+            return
+        rel_dir = self._wd_to_dir.get(wd)
+        if rel_dir is None:
+            return
+        if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            # Перемещение и удаление папки уже описаны событиями родителя
+            # (MOVED_FROM/MOVED_TO, DELETE); к тому же после MOVED_TO этот wd
+            # указывает на новый путь, и «удаление» стёрло бы переименование
+            return
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        is_dir = bool(mask & self.IN_ISDIR)
+        if not is_dir and os.path.splitext(name)[1].lower() != ".txt":
+            return
+        if mask & self.IN_CREATE:
+            if is_dir:
+                self._watch_tree(rel_path)
+            self._pending.append(ContentEvent("add", rel_path, is_dir))
+        elif mask & self.IN_DELETE:
+            self._pending.append(ContentEvent("delete", rel_path, is_dir))
+        elif mask & self.IN_MOVED_FROM:
+            self._moves[cookie] = (rel_path, is_dir)
+        elif mask & self.IN_MOVED_TO:
+            if is_dir:
+                self._watch_tree(rel_path)
+            moved = self._moves.pop(cookie, None)
+            if moved is not None:
+                self._pending.append(ContentEvent("rename", rel_path, is_dir, old_path=moved[0]))
+            else:
+                self._pending.append(ContentEvent("add", rel_path, is_dir))
+        elif mask & (self.IN_MODIFY | self.IN_CLOSE_WRITE):
+            self._pending.append(ContentEvent("modify", rel_path, is_dir))
+
+    def _flush(self) -> None:
+        self._timer = None
+        # Перемещения без пары ушли за пределы папки — это удаление
+        for rel_path, is_dir in self._moves.values():
+            self._pending.append(ContentEvent("delete", rel_path, is_dir))
+            if is_dir:
+                self._unwatch_tree(rel_path)
+        self._moves.clear()
+        events = coalesce_events(self._pending)
+        self._pending = []
+        if events:
+            self._queue.put_nowait(events)
+
+    async def changes(self) -> List[ContentEvent]:
+        """Следующая пачка изменений"""
+        return await self._queue.get()
+
+
+class PollingWatcher:
+    """Запасной вариант без inotify: опрос mtime папок из снимка каталога.
+
+    За один проход делается по одному stat на папку; перечитываются только
+    папки, у которых изменилось mtime. Правка файла на месте (без создания
+    или переименования) не меняет mtime папки и таким опросом не видна.
+    """
+
+    def __init__(self, root: Path, interval: float = 10.0) -> None:
+        self.root = root
+        self.interval = interval
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def _changed_dirs(self, catalog: ContentCatalog) -> List[ContentEvent]:
+        events: List[ContentEvent] = []
+        for rel_dir, entry in catalog.dirs.items():
+            abs_dir = os.path.join(self.root, rel_dir) if rel_dir else str(self.root)
+            try:
+                mtime_ns = os.stat(abs_dir).st_mtime_ns
+            except FileNotFoundError:
+                events.append(ContentEvent("delete", rel_dir, is_dir=True))
+                continue
+            if mtime_ns != entry.mtime_ns:
+                events.append(ContentEvent("modify", rel_dir, is_dir=True))
+        return events
+
+    async def changes(self) -> List[ContentEvent]:
+        while True:
+            await asyncio.sleep(self.interval)
+            events = await io_executor.run(self._changed_dirs, content_catalog)
+            if events:
+                return events
+
+
+def create_content_watcher(root: Path, interval_seconds: float) -> "InotifyWatcher | PollingWatcher":
+    if InotifyWatcher.available():
+        try:
+            watcher = InotifyWatcher(root)
+            watcher.start()
+            return watcher
+        except OSError as e:
+            logging.warning("inotify недоступен (%s), используется опрос папок", e)
+    watcher = PollingWatcher(root, interval_seconds)
+    watcher.start()
+    return watcher
+
+
+async def watch_info_changes(bot: Bot, interval_seconds: int = 10) -> None:
+    """Фоновый мониторинг папки: события inotify или опрос mtime папок"""
+    watcher = create_content_watcher(INFO_ROOT, interval_seconds)
+    try:
+        while True:
+            events = await watcher.changes()
+            try:
+                started = time.perf_counter()
+                old, new = await refresh_content(affected_dirs(events))
+                content_refresh_seconds.observe(time.perf_counter() - started)
+                renamed = [e.rel_path for e in events if e.kind == "rename"]
+                new_files = [
+                    rel for rel in sorted(new.files.keys() - old.files.keys())
+                    if not any(rel == r or rel.startswith(r + "/") for r in renamed)
+                ]
+                if new_files:
+                    broadcast_engine.enqueue(new_files)
+            except Exception as e:
+                logging.warning("Ошибка в наблюдателе папки: %s", e)
+    finally:
+        watcher.close()
+
+
+# ===== РАССЫЛКА УВЕДОМЛЕНИЙ =====
+
+class TokenBucket:
+    """Токен-бакет: в среднем rate запросов в секунду, всплеск до capacity.
+
+    Ожидающие обслуживаются по очереди; pause() останавливает выдачу
+    токенов целиком (например, после RetryAfter от Telegram).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def pause(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def build_broadcast_digest(files: List[str]) -> Tuple[str, InlineKeyboardMarkup]:
+    """Одно сообщение о новых материалах вместо сообщения на каждый файл"""
+    if len(files) == 1:
+        rel = files[0]
+        file_id = path_registry.get_id("file", rel)
+        dir_id = path_registry.get_id("dir", parent_of(rel))
+        return f"🆕 Добавлен новый материал: {rel}", InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text="📘 Открыть файл", callback_data=f"open_file:{file_id}")],
+                [InlineKeyboardButton(text="📂 Открыть раздел", callback_data=f"open_dir:{dir_id}")],
+            ]
+        )
+    text = f"🆕 Добавлены новые материалы ({len(files)}):\n"
+    for rel in files[:20]:
+        text += f"• {rel}\n"
+    if len(files) > 20:
+        text += f"... и ещё {len(files) - 20}\n"
+    buttons = []
+    for rel in files[:5]:
+        file_id = path_registry.get_id("file", rel)
+        buttons.append([InlineKeyboardButton(text=f"📘 {Path(rel).stem}", callback_data=f"open_file:{file_id}")])
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+class BroadcastEngine:
+    """Рассылка уведомлений о новых материалах отдельной задачей.
+
+    Новые файлы копятся coalesce_delay секунд и уходят одним дайджестом
+    на чат. Отправка идёт из concurrency параллельных воркеров; лимиты
+    скорости, RetryAfter и повторы целиком на OutboundSession, где рассылка
+    идёт полосой LANE_BROADCAST после ответов пользователям. Прогресс рассылки сохраняется как
+    контрольная точка (файлы и id последнего чата, до которого разослано
+    всё), поэтому после перезапуска рассылка продолжается с места остановки.
+    """
+
+    CHECKPOINT_KEY = "broadcast"
+
+    def __init__(self, concurrency: int = 16, coalesce_delay: float = 2.0) -> None:
+        self.concurrency = concurrency
+        self.coalesce_delay = coalesce_delay
+        self.sent = 0
+        self.failed = 0
+        self._pending: List[str] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Если задано — подписчики читаются из общего хранилища (несколько процессов)
+        self.subscriber_source: Optional[Callable[[], set[int]]] = None
+
+    def configure(self, concurrency: int) -> None:
+        self.concurrency = max(1, concurrency)
+
+    def enqueue(self, files: Iterable[str]) -> None:
+        """Ставит новые файлы в очередь на рассылку"""
+        for rel in files:
+            if rel not in self._pending:
+                self._pending.append(rel)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self, bot: Bot) -> None:
+        self._task = asyncio.create_task(self.run(bot))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
             try:
-                msg = await callback.message.answer(part)
-                sent_ids.append(msg.message_id)
-            except Exception as e:
-                logging.warning(f"Ошибка отправки текста: {e}")
-        
-        # Сохраняем ID отправленных сообщений для последующей очистки
-        if sent_ids:
-            user_content_messages[callback.message.chat.id] = sent_ids
-    except KeyError:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _save_checkpoint(self, files: List[str], after_chat: Optional[int]) -> None:
+        state_writer.set_meta(self.CHECKPOINT_KEY, json.dumps({"files": files, "after": after_chat}))
+
+    def _load_checkpoint(self) -> Optional[Tuple[List[str], Optional[int]]]:
+        raw = state_writer.meta.get(self.CHECKPOINT_KEY)
+        if not raw:
+            return None
         try:
-            await callback.answer("Ссылка устарела — откройте заново", show_alert=True)
-        except:
-            pass  # Игнорируем ошибки callback
-    except Exception as e:
-        logging.exception("Ошибка при открытии файла: %s", e)
+            data = json.loads(raw)
+            return [rel for rel in data["files"] if rel in content_catalog.files], data.get("after")
+        except (ValueError, KeyError, TypeError):
+            logging.warning("Повреждённая контрольная точка рассылки, пропускается")
+            return None
+
+    async def run(self, bot: Bot) -> None:
+        api_lane.set(LANE_BROADCAST)
+        self._wakeup = asyncio.Event()
+        checkpoint = self._load_checkpoint()
+        if checkpoint is not None:
+            files, after_chat = checkpoint
+            if files:
+                logging.info("Продолжение рассылки после перезапуска: %d файлов", len(files))
+                await self._send_job(bot, files, after_chat)
+            else:
+                state_writer.set_meta(self.CHECKPOINT_KEY, None)
+        while True:
+            if not self._pending:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            # Даём накопиться соседним изменениям, чтобы разослать их одним дайджестом
+            await asyncio.sleep(self.coalesce_delay)
+            files, self._pending = self._pending, []
+            files = [rel for rel in files if rel in content_catalog.files]
+            if files:
+                try:
+                    await self._send_job(bot, files, None)
+                except Exception as e:
+                    logging.warning("Ошибка рассылки: %s", e)
+
+    async def _send_job(self, bot: Bot, files: List[str], after_chat: Optional[int]) -> None:
+        audience = await io_executor.run(self.subscriber_source) if self.subscriber_source else subscribers
+        chats = sorted(chat_id for chat_id in audience if after_chat is None or chat_id > after_chat)
+        text, kb = build_broadcast_digest(files)
+        self._save_checkpoint(files, after_chat)
+        done = [False] * len(chats)
+        cursor = 0
+        watermark = 0
+        saved_at = time.monotonic()
+
+        async def worker() -> None:
+            nonlocal cursor, watermark, saved_at
+            while cursor < len(chats):
+                index = cursor
+                cursor += 1
+                await self._deliver(bot, chats[index], text, kb)
+                done[index] = True
+                while watermark < len(done) and done[watermark]:
+                    watermark += 1
+                if watermark and time.monotonic() - saved_at >= 1.0:
+                    self._save_checkpoint(files, chats[watermark - 1])
+                    saved_at = time.monotonic()
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(chats)))))
+        state_writer.set_meta(self.CHECKPOINT_KEY, None)
+
+    async def _deliver(self, bot: Bot, chat_id: int, text: str, kb: InlineKeyboardMarkup) -> bool:
+        """Одно уведомление; ожидание лимитов и повторы уже сделала сессия"""
         try:
-            await callback.answer("Ошибка при открытии", show_alert=True)
-        except:
-            pass
+            await bot.send_message(chat_id, text, reply_markup=kb)
+        except TelegramForbiddenError:
+            # Бот заблокирован или удалён из чата — отписываем
+            subscribers.discard(chat_id)
+            state_writer.mark_subscriber(chat_id, False)
+            self.failed += 1
+            return False
+        except Exception as e:
+            logging.warning("Не удалось отправить уведомление %s: %s", chat_id, e)
+            self.failed += 1
+            return False
+        self.sent += 1
+        return True
 
 
-# ===== ОБРАБОТЧИКИ СПЕЦИАЛЬНЫХ КНОПОК =====
+broadcast_engine = BroadcastEngine()
 
-@router.callback_query(F.data == "search")
-async def on_search_callback(callback: CallbackQuery) -> None:
-    await clear_user_messages(callback.message.bot, callback.message.chat.id)
-    await callback.message.edit_text(
-        "🔍 <b>Поиск по материалам</b>\n\n"
-        "Отправьте ключевое слово для поиска по всем файлам.\n"
-        "Например: <code>команды</code>, <code>атака</code>, <code>безопасность</code>",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
-        ]),
-        parse_mode=ParseMode.HTML
-    )
-    await callback.answer()
 
-@router.callback_query(F.data == "stats")
-async def on_stats_callback(callback: CallbackQuery) -> None:
-    await clear_user_messages(callback.message.bot, callback.message.chat.id)
-    user_id = callback.from_user.id
-    if user_id not in user_progress:
-        user_progress[user_id] = {}
-    
-    total_files = len(scan_all_txt())
-    studied_files = sum(1 for f in user_progress[user_id].values() if f)
-    
-    if total_files == 0:
-        await callback.message.edit_text("📊 Пока нет материалов для изучения.")
-        return
-    
-    percentage = (studied_files / total_files) * 100
-    progress_bar = "🟩" * int(percentage / 10) + "⬜" * (10 - int(percentage / 10))
-    
-    stats_text = (
-        f"📊 <b>Ваша статистика изучения</b>\n\n"
-        f"📚 Изучено материалов: <b>{studied_files}/{total_files}</b>\n"
-        f"📈 Прогресс: <b>{percentage:.1f}%</b>\n\n"
-        f"<code>{progress_bar}</code>\n\n"
-    )
-    
-    if studied_files == total_files:
-        stats_text += "🎉 <b>Поздравляем! Вы изучили все материалы!</b>"
-    elif studied_files > 0:
-        remaining = total_files - studied_files
-        stats_text += f"💪 Осталось изучить: <b>{remaining}</b> материалов"
+# ===== ИСХОДЯЩИЕ ЗАПРОСЫ К BOT API =====
+
+# Полоса приоритета текущей задачи: ответы пользователям идут раньше рассылки и удалений
+LANE_INTERACTIVE, LANE_BROADCAST, LANE_CLEANUP = 0, 1, 2
+api_lane: ContextVar[int] = ContextVar("api_lane", default=LANE_INTERACTIVE)
+# Общий лимит Telegram (~30 сообщений в секунду) касается отправки сообщений;
+# ответы на callback, правки и удаления ограничены только бакетом своего чата
+GLOBALLY_LIMITED_PREFIXES = ("send", "copy", "forward")
+
+
+class PriorityRateLimiter:
+    """Общий токен-бакет с приоритетами: свободный токен получает самый
+    приоритетный ожидающий (меньшее значение — раньше), внутри полосы — по очереди.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters: List[Tuple[int, int, "asyncio.Future[None]"]] = []
+        self._seq = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу на seconds; запас токенов обнуляется, чтобы после
+        паузы не уйти всплеском в тот же лимит"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = self._blocked_until
+
+    def _refill(self, now: float) -> None:
+        if now < self._updated:
+            return
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = LANE_INTERACTIVE) -> None:
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and self._tokens >= 1 and now >= self._blocked_until:
+            self._tokens -= 1
+            return
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, future))
+        self._schedule(0.0)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._tokens += 1  # токен выдан, но уже не нужен
+            raise
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+
+    def _pump(self) -> None:
+        self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and now >= self._blocked_until and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self._waiters:
+            self._schedule(max(self._blocked_until - now, (1 - self._tokens) / self.rate))
+
+
+class RetryBudget:
+    """Бюджет повторов: не больше ratio повторов на запрос (плюс min_per_second в секунду).
+
+    При массовых сбоях повторы не умножают нагрузку на API.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, cap: float = 50.0) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self._balance = cap
+        self._updated = time.monotonic()
+
+    def deposit(self) -> None:
+        now = time.monotonic()
+        self._balance = min(self.cap, self._balance + self.ratio + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def withdraw(self) -> bool:
+        self.deposit()
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+class OutboundSession(AiohttpSession):
+    """Сессия Bot API: общий пул соединений, лимиты скорости, приоритеты и повторы.
+
+    Каждый запрос ждёт токен своего чата (если в методе есть chat_id), а
+    отправка сообщений — ещё и общий токен в порядке приоритета полосы.
+    RetryAfter приостанавливает бакет чата; если 429 за время паузы получили
+    flood_chats разных чатов (или в методе нет chat_id), лимит общий, и
+    приостанавливается весь общий бакет. Ошибки 5xx и сети повторяются с
+    экспоненциальной задержкой — в пределах max_attempts и общего бюджета повторов.
+    """
+
+    def __init__(
+        self,
+        api: Optional[TelegramAPIServer] = None,
+        connections: int = 100,
+        rate: float = 30.0,
+        chat_rate: float = 3.0,
+        max_attempts: int = 3,
+        max_retry_wait: float = 30.0,
+        flood_chats: int = 3,
+    ) -> None:
+        if api is not None:
+            super().__init__(api=api, limit=connections)
+        else:
+            super().__init__(limit=connections)
+        self.limiter = PriorityRateLimiter(rate)
+        self.chat_rate = chat_rate
+        self.max_attempts = max(1, max_attempts)
+        self.max_retry_wait = max_retry_wait
+        self.retry_budget = RetryBudget()
+        self.retries = 0
+        self.flood_chats = max(1, flood_chats)
+        self._chat_buckets: Dict[Any, Tuple[TokenBucket, float]] = {}
+        self._flooded_chats: Dict[Any, float] = {}  # чат -> конец паузы после 429
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        now = time.monotonic()
+        item = self._chat_buckets.get(chat_id)
+        if item is None:
+            if len(self._chat_buckets) >= 10000:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if now - value[1] < 60
+                }
+            item = (TokenBucket(self.chat_rate, capacity=2 * self.chat_rate), now)
+        self._chat_buckets[chat_id] = (item[0], now)
+        return item[0]
+
+    def _pause_after_flood(self, chat_id: Any, seconds: float) -> None:
+        """Переносит RetryAfter в бакеты, чтобы повтор и соседние запросы подождали"""
+        if chat_id is None:
+            self.limiter.pause(seconds)
+            return
+        self._chat_bucket(chat_id).pause(seconds)
+        now = time.monotonic()
+        self._flooded_chats = {key: until for key, until in self._flooded_chats.items() if until > now}
+        self._flooded_chats[chat_id] = now + seconds
+        if len(self._flooded_chats) >= self.flood_chats:
+            self.limiter.pause(seconds)
+
+    async def make_request(self, bot: Bot, method: Any, timeout: Optional[int] = None) -> Any:
+        priority = api_lane.get()
+        chat_id = getattr(method, "chat_id", None)
+        name = getattr(method, "__api_method__", type(method).__name__)
+        globally_limited = name.startswith(GLOBALLY_LIMITED_PREFIXES)
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            if globally_limited:
+                await self.limiter.acquire(priority)
+            self.retry_budget.deposit()
+            started = time.perf_counter()
+            status = "ok"
+            try:
+                return await super().make_request(bot, method, timeout)
+            except TelegramRetryAfter as e:
+                status = "retry_after"
+                error: Exception = e
+                delay = 0.0
+                if e.retry_after > self.max_retry_wait:
+                    raise
+                self._pause_after_flood(chat_id, e.retry_after)
+                if chat_id is None and not globally_limited:
+                    delay = e.retry_after  # ни один бакет этот запрос не задержит
+            except (TelegramServerError, TelegramNetworkError) as e:
+                status = type(e).__name__
+                error = e
+                delay = min(self.max_retry_wait, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            except Exception as e:
+                status = type(e).__name__
+                raise
+            finally:
+                api_requests.inc(name, status)
+                api_request_seconds.observe(time.perf_counter() - started, name)
+            attempt += 1
+            if attempt >= self.max_attempts or not self.retry_budget.withdraw():
+                raise error
+            self.retries += 1
+            logging.debug("Повтор %s (%d): %s", type(method).__name__, attempt, error)
+            if delay:
+                await asyncio.sleep(delay)
+
+
+# ===== РЕЖИМ WEBHOOK =====
+
+@dataclass
+class ChatQueue:
+    """Очередь обновлений одного чата"""
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    waiting: int = 0
+    latest_nav: int = 0
+
+
+class ChatSchedulerMiddleware(BaseMiddleware):
+    """Планировщик обновлений: по порядку внутри чата, параллельно между чатами.
+
+    Нажатия кнопок и команды одного чата выполняются строго друг за другом
+    (двойное нажатие не запускает два обработчика одновременно), а всего
+    одновременно выполняется не больше limit обработчиков. Если за нажатием
+    open_dir: в очереди чата стоит ещё одно, старое пропускается: показать
+    нужно только последнюю выбранную папку.
+
+    Текстовый поиск и inline-запросы очередь чата не занимают: их порядок
+    держит SearchScheduler, который сам отбрасывает устаревшие запросы.
+    Встань они в очередь, следующий запрос начинался бы только после ответа
+    на предыдущий, и вытеснять было бы нечего.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self.coalesced = 0
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self._chats: Dict[int, ChatQueue] = {}
+        self._nav_seq = 0
+
+    @staticmethod
+    def is_ordered(event: TelegramObject) -> bool:
+        """Нужна ли обновлению очередь чата: нажатия кнопок и команды — да"""
+        if not isinstance(event, Update):
+            return True
+        if event.callback_query is not None:
+            return True
+        if event.message is not None:
+            return (event.message.text or "").startswith("/")
+        return False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat") or data.get("event_from_user")
+        if chat is None or not self.is_ordered(event):
+            async with self._semaphore:
+                return await handler(event, data)
+
+        queue = self._chats.get(chat.id)
+        if queue is None:
+            queue = self._chats[chat.id] = ChatQueue()
+        queue.waiting += 1
+        callback = event.callback_query if isinstance(event, Update) else None
+        nav_seq = 0
+        if callback is not None and (callback.data or "").startswith("open_dir:"):
+            self._nav_seq += 1
+            nav_seq = queue.latest_nav = self._nav_seq
+        try:
+            # asyncio.Lock будит ожидающих по очереди, поэтому порядок сохраняется
+            async with queue.lock:
+                if nav_seq and nav_seq != queue.latest_nav:
+                    self.coalesced += 1
+                    try:
+                        await callback.answer()
+                    except Exception:
+                        pass
+                    return None
+                async with self._semaphore:
+                    return await handler(event, data)
+        finally:
+            queue.waiting -= 1
+            if not queue.waiting:
+                self._chats.pop(chat.id, None)
+
+
+@dataclass
+class WebhookSettings:
+    """Настройки приёма обновлений через webhook"""
+    base_url: str
+    path: str
+    secret: str
+    host: str
+    port: int
+
+    @classmethod
+    def from_env(cls) -> "WebhookSettings":
+        secret = os.getenv("WEBHOOK_SECRET", "").strip()
+        if not secret:
+            secret = secrets.token_urlsafe(32)
+            logging.info("WEBHOOK_SECRET не задан, сгенерирован случайный секрет")
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", secret):
+            raise RuntimeError("WEBHOOK_SECRET: допустимы 1-256 символов A-Z, a-z, 0-9, _ и -")
+        path = os.getenv("WEBHOOK_PATH", "/webhook").strip() or "/webhook"
+        return cls(
+            base_url=os.getenv("WEBHOOK_BASE_URL", "").strip().rstrip("/"),
+            path=path if path.startswith("/") else f"/{path}",
+            secret=secret,
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0").strip(),
+            port=env_int("WEBHOOK_PORT", 8080),
+        )
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, settings: WebhookSettings) -> None:
+    """Принимает обновления HTTP-сервером aiohttp вместо long polling.
+
+    Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются.
+    Если задан WEBHOOK_BASE_URL, адрес регистрируется в Telegram через setWebhook.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=settings.secret,
+    ).register(app, path=settings.path)
+    setup_application(app, dp, bot=bot)
+
+    if settings.base_url:
+        await bot.set_webhook(
+            f"{settings.base_url}{settings.path}",
+            secret_token=settings.secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
     else:
-        stats_text += "🚀 Начните изучение с базовых разделов!"
-    
-    await callback.message.edit_text(stats_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
-    ]), parse_mode=ParseMode.HTML)
-    await callback.answer()
+        logging.info("WEBHOOK_BASE_URL не задан: setWebhook не вызывается")
 
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.host, port=settings.port)
+    await site.start()
+    logging.info("Webhook слушает http://%s:%s%s", settings.host, settings.port, settings.path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
-@router.callback_query(F.data == "home")
-async def on_home_callback(callback: CallbackQuery) -> None:
-    await clear_user_messages(callback.message.bot, callback.message.chat.id)
-    user_id = callback.from_user.id
-    if user_id not in user_progress:
-        user_progress[user_id] = {}
-    
-    greeting = (
-        "🎯 <b>Добро пожаловать в Kali Linux Academy!</b>\n\n"
-        "🔥 <i>Ваш персональный гид по кибербезопасности</i>\n\n"
-        "📚 <b>Что вас ждёт:</b>\n"
-        "🟢 <b>Базовый уровень</b> — основы и введение\n"
-        "🟡 <b>Средний уровень</b> — практические атаки\n"
-        "🔴 <b>Продвинутый уровень</b> — экспертные техники\n\n"
-        "✨ <b>Особенности:</b>\n"
-        "• Автоматические уведомления о новых материалах\n"
-        "• Отслеживание прогресса изучения\n"
-        "• Поиск по всем материалам\n"
-        "• Красивое оформление с цветовой индикацией\n\n"
-        "🚀 <b>Начните изучение прямо сейчас!</b>"
+def create_bot(token: str) -> Bot:
+    """Бот с сессией к официальному Bot API или к TELEGRAM_API_URL (например, локальная заглушка)"""
+    api_url = os.getenv("TELEGRAM_API_URL", "").strip()
+    session = OutboundSession(
+        api=TelegramAPIServer.from_base(api_url) if api_url else None,
+        connections=env_int("API_CONNECTIONS", 100),
+        rate=env_int("API_RATE", 30),
+        chat_rate=env_int("API_CHAT_RATE", 3),
+        max_attempts=env_int("API_MAX_ATTEMPTS", 3),
     )
-    await callback.message.edit_text(greeting, reply_markup=build_home_keyboard(user_id), parse_mode=ParseMode.HTML)
-    await callback.answer()
+    return Bot(token=token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
 
-# ===== ПОИСК ПО ТЕКСТУ =====
+# ===== НЕСКОЛЬКО ПРОЦЕССОВ =====
 
-@router.message()
-async def on_text_search(message: Message) -> None:
-    if not message.text or message.text.startswith('/'):
-        return
-    
-    search_term = message.text.lower().strip()
-    if len(search_term) < 2:
-        await message.answer("🔍 Введите минимум 2 символа для поиска.")
-        return
-    
-    results = []
-    for file_path in scan_all_txt():
+CONTENT_VERSION_KEY = "content_version"
+
+
+def update_shard_key(raw: Mapping[str, Any]) -> int:
+    """Ключ распределения «сырого» обновления по процессам: id пользователя.
+
+    Прогресс хранится по пользователю, поэтому все его обновления (из лички
+    и из групп) должен обрабатывать один воркер. В личке id пользователя
+    совпадает с chat_id, так что порядок внутри личного чата сохраняется.
+    Обновления без отправителя (посты каналов) распределяются по чату.
+    """
+    for key, event in raw.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return int(user["id"])
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return int(chat["id"])
+    return 0
+
+
+class LeaderLock:
+    """Выбор ведущего процесса: эксклюзивный flock на файле.
+
+    Блокировку держит ровно один процесс; когда он завершается (в том числе
+    аварийно), ядро снимает её и ведущим становится следующий претендент.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            raise RuntimeError("Выбор ведущего процесса требует fcntl (Linux/macOS)")
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
         try:
-            content = read_text_file(file_path).lower()
-            if search_term in content or search_term in file_path.lower():
-                # Находим контекст вокруг найденного слова
-                lines = content.split('\n')
-                matching_lines = []
-                for i, line in enumerate(lines):
-                    if search_term in line:
-                        start = max(0, i-1)
-                        end = min(len(lines), i+2)
-                        context = '\n'.join(lines[start:end])
-                        matching_lines.append(context[:200] + "..." if len(context) > 200 else context)
-                        if len(matching_lines) >= 3:  # Ограничиваем количество результатов
-                            break
-                
-                if matching_lines:
-                    results.append((file_path, matching_lines))
-        except Exception as e:
-            logging.warning(f"Ошибка при поиске в файле {file_path}: {e}")
-    
-    if not results:
-        await message.answer(
-            f"🔍 По запросу '{search_term}' ничего не найдено.\n\n"
-            "Попробуйте другие ключевые слова или проверьте правописание.",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🏠 Главная", callback_data="home")]
-            ]),
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+async def sync_ordinals(store: StateStore, rescan: bool = True, promote: bool = False) -> None:
+    """Подтягивает номера уроков из общего хранилища.
+
+    promote — процесс стал ведущим и дальше сам выдаёт номера новым урокам.
+    Если часть уроков снимка получила номера только сейчас, снимок
+    перестраивается, чтобы они попали в маски прогресса.
+    """
+    known = len(lesson_ordinals)
+    lesson_ordinals.merge(await io_executor.run(store.load_ordinals))
+    if promote:
+        lesson_ordinals.assigning = True
+    if rescan:
+        await refresh_content()
+    current = content_catalog
+    if len(current.ordinals) < len(current.files) and (promote or len(lesson_ordinals) > known):
+        set_catalog(await io_executor.run(ContentCatalog, dict(current.dirs), dict(current.files)))
+
+
+async def run_shard_roles(bot: Bot, lock: LeaderLock, store: StateStore, interval: float = 2.0) -> None:
+    """Фоновые роли процесса-воркера.
+
+    Ведущий наблюдает за папкой, рассылает уведомления, выдаёт номера новым
+    урокам и публикует версию каталога (вместе с номерами) в общем
+    хранилище. Остальные процессы опрашивают эту версию и перестраивают свой
+    каталог вслед за ним, номера уроков они только загружают.
+    """
+    watch_task: Optional[asyncio.Task] = None
+    published: Optional[str] = None
+    try:
+        while True:
+            if not lock.held and await io_executor.run(lock.try_acquire):
+                logging.info("Процесс %d стал ведущим: наблюдение за папкой и рассылка", os.getpid())
+                # Контрольная точка рассылки могла остаться от прежнего ведущего
+                checkpoint = await io_executor.run(store.read_meta, BroadcastEngine.CHECKPOINT_KEY)
+                if checkpoint:
+                    state_writer.meta[BroadcastEngine.CHECKPOINT_KEY] = checkpoint
+                await sync_ordinals(store, promote=True)
+                watch_task = asyncio.create_task(watch_info_changes(bot))
+                broadcast_engine.start(bot)
+            if lock.held:
+                if content_catalog.version != published:
+                    # Номера новых уроков уходят в той же пачке, что и версия
+                    state_writer.set_meta(CONTENT_VERSION_KEY, content_catalog.version)
+                    await state_writer.flush()
+                    published = content_catalog.version
+            else:
+                version = await io_executor.run(store.read_meta, CONTENT_VERSION_KEY)
+                if version and version != content_catalog.version:
+                    await sync_ordinals(store)
+                elif len(content_catalog.ordinals) < len(content_catalog.files):
+                    # Файлы увидели раньше ведущего: ждём выданных им номеров
+                    await sync_ordinals(store, rescan=False)
+            await asyncio.sleep(interval)
+    finally:
+        if watch_task is not None:
+            watch_task.cancel()
+
+
+async def worker_main(index: int, updates: "multiprocessing.Queue") -> None:
+    """Процесс-воркер: обрабатывает обновления своей доли чатов из очереди супервизора"""
+    load_settings()
+    token = read_token()
+    # Номера уроков выдаёт только ведущий (см. run_shard_roles)
+    lesson_ordinals.assigning = False
+    store = await prepare_runtime()
+    broadcast_engine.subscriber_source = store.load_subscribers
+    dp = create_dispatcher()
+    lock = LeaderLock(Path(os.getenv("LEADER_LOCK_PATH") or APP_ROOT / "bot.leader.lock"))
+    slots = asyncio.Semaphore(env_int("HANDLER_CONCURRENCY", 64))
+    loop = asyncio.get_running_loop()
+
+    async def feed(raw: Dict[str, Any]) -> None:
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception:
+            logging.exception("Ошибка обработки обновления %s", raw.get("update_id"))
+        finally:
+            slots.release()
+
+    async with create_bot(token) as bot:
+        state_writer.start()
+        # Воркер i отдаёт метрики на METRICS_PORT + 1 + i
+        metrics_runner = await start_monitoring(index + 1)
+        roles = asyncio.create_task(run_shard_roles(bot, lock, store))
+        pending: set[asyncio.Task] = set()
+        logging.info("Воркер %d (pid %d) запущен", index, os.getpid())
+        try:
+            while True:
+                # Свободный слот берётся до чтения: переполненный воркер тормозит свою очередь
+                await slots.acquire()
+                raw = await loop.run_in_executor(None, updates.get)
+                if raw is None:
+                    slots.release()
+                    break
+                task = asyncio.create_task(feed(raw))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            roles.cancel()
+            try:
+                await roles
+            except asyncio.CancelledError:
+                pass
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            await shutdown_runtime()
+            lock.release()
+
+
+def run_worker(index: int, updates: "multiprocessing.Queue") -> None:
+    """Точка входа процесса-воркера (multiprocessing, spawn)"""
+    # Ctrl+C получает вся группа процессов; воркер останавливает супервизор через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    try:
+        asyncio.run(worker_main(index, updates))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+class ShardSupervisor:
+    """Принимает обновления и раздаёт их процессам-воркерам по update_shard_key.
+
+    Ключ — id отправителя: все обновления одного пользователя (из лички и из
+    групп) попадают в один процесс, а в личке он совпадает с chat_id, так что
+    личный чат целиком обслуживает один воркер. Подписчики, прогресс и номера
+    уроков хранятся в общей базе SQLite (WAL), прогресс объединяется по OR.
+    Упавший воркер перезапускается с той же очередью.
+
+    Цена ключа по пользователю — групповые чаты: обновления разных участников
+    одной группы уходят в разные процессы. Порядок ChatSchedulerMiddleware
+    соблюдается только внутри воркера, а user_content_messages группы у
+    каждого воркера свой, так что очистка удаляет лишь сообщения, отправленные
+    этим воркером.
+    """
+
+    def __init__(self, workers: int, queue_limit: int = 1000) -> None:
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(maxsize=max(1, queue_limit)) for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self._stopping = False
+
+    def _spawn(self, index: int) -> None:
+        process = self._ctx.Process(
+            target=run_worker, args=(index, self.queues[index]), name=f"bot-worker-{index}",
         )
-        return
-    
-    # Отправляем результаты поиска
-    response = f"🔍 Результаты поиска по запросу: '{search_term}'\n\n"
-    
-    for i, (file_path, contexts) in enumerate(results[:5]):  # Ограничиваем 5 результатами
-        file_name = Path(file_path).name
-        emoji = get_emoji(file_name)
-        response += f"{i+1}. {emoji} {file_name}\n"
-        response += f"Путь: {file_path}\n"
-        
-        # Добавляем кнопку для открытия файла
-        file_id = path_registry.get_id("file", file_path)
-        
-        for context in contexts[:2]:  # Показываем максимум 2 контекста
-            response += f"{context}\n"
-        
-        response += "\n"
-    
-    if len(results) > 5:
-        response += f"... и ещё {len(results) - 5} результатов\n\n"
-    
-    # Кнопки для навигации
-    buttons = []
-    for i, (file_path, _) in enumerate(results[:3]):  # Кнопки для первых 3 результатов
-        file_name = Path(file_path).name
-        file_id = path_registry.get_id("file", file_path)
-        buttons.append([InlineKeyboardButton(text=f"📖 {file_name}", callback_data=f"open_file:{file_id}")])
-    
-    buttons.append([InlineKeyboardButton(text="🏠 Главная", callback_data="home")])
-    
-    await message.answer(response, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode=ParseMode.HTML)
+        process.start()
+        self.processes[index] = process
 
+    def start(self) -> None:
+        for index in range(len(self.queues)):
+            self._spawn(index)
 
-# ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ МОНИТОРИНГА =====
+    async def dispatch(self, raw: Dict[str, Any]) -> None:
+        updates = self.queues[update_shard_key(raw) % len(self.queues)]
+        try:
+            updates.put_nowait(raw)
+        except QueueFull:
+            await asyncio.get_running_loop().run_in_executor(None, updates.put, raw)
 
-def scan_all_txt() -> set[str]:
-    """Сканирует все .txt файлы в папке Информация"""
-    files: set[str] = set()
-    for path in INFO_ROOT.rglob("*.txt"):
-        rel = path.relative_to(INFO_ROOT).as_posix()
-        files.add(rel)
-    return files
+    async def supervise(self, interval: float = 2.0) -> None:
+        """Перезапускает завершившиеся воркеры"""
+        while not self._stopping:
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logging.warning("Воркер %d завершился (код %s), перезапуск", index, process.exitcode)
+                    self._spawn(index)
+            await asyncio.sleep(interval)
 
+    async def poll(self, bot: Bot, allowed_updates: List[str]) -> None:
+        """Long polling в супервизоре; обработка — в воркерах"""
+        offset: Optional[int] = None
+        backoff = 1.0
+        while True:
+            try:
+                batch = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logging.warning("getUpdates: %s, повтор через %.0f с", e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+            backoff = 1.0
+            for update in batch:
+                offset = update.update_id + 1
+                await self.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
 
-async def watch_info_changes(bot: Bot, interval_seconds: int = 10) -> None:
-    """Фоновый мониторинг папки на предмет новых файлов"""
-    global known_files
-    known_files = scan_all_txt()
-    while True:
+    async def serve_webhook(self, bot: Bot, settings: WebhookSettings, allowed_updates: List[str]) -> None:
+        """Webhook в супервизоре: тело запроса передаётся воркеру без разбора"""
+        async def handle(request: web.Request) -> web.Response:
+            if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != settings.secret:
+                return web.Response(status=401)
+            await self.dispatch(await request.json())
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(settings.path, handle)
+        if settings.base_url:
+            await bot.set_webhook(
+                f"{settings.base_url}{settings.path}",
+                secret_token=settings.secret,
+                allowed_updates=allowed_updates,
+            )
+        else:
+            logging.info("WEBHOOK_BASE_URL не задан: setWebhook не вызывается")
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host=settings.host, port=settings.port).start()
+        logging.info("Webhook слушает http://%s:%s%s", settings.host, settings.port, settings.path)
         try:
-            current = scan_all_txt()
-            new_files = current - known_files
-            if new_files:
-                for rel in sorted(new_files):
-                    parent_dir = str(Path(rel).parent.as_posix()) if Path(rel).parent.as_posix() != "." else ""
-                    file_id = path_registry.get_id("file", rel)
-                    dir_id = path_registry.get_id("dir", parent_dir)
-                    kb = InlineKeyboardMarkup(
-                        inline_keyboard=[
-                            [InlineKeyboardButton(text="📘 Открыть файл", callback_data=f"open_file:{file_id}")],
-                            [InlineKeyboardButton(text="📂 Открыть раздел", callback_data=f"open_dir:{dir_id}")],
-                        ]
-                    )
-                    for chat_id in list(subscribers):
-                        try:
-                            await bot.send_message(chat_id, f"🆕 Добавлен новый материал: {rel}", reply_markup=kb)
-                        except Exception as e:
-                            logging.warning("Не удалось отправить уведомление %s: %s", chat_id, e)
-                known_files = current
-        except Exception as e:
-            logging.warning("Ошибка в наблюдателе папки: %s", e)
-        await asyncio.sleep(interval_seconds)
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
 
+    def stop(self, timeout: float = 30.0) -> None:
+        """Останавливает воркеры: метка конца очереди, затем ожидание сброса состояния"""
+        self._stopping = True
+        for updates in self.queues:
+            try:
+                updates.put(None, timeout=timeout)
+            except QueueFull:
+                pass
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                logging.warning("Воркер %d не остановился за %.0f с, принудительное завершение", index, timeout)
+                process.terminate()
+                process.join()
 
-# ===== ГЛАВНАЯ ФУНКЦИЯ ЗАПУСКА =====
 
-async def main() -> None:
-    """Основная функция запуска бота"""
+async def run_supervisor(workers: int) -> None:
+    """Несколько процессов-воркеров с общим состоянием в SQLite"""
     logging.basicConfig(level=logging.INFO)
-    ensure_info_root()
+    load_settings()
+    token = read_token()
+    if os.getenv("STATE_BACKEND", "sqlite").strip().lower() != "sqlite":
+        raise RuntimeError("Для нескольких процессов нужен STATE_BACKEND=sqlite (общее хранилище)")
+    run_mode = read_run_mode()
+    webhook_settings = WebhookSettings.from_env() if run_mode == "webhook" else None
+    allowed_updates = create_dispatcher().resolve_used_update_types()
+
+    supervisor = ShardSupervisor(workers, env_int("WORKER_QUEUE_LIMIT", 1000))
+    supervisor.start()
+    try:
+        async with create_bot(token) as bot:
+            await bot.get_me()
+            monitor = asyncio.create_task(supervisor.supervise())
+            try:
+                if webhook_settings is not None:
+                    await supervisor.serve_webhook(bot, webhook_settings, allowed_updates)
+                else:
+                    await supervisor.poll(bot, allowed_updates)
+            finally:
+                monitor.cancel()
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, supervisor.stop)
+
 
-    # Загрузка токена из .env
+# ===== ГЛАВНАЯ ФУНКЦИЯ ЗАПУСКА =====
+
+def load_settings() -> None:
+    """Загрузка настроек и токена из .env"""
     env_path = APP_ROOT / ".env"
     load_dotenv(dotenv_path=env_path, override=False)
+
+
+def read_token() -> str:
     token = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("BOT_TOKEN")
     
     if not token:
@@ -617,12 +4096,80 @@ async def main() -> None:
     token = token.strip()
     if "PASTE_YOUR_TOKEN_HERE" in token or token == "":
         raise RuntimeError("В .env оставлен плейсхолдер токена. Вставьте реальный токен от @BotFather")
+    return token
 
-    # Создание бота и диспетчера
+
+def read_run_mode() -> str:
+    run_mode = os.getenv("RUN_MODE", "polling").strip().lower()
+    if run_mode not in ("polling", "webhook"):
+        raise RuntimeError(f"Неизвестный RUN_MODE: {run_mode} (ожидается polling или webhook)")
+    return run_mode
+
+
+async def prepare_runtime() -> StateStore:
+    """Пул ввода-вывода, восстановление состояния и первый снимок каталога"""
+    io_executor.configure(env_int("IO_WORKERS", 4), env_int("IO_QUEUE_LIMIT", 64))
+    keyboard_cache.max_bytes = env_int("KEYBOARD_CACHE_BYTES", keyboard_cache.max_bytes)
+    await io_executor.run(ensure_info_root)
+    await io_executor.run(emoji_classifier.load, EMOJI_RULES_PATH)
+
+    # Восстановление подписчиков и прогресса (до первого снимка: номера уроков)
+    store = open_state_store(os.getenv("STATE_BACKEND", "sqlite"), os.getenv("STATE_PATH"))
+    state_writer.configure(store, env_int("STATE_FLUSH_INTERVAL", 2), env_int("STATE_MAX_DIRTY", 1000))
+    state_writer.restore(await io_executor.run(store.load))
+    await refresh_content()
+    broadcast_engine.configure(env_int("BROADCAST_CONCURRENCY", 16))
+    search_scheduler.configure(env_int("SEARCH_CONCURRENCY", 2), env_int("SEARCH_DEBOUNCE_MS", 300) / 1000)
+    ADMIN_IDS.update(int(part) for part in re.findall(r"-?\d+", os.getenv("ADMIN_IDS", "")))
+    global INLINE_CACHE_TIME
+    INLINE_CACHE_TIME = env_int("INLINE_CACHE_TIME", INLINE_CACHE_TIME)
+    return store
+
+
+async def start_monitoring(port_offset: int = 0) -> Optional[web.AppRunner]:
+    """Замер задержки цикла, сторож блокировок и, если задан METRICS_PORT, HTTP-сервер метрик"""
+    loop_watchdog.configure(env_int("SLOW_CALLBACK_MS", 250) / 1000, env_int("SLOW_LOG_SIZE", 50))
+    loop_watchdog.start()
+    asyncio.create_task(sample_loop_lag(loop_watchdog.beat_interval))
+    port = env_int("METRICS_PORT", 0)
+    if not port:
+        return None
+    return await start_metrics_server(os.getenv("METRICS_HOST", "127.0.0.1").strip(), port + port_offset)
+
+
+async def shutdown_runtime() -> None:
+    """Останавливает фоновые задачи и сохраняет состояние"""
+    await broadcast_engine.close()
+    await cleanup_queue.close()
+    try:
+        await state_writer.close()
+    except Exception as e:
+        logging.error("Не удалось сохранить состояние при остановке: %s", e)
+    search_scheduler.shutdown()
+    loop_watchdog.stop()
+    io_executor.shutdown()
+
+
+def create_dispatcher() -> Dispatcher:
     dp = Dispatcher(storage=MemoryStorage())
+    dp.update.outer_middleware(ChatSchedulerMiddleware(env_int("HANDLER_CONCURRENCY", 64)))
     dp.include_router(router)
+    return dp
+
+
+async def main() -> None:
+    """Основная функция запуска бота"""
+    logging.basicConfig(level=logging.INFO)
+    load_settings()
+    await prepare_runtime()
+    token = read_token()
+    run_mode = read_run_mode()
+    webhook_settings = WebhookSettings.from_env() if run_mode == "webhook" else None
+
+    # Создание бота и диспетчера
+    dp = create_dispatcher()
     
-    async with Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.HTML)) as bot:
+    async with create_bot(token) as bot:
         # Проверка токена
         try:
             await bot.get_me()
@@ -630,15 +4177,37 @@ async def main() -> None:
             logging.error("Проверка токена не пройдена: %r", e)
             raise RuntimeError(f"Ошибка при проверке токена: {str(e)}")
 
-        # Запуск фонового мониторинга и polling
+        # Запуск фонового мониторинга, записи состояния и приёма обновлений
         asyncio.create_task(watch_info_changes(bot))
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        state_writer.start()
+        broadcast_engine.start(bot)
+        metrics_runner = await start_monitoring()
+        try:
+            if webhook_settings is not None:
+                await run_webhook(dp, bot, webhook_settings)
+            else:
+                await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        finally:
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            await shutdown_runtime()
 
 
 # ===== ТОЧКА ВХОДА =====
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kali Linux Academy — Telegram-бот")
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="число процессов-воркеров (по умолчанию WORKERS из .env или 1 — один процесс)",
+    )
+    args = parser.parse_args()
     try:
-        asyncio.run(main())
+        load_settings()
+        workers = args.workers if args.workers is not None else env_int("WORKERS", 1)
+        if workers > 1:
+            asyncio.run(run_supervisor(workers))
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         pass
@@ -0,0 +1,316 @@
+"""Локальная заглушка Telegram Bot API и генератор синтетических обновлений.
+
+Позволяет замерить пропускную способность бота в режиме webhook без сети
+и без настоящего токена (см. РАЗВЕРТЫВАНИЕ.md, «Нагрузочная проверка»).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import time
+from collections import Counter
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+
+# ===== ЗАГЛУШКА BOT API =====
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Kali Linux Academy", "username": "fake_academy_bot"}
+
+
+class FakeTelegramAPI:
+    """Отвечает на любые методы Bot API правдоподобными результатами.
+
+    flood_limit > 0 — больше этого числа вызовов в секунду получают 429 с
+    retry_after; error_rate — доля ответов 502 (проверка повторов бота).
+    fail_next() задаёт ошибки для ближайших вызовов — для тестов.
+    """
+
+    def __init__(self, flood_limit: int = 0, error_rate: float = 0.0, seed: int = 0) -> None:
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self.started_at = time.monotonic()
+        self.flood_limit = flood_limit
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._window = 0
+        self._window_calls = 0
+        self._scripted: List[Tuple[int, int]] = []
+
+    def fail_next(self, status: int, count: int = 1, retry_after: int = 1) -> None:
+        """Следующие count вызовов получат status (429 — с retry_after секунд)"""
+        self._scripted.extend([(status, retry_after)] * count)
+
+    def _reject(self, status: int, retry_after: int = 1) -> web.Response:
+        self.rejected[status] += 1
+        if status == 429:
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+        return web.json_response({
+            "ok": False, "error_code": status, "description": HTTPStatus(status).phrase,
+        }, status=status)
+
+    def _failure(self) -> Optional[web.Response]:
+        """Имитация 429 и 5xx: None, если запрос нужно обслужить"""
+        if self._scripted:
+            return self._reject(*self._scripted.pop(0))
+        if self.flood_limit:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window, self._window_calls = window, 0
+            self._window_calls += 1
+            if self._window_calls > self.flood_limit:
+                return self._reject(429)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return self._reject(502)
+        return None
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def result_for(self, method: str, params: Dict[str, Any]) -> Any:
+        method = method.lower()
+        if method == "getme":
+            return BOT_USER
+        if method in ("sendmessage", "editmessagetext", "editmessagereplymarkup"):
+            return self._message(params)
+        if method == "getupdates":
+            return []
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        self.calls[method] += 1
+        return web.json_response({"ok": True, "result": self.result_for(method, params)})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        elapsed = time.monotonic() - self.started_at
+        total = sum(self.calls.values())
+        return web.json_response({
+            "elapsed_seconds": round(elapsed, 3),
+            "total_calls": total,
+            "calls_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+            "by_method": dict(self.calls),
+            "rejected": {str(status): count for status, count in self.rejected.items()},
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def serve(host: str, port: int, flood_limit: int = 0, error_rate: float = 0.0) -> None:
+    api = FakeTelegramAPI(flood_limit, error_rate)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info("Заглушка Bot API: http://%s:%s (статистика: /stats)", host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+# ===== СИНТЕТИЧЕСКИЕ ОБНОВЛЕНИЯ =====
+
+SEARCH_WORDS = ["kali", "linux", "команды", "атака", "фишинг", "система", "nmap", "пользователь"]
+CALLBACK_DATA = ["home", "stats", "search"]
+
+
+def navigation_callbacks(info_dir: Path) -> List[str]:
+    """callback_data кнопок навигации по реальному дереву материалов.
+
+    id детерминированы (хэш вида и пути), поэтому их можно вычислить заранее.
+    """
+    from bot import callback_id
+
+    data: List[str] = []
+    for abs_dir, _, file_names in os.walk(info_dir):
+        rel_dir = Path(abs_dir).relative_to(info_dir).as_posix()
+        rel_dir = "" if rel_dir == "." else rel_dir
+        data.append(f"open_dir:{callback_id('dir', rel_dir)}")
+        for name in file_names:
+            if name.lower().endswith(".txt"):
+                rel = f"{rel_dir}/{name}" if rel_dir else name
+                data.append(f"open_file:{callback_id('file', rel)}")
+                data.append(f"page:{callback_id('file', rel)}:1")
+    return data
+
+
+def _user(chat_id: int) -> Dict[str, Any]:
+    return {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    message: Dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": _user(chat_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, chat_id: int, data: str) -> Dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
+
+
+def inline_update(update_id: int, chat_id: int, query: str) -> Dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "inline_query": {"id": str(update_id), "from": _user(chat_id), "query": query, "offset": ""},
+    }
+
+
+def synthetic_updates(
+    count: int, chats: int, seed: int = 0, callbacks: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Смесь команд, нажатий кнопок, поисковых и inline-запросов от chats пользователей"""
+    rnd = random.Random(seed)
+    callbacks = callbacks or CALLBACK_DATA
+    updates: List[Dict[str, Any]] = []
+    for update_id in range(1, count + 1):
+        chat_id = rnd.randint(1, chats)
+        roll = rnd.random()
+        if roll < 0.1:
+            updates.append(message_update(update_id, chat_id, rnd.choice(["/start", "/stats", "/search"])))
+        elif roll < 0.3:
+            updates.append(message_update(update_id, chat_id, rnd.choice(SEARCH_WORDS)))
+        elif roll < 0.4:
+            word = rnd.choice(SEARCH_WORDS)
+            updates.append(inline_update(update_id, chat_id, word[:rnd.randint(2, len(word))]))
+        else:
+            updates.append(callback_update(update_id, chat_id, rnd.choice(callbacks)))
+    return updates
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Квантиль q по ближайшему рангу; 0.0 для пустой выборки"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def load(webhook: str, secret: str, updates: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    """POST-ит обновления на webhook и возвращает сводку по задержкам"""
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    queue = iter(updates)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+    async with ClientSession(
+        connector=TCPConnector(limit=concurrency),
+        timeout=ClientTimeout(total=60),
+    ) as session:
+        async def worker() -> None:
+            for update in queue:
+                started = time.perf_counter()
+                async with session.post(webhook, data=json.dumps(update), headers={
+                    **headers, "Content-Type": "application/json",
+                }) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started_at
+
+    return {
+        "updates": len(updates),
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "statuses": dict(statuses),
+    }
+
+
+# ===== ТОЧКА ВХОДА =====
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_cmd = commands.add_parser("serve", help="запустить заглушку Bot API")
+    serve_cmd.add_argument("--host", default="127.0.0.1")
+    serve_cmd.add_argument("--port", type=int, default=8081)
+    serve_cmd.add_argument("--flood-limit", type=int, default=0, help="вызовов в секунду до ответа 429 (0 — без лимита)")
+    serve_cmd.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 502")
+
+    load_cmd = commands.add_parser("load", help="отправить синтетические обновления на webhook")
+    load_cmd.add_argument("--webhook", default="http://127.0.0.1:8080/webhook")
+    load_cmd.add_argument("--secret", default="")
+    load_cmd.add_argument("--updates", type=int, default=1000)
+    load_cmd.add_argument("--chats", type=int, default=100)
+    load_cmd.add_argument("--concurrency", type=int, default=20)
+    load_cmd.add_argument("--seed", type=int, default=0)
+    load_cmd.add_argument(
+        "--info-dir", default=str(Path(__file__).resolve().parent / "Информация"),
+        help="дерево материалов для кнопок навигации (пустая строка — без навигации)",
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        asyncio.run(serve(args.host, args.port, args.flood_limit, args.error_rate))
+    else:
+        callbacks = list(CALLBACK_DATA)
+        if args.info_dir and Path(args.info_dir).is_dir():
+            callbacks += navigation_callbacks(Path(args.info_dir))
+        updates = synthetic_updates(args.updates, args.chats, args.seed, callbacks)
+        report = asyncio.run(load(args.webhook, args.secret, updates, args.concurrency))
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,28 @@
+"""Общие фикстуры тестов: модули бота импортируются из корня репозитория"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def info_root(tmp_path, monkeypatch):
+    """Пустая папка Информация во временном каталоге вместо настоящей"""
+    root = (tmp_path / bot.INFO_DIR_NAME).resolve()
+    root.mkdir()
+    monkeypatch.setattr(bot, "INFO_ROOT", root)
+    monkeypatch.setattr(bot, "lesson_ordinals", bot.LessonOrdinals())
+    return root
+
+
+def write_lesson(root: Path, rel_path: str, text: str = "урок") -> Path:
+    path = root / rel_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return path
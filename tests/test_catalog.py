@@ -0,0 +1,89 @@
+"""Снимок каталога: полный обход, перечитывание папок, символьные ссылки"""
+import os
+import shutil
+
+import pytest
+
+import bot
+from conftest import write_lesson
+
+
+def assert_same(catalog, full):
+    assert dict(catalog.dirs) == dict(full.dirs)
+    assert dict(catalog.files) == dict(full.files)
+    assert catalog.version == full.version
+    assert dict(catalog.dir_masks) == dict(full.dir_masks)
+
+
+@pytest.fixture
+def tree(info_root):
+    write_lesson(info_root, "01. Введение/01. Что такое Kali.txt")
+    write_lesson(info_root, "01. Введение/02. Установка.txt")
+    write_lesson(info_root, "02. Атаки/01. Фишинг/01. Основы.txt")
+    write_lesson(info_root, "02. Атаки/02. Пароли.txt")
+    write_lesson(info_root, "00. Начало.txt")
+    (info_root / "02. Атаки/картинка.png").write_bytes(b"")
+    return info_root
+
+
+def test_full_build_lists_dirs_and_txt_files(tree):
+    catalog = bot.ContentCatalog.build(tree)
+
+    dirs, files = catalog.list_dir("02. Атаки")
+    assert dirs == [("01. Фишинг", "02. Атаки/01. Фишинг")]
+    assert files == [("02. Пароли", "02. Атаки/02. Пароли.txt")]
+    assert catalog.dirs[""].total_files == 5
+    assert catalog.dirs["02. Атаки"].total_files == 2
+
+
+@pytest.mark.parametrize("change, rel_dirs", [
+    (lambda root: write_lesson(root, "01. Введение/03. Новый.txt"), ["01. Введение"]),
+    (lambda root: os.remove(root / "02. Атаки/02. Пароли.txt"), ["02. Атаки"]),
+    (lambda root: write_lesson(root, "03. Новый раздел/01. Урок.txt"), [""]),
+    (lambda root: shutil.rmtree(root / "02. Атаки/01. Фишинг"), ["02. Атаки/01. Фишинг"]),
+    (lambda root: os.rename(root / "01. Введение", root / "02. Атаки/01. Введение"), ["", "02. Атаки"]),
+    (lambda root: os.rename(root / "00. Начало.txt", root / "01. Введение/00. Начало.txt"), ["", "01. Введение"]),
+])
+def test_rescan_of_changed_dirs_matches_full_build(tree, change, rel_dirs):
+    old = bot.ContentCatalog.build(tree)
+    change(tree)
+
+    assert_same(old.rescan(tree, rel_dirs), bot.ContentCatalog.build(tree))
+
+
+def test_rescan_of_removed_root_gives_empty_catalog(tree):
+    old = bot.ContentCatalog.build(tree)
+    shutil.rmtree(tree)
+
+    rescanned = old.rescan(tree, [""])
+    assert list(rescanned.files) == []
+
+
+def test_symlinks_out_of_tree_are_skipped(tree, tmp_path):
+    outside = tmp_path / "outside"
+    write_lesson(outside, "секрет.txt")
+    os.symlink(outside, tree / "ссылка на папку")
+    os.symlink(outside / "секрет.txt", tree / "секрет.txt")
+
+    catalog = bot.ContentCatalog.build(tree)
+
+    assert "ссылка на папку" not in catalog.dirs
+    assert "секрет.txt" not in catalog.files
+
+
+def test_symlink_loop_does_not_recurse(tree):
+    os.symlink(tree, tree / "01. Введение/петля")
+
+    catalog = bot.ContentCatalog.build(tree)
+
+    assert not any("петля" in rel for rel in catalog.dirs)
+
+
+def test_symlinked_file_inside_tree_and_broken_link(tree):
+    os.symlink(tree / "00. Начало.txt", tree / "01. Введение/00. Ссылка.txt")
+    os.symlink(tree / "нет такого.txt", tree / "битая.txt")
+
+    catalog = bot.ContentCatalog.build(tree)
+
+    assert "01. Введение/00. Ссылка.txt" in catalog.files
+    assert "битая.txt" not in catalog.files
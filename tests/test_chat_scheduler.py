@@ -0,0 +1,93 @@
+"""Очередь чата (ChatSchedulerMiddleware) вместе с планировщиком поиска"""
+import asyncio
+import time
+
+from aiogram.types import Update
+
+import bot
+from fake_telegram import callback_update, inline_update, message_update
+
+
+def feed(middleware, handler, raw):
+    update = Update.model_validate(raw)
+    if update.callback_query is not None:
+        source = update.callback_query
+        chat = source.message.chat
+    elif update.inline_query is not None:
+        source, chat = update.inline_query, None
+    else:
+        source = update.message
+        chat = source.chat
+    return middleware(handler, update, {"event_chat": chat, "event_from_user": source.from_user})
+
+
+def slow_search(query, limit, max_contexts):
+    time.sleep(0.05)
+    return bot.SearchResults(total=0, hits=[])
+
+
+def run_burst(monkeypatch, updates, extract):
+    """Подаёт обновления с паузой 5 мс и возвращает запросы, на которые пришёл ответ"""
+    scheduler = bot.SearchScheduler(workers=2, debounce=0.0)
+    monkeypatch.setattr(bot, "search_scheduler", scheduler)
+    monkeypatch.setattr(bot.search_index, "search", slow_search)
+    bot.search_cache.clear()
+    answered = []
+
+    async def handler(update, data):
+        user_id, query, channel = extract(update)
+        results = await bot.search_scheduler.search(user_id, query, channel=channel)
+        if results is not None:
+            answered.append(query)
+
+    async def run():
+        middleware = bot.ChatSchedulerMiddleware(8)
+        tasks = []
+        for raw in updates:
+            tasks.append(asyncio.create_task(feed(middleware, handler, raw)))
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*tasks)
+
+    try:
+        asyncio.run(run())
+    finally:
+        scheduler.shutdown()
+    return answered
+
+
+def test_rapid_text_searches_supersede_through_middleware(monkeypatch):
+    queries = ["k", "ka", "kal", "kali", "kali l", "kali linux"]
+    updates = [message_update(i, 42, query) for i, query in enumerate(queries, start=1)]
+    answered = run_burst(
+        monkeypatch, updates, lambda u: (u.message.from_user.id, u.message.text, "message"),
+    )
+    assert answered == [queries[-1]]
+
+
+def test_rapid_inline_queries_supersede_through_middleware(monkeypatch):
+    queries = ["na", "nm", "nma", "nmap"]
+    updates = [inline_update(i, 42, query) for i, query in enumerate(queries, start=1)]
+    answered = run_burst(
+        monkeypatch, updates, lambda u: (u.inline_query.from_user.id, u.inline_query.query, "inline"),
+    )
+    assert answered == [queries[-1]]
+
+
+def test_callbacks_and_commands_of_one_chat_run_in_order():
+    events = []
+
+    async def handler(update, data):
+        events.append(("start", update.update_id))
+        await asyncio.sleep(0.01)
+        events.append(("end", update.update_id))
+
+    async def run():
+        middleware = bot.ChatSchedulerMiddleware(8)
+        await asyncio.gather(
+            feed(middleware, handler, callback_update(1, 42, "home")),
+            feed(middleware, handler, message_update(2, 42, "/stats")),
+            feed(middleware, handler, callback_update(3, 42, "stats")),
+        )
+
+    asyncio.run(run())
+    assert events == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
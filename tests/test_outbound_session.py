@@ -0,0 +1,159 @@
+"""OutboundSession против FakeTelegramAPI: приоритеты, 429, повторы 5xx и бюджет повторов"""
+import asyncio
+import contextlib
+import time
+
+import pytest
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramServerError
+from aiohttp import web
+
+import bot
+from fake_telegram import FakeTelegramAPI
+
+
+@contextlib.asynccontextmanager
+async def fake_telegram(api, **options):
+    """Bot с OutboundSession, направленной на заглушку на свободном порту"""
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    host, port = runner.addresses[0][:2]
+    session = bot.OutboundSession(api=TelegramAPIServer.from_base(f"http://{host}:{port}"), **options)
+    try:
+        yield Bot(token="123456:TEST", session=session)
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bot.random, "uniform", lambda a, b: 0.0)
+
+
+def test_interactive_sends_overtake_queued_broadcast():
+    order = []
+
+    async def send(client, lane, chat_id):
+        bot.api_lane.set(lane)
+        await client.send_message(chat_id, "текст")
+        order.append(lane)
+
+    async def run():
+        async with fake_telegram(FakeTelegramAPI(), rate=5, chat_rate=100) as client:
+            # Весь запас общего бакета уходит сразу, дальше токен раз в 0,2 с
+            await asyncio.gather(*(client.send_message(chat_id, "прогрев") for chat_id in range(5)))
+            lanes = [bot.LANE_BROADCAST] * 3 + [bot.LANE_INTERACTIVE] * 3
+            await asyncio.gather(*(send(client, lane, 100 + n) for n, lane in enumerate(lanes)))
+
+    asyncio.run(run())
+
+    assert order == [bot.LANE_INTERACTIVE] * 3 + [bot.LANE_BROADCAST] * 3
+
+
+def test_only_sends_wait_for_global_bucket():
+    api = FakeTelegramAPI()
+    done = {}
+
+    async def timed(label, call, started):
+        await call
+        done[label] = time.monotonic() - started
+
+    async def run():
+        async with fake_telegram(api, rate=1, chat_rate=100) as client:
+            await client.send_message(1, "забирает единственный токен")
+            started = time.monotonic()
+            await asyncio.gather(
+                timed("send", client.send_message(2, "ждёт токен"), started),
+                *(timed(f"answer{n}", client.answer_callback_query(str(n)), started) for n in range(5)),
+                timed("edit", client.edit_message_text("правка", chat_id=3, message_id=1), started),
+            )
+
+    asyncio.run(run())
+
+    assert done["send"] >= 0.8
+    assert max(seconds for label, seconds in done.items() if label != "send") < 0.5
+    assert api.calls["answerCallbackQuery"] == 5
+
+
+def test_retry_after_in_several_chats_pauses_all_sends():
+    api = FakeTelegramAPI()
+    api.fail_next(429, count=3, retry_after=1)
+    done = {}
+
+    async def send(client, chat_id, started, delay=0.0):
+        await asyncio.sleep(delay)
+        await client.send_message(chat_id, "текст")
+        done[chat_id] = time.monotonic() - started
+
+    async def run():
+        async with fake_telegram(api, rate=30, chat_rate=100, flood_chats=3) as client:
+            started = time.monotonic()
+            await asyncio.gather(*(send(client, chat_id, started) for chat_id in (1, 2, 3)),
+                                 send(client, 4, started, delay=0.2))
+
+    asyncio.run(run())
+
+    # Чат 4 не получил своего 429: он дождался конца общей паузы
+    assert api.rejected[429] == 3
+    assert api.calls["sendMessage"] == 4
+    assert min(done.values()) >= 0.9
+
+
+def test_retry_after_in_one_chat_pauses_only_that_chat():
+    api = FakeTelegramAPI()
+    api.fail_next(429, retry_after=1)
+    done = {}
+
+    async def send(client, chat_id, started, delay=0.0):
+        await asyncio.sleep(delay)
+        await client.send_message(chat_id, "текст")
+        done[chat_id] = time.monotonic() - started
+
+    async def run():
+        async with fake_telegram(api, rate=30, chat_rate=100, flood_chats=3) as client:
+            started = time.monotonic()
+            await asyncio.gather(send(client, 1, started), send(client, 2, started, delay=0.1))
+
+    asyncio.run(run())
+
+    assert api.rejected[429] == 1
+    assert done[1] >= 0.9
+    assert done[2] < 0.5
+
+
+def test_server_errors_are_retried(no_backoff):
+    api = FakeTelegramAPI()
+    api.fail_next(502, count=2)
+
+    async def run():
+        async with fake_telegram(api, max_attempts=3) as client:
+            message = await client.send_message(1, "текст")
+            return message, client.session.retries
+
+    message, retries = asyncio.run(run())
+
+    assert message.text == "текст"
+    assert retries == 2
+    assert api.rejected[502] == 2
+
+
+def test_server_errors_give_up_when_retry_budget_is_spent(no_backoff):
+    api = FakeTelegramAPI(error_rate=1.0)
+
+    async def run():
+        async with fake_telegram(api, max_attempts=5) as client:
+            client.session.retry_budget = bot.RetryBudget(ratio=0.0, min_per_second=0.0, cap=1.0)
+            with pytest.raises(TelegramServerError):
+                await client.send_message(1, "первый")
+            attempts_first = api.rejected[502]
+            with pytest.raises(TelegramServerError):
+                await client.send_message(1, "второй")
+            return attempts_first, api.rejected[502] - attempts_first
+
+    first, second = asyncio.run(run())
+
+    # Единственный повтор из бюджета достаётся первому запросу, второй не повторяется
+    assert (first, second) == (2, 1)
@@ -0,0 +1,61 @@
+"""Деление уроков на страницы: предел в кодовых единицах UTF-16"""
+import pytest
+
+import bot
+
+
+def assert_pages_fit(pages, limit):
+    assert pages
+    for page in pages:
+        assert page.strip()
+        assert bot.utf16_len(page) <= limit
+
+
+def test_short_text_is_one_page():
+    assert bot.split_pages("Короткий урок", limit=100) == ["Короткий урок"]
+
+
+def test_empty_text_is_one_placeholder_page():
+    assert bot.split_pages("", limit=100) == ["…"]
+    assert bot.split_pages("\n\n\n", limit=100) == ["…"]
+
+
+def test_paragraphs_are_kept_whole_when_they_fit():
+    paragraphs = [f"Абзац {i}. " + "слово " * 10 + "\n\n" for i in range(20)]
+    text = "".join(paragraphs)
+
+    pages = bot.split_pages(text, limit=200)
+
+    assert_pages_fit(pages, 200)
+    assert "".join(pages) == text
+    for page in pages:
+        assert page.startswith("Абзац")
+
+
+def test_long_paragraph_is_split_by_lines():
+    text = "".join(f"строка {i}\n" for i in range(100))
+
+    pages = bot.split_pages(text, limit=50)
+
+    assert_pages_fit(pages, 50)
+    assert "".join(pages) == text
+    assert all(page.endswith("\n") for page in pages)
+
+
+@pytest.mark.parametrize("char", ["я", "a", "🔐"])
+def test_line_without_breaks_is_cut_by_utf16_length(char):
+    text = char * 1000
+
+    pages = bot.split_pages(text, limit=99)
+
+    assert_pages_fit(pages, 99)
+    assert "".join(pages) == text
+
+
+def test_default_limit_fits_telegram_message():
+    text = ("🔐 Урок про безопасность. " * 50 + "\n\n") * 40
+
+    pages = bot.split_pages(text)
+
+    assert_pages_fit(pages, 4096)
+    assert len(pages) > 1
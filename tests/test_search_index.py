@@ -0,0 +1,246 @@
+"""SearchIndex: ранжирование BM25, стемминг и изменения индекса"""
+import pytest
+
+import bot
+
+FILLER = "текст урока про терминал"
+
+
+def build(docs):
+    index = bot.SearchIndex()
+    for rel_path, text in docs.items():
+        index.add_document(rel_path, text)
+    return index
+
+
+def ranking(index, query, limit=10):
+    return [hit.rel_path for hit in index.search(query, limit=limit).hits]
+
+
+def scores(index, query, limit=10):
+    return {hit.rel_path: hit.score for hit in index.search(query, limit=limit).hits}
+
+
+def test_term_frequency_raises_score():
+    index = build({
+        "a.txt": f"nmap {FILLER} {FILLER}",
+        "b.txt": f"nmap nmap nmap {FILLER}",
+        "c.txt": f"{FILLER} {FILLER} про",
+    })
+
+    assert ranking(index, "nmap") == ["b.txt", "a.txt"]
+
+
+def test_shorter_document_wins_at_equal_frequency():
+    index = build({
+        "long.txt": f"nmap {FILLER} {FILLER} {FILLER} {FILLER}",
+        "short.txt": f"nmap {FILLER}",
+        "other.txt": FILLER,
+    })
+
+    assert ranking(index, "nmap") == ["short.txt", "long.txt"]
+
+
+def test_title_matches_are_boosted():
+    index = build({
+        "Сеть/Nmap/x.txt": f"nmap {FILLER}",
+        "Сеть/nmap.txt": f"nmap {FILLER}",
+        "Сеть/y.txt": f"nmap nmap nmap {FILLER}",
+        "Сеть/z.txt": FILLER,
+    })
+
+    # Имя файла весит больше папки, а любой буст — больше частоты в тексте
+    assert ranking(index, "nmap") == ["Сеть/nmap.txt", "Сеть/Nmap/x.txt", "Сеть/y.txt"]
+
+
+def test_equal_scores_are_ordered_by_path():
+    index = build({name: f"nmap {FILLER}" for name in ("c.txt", "a.txt", "b.txt")})
+
+    assert ranking(index, "nmap") == ["a.txt", "b.txt", "c.txt"]
+    assert index.search("nmap", limit=2).total == 3
+
+
+@pytest.mark.parametrize("forms", [
+    ["атака", "атаки", "атаку", "атакой", "атаками", "атаках"],
+    ["пользователь", "пользователя", "пользователями", "пользователей"],
+    ["сканирование", "сканирования", "сканированию", "сканированием", "сканирований"],
+    ["уязвимость", "уязвимости", "уязвимостью", "уязвимостей", "уязвимостями"],
+    ["система", "системы", "систему", "системой", "системах"],
+    ["scan", "scans", "scanning", "scanned"],
+    ["exploit", "exploits", "exploited", "exploiting"],
+])
+def test_inflected_forms_share_a_stem(forms):
+    assert len({bot.stem(form) for form in forms}) == 1
+
+
+def test_query_matches_other_inflections():
+    index = build({"a.txt": "защита от атаки на пароль", "b.txt": FILLER})
+
+    for query in ("атакой", "атаками", "атаку"):
+        assert ranking(index, query) == ["a.txt"]
+
+
+def test_added_then_removed_document_leaves_scores_unchanged():
+    docs = {
+        "a.txt": f"nmap kali {FILLER}",
+        "b.txt": f"kali kali {FILLER} {FILLER}",
+        "c.txt": f"атака nmap {FILLER}",
+    }
+    index = build(docs)
+    before = {query: scores(index, query) for query in ("nmap", "kali", "атака")}
+
+    index.add_document("d.txt", f"nmap nmap kali атака {FILLER}")
+    assert "d.txt" in scores(index, "nmap")
+    index.remove_document("d.txt")
+
+    for query, expected in before.items():
+        assert scores(index, query) == pytest.approx(expected)
+
+
+def test_incremental_changes_match_a_fresh_build():
+    index = build({
+        "a.txt": f"nmap kali {FILLER}",
+        "b.txt": f"старый текст про kali {FILLER}",
+        "c.txt": f"атака {FILLER}",
+    })
+    index.add_document("b.txt", f"nmap nmap {FILLER}")  # изменённый файл
+    index.remove_document("c.txt")
+    index.add_document("d.txt", f"kali атака {FILLER}")
+
+    fresh = build({
+        "a.txt": f"nmap kali {FILLER}",
+        "b.txt": f"nmap nmap {FILLER}",
+        "d.txt": f"kali атака {FILLER}",
+    })
+
+    assert len(index) == len(fresh) == 3
+    for query in ("nmap", "kali", "атака", "старый", "терминал"):
+        assert scores(index, query) == pytest.approx(scores(fresh, query))
+
+
+# ===== ОПЕЧАТКИ И РАСКЛАДКА =====
+
+@pytest.fixture
+def tools_index():
+    return build({
+        "Сеть/Сканирование.txt": f"nmap сканирует порты {FILLER}",
+        "Эксплойты/Фреймворк.txt": f"metasploit запускает эксплойт {FILLER}",
+        "Атаки/Фишинг.txt": f"атака через письмо {FILLER}",
+    })
+
+
+def test_one_edit_typo_finds_the_word(tools_index):
+    assert ranking(tools_index, "nmpa") == ["Сеть/Сканирование.txt"]
+    assert ranking(tools_index, "metasplot") == ["Эксплойты/Фреймворк.txt"]
+
+
+def test_wrong_keyboard_layout_is_swapped(tools_index):
+    assert "тьфз".translate(bot.LAYOUT_SWAP) == "nmap"
+    assert ranking(tools_index, "тьфз") == ["Сеть/Сканирование.txt"]
+    assert ranking(tools_index, "fnfrf") == ["Атаки/Фишинг.txt"]
+
+
+def test_mixed_cyrillic_and_latin_letters_are_folded(tools_index):
+    assert ranking(tools_index, "nmар") == ["Сеть/Сканирование.txt"]  # «а» и «р» кириллические
+
+
+@pytest.mark.parametrize("query", ["nmp", "mpa", "nm"])
+def test_short_queries_are_not_corrected(tools_index, query):
+    assert len(query) < bot.FUZZY_MIN_LENGTH
+    assert tools_index.search(query).total == 0
+
+
+def test_exact_match_outranks_fuzzy_neighbours():
+    index = build({
+        "a.txt": f"nmap {FILLER}",
+        "b.txt": f"nmaq nmaq nmaq {FILLER}",
+    })
+
+    # Точное слово есть в словаре — похожие слова не подмешиваются
+    assert ranking(index, "nmap") == ["a.txt"]
+    # При исправлении опечатки более близкое слово перевешивает частоту менее близкого
+    assert ranking(index, "nmpa") == ["a.txt", "b.txt"]
+
+
+def test_trigram_index_forgets_removed_words():
+    trigrams = bot.TrigramIndex()
+    for term in ("metasploit", "nmap", "netcat"):
+        trigrams.add(term)
+    assert [term for term, _ in trigrams.similar("metasplot")] == ["metasploit"]
+
+    trigrams.remove("metasploit")
+
+    assert trigrams.similar("metasplot") == []
+
+
+def test_typo_is_not_corrected_to_a_removed_document():
+    index = build({"a.txt": f"metasploit {FILLER}", "b.txt": FILLER})
+    assert ranking(index, "metasplot") == ["a.txt"]
+
+    index.remove_document("a.txt")
+
+    assert index.search("metasplot").total == 0
+
+
+# ===== ПОЗИЦИИ И ФРАЗЫ =====
+
+def test_quoted_phrase_requires_adjacent_words():
+    index = build({
+        "phrase.txt": "установка kali linux на ноутбук",
+        "apart.txt": "linux и kali на ноутбук",
+        "reverse.txt": "linux kali на ноутбук",
+    })
+
+    assert sorted(ranking(index, "kali linux")) == ["apart.txt", "phrase.txt", "reverse.txt"]
+    assert ranking(index, '"kali linux"') == ["phrase.txt"]
+    assert ranking(index, "«linux kali»") == ["reverse.txt"]
+
+
+def test_phrase_matches_inflected_forms():
+    index = build({
+        "a.txt": "защита от атаки фишингом",
+        "b.txt": "атака и защита от фишинга",
+    })
+
+    assert ranking(index, '"атака фишинг"') == ["a.txt"]
+
+
+def test_phrase_and_free_words_combine():
+    index = build({
+        "a.txt": "kali linux сканирует порты через nmap",
+        "b.txt": "kali linux и metasploit",
+        "c.txt": "nmap для linux и kali",
+    })
+
+    assert ranking(index, '"kali linux" nmap') == ["a.txt", "b.txt"]
+    assert index.search('"linux kali"').total == 0
+
+
+def test_context_is_taken_from_the_matching_line():
+    index = build({"a.txt": "первая строка\nвторая строка\nтретья\nчетвёртая про nmap\nпятая\nшестая"})
+
+    hit = index.search("nmap").hits[0]
+
+    assert hit.contexts == ["третья\nчетвёртая про nmap\nпятая"]
+
+
+def test_reindexed_document_replaces_its_positions():
+    index = build({"a.txt": "kali linux\nстарая строка", "b.txt": "linux"})
+
+    index.add_document("a.txt", "новая строка\nlinux отдельно от kali")
+
+    assert ranking(index, '"kali linux"') == []
+    assert index.search("kali").hits[0].contexts == ["новая строка\nlinux отдельно от kali"]
+    assert index.search("старая").total == 0
+
+
+def test_removed_document_leaves_no_postings():
+    index = build({"a.txt": "kali linux nmap", "b.txt": "kali linux"})
+
+    index.remove_document("a.txt")
+
+    assert ranking(index, '"kali linux"') == ["b.txt"]
+    assert index.search("nmap").total == 0
+    assert "a.txt" not in index
+    index.add_document("a.txt", "nmap")
+    assert ranking(index, "nmap") == ["a.txt"]
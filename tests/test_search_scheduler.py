@@ -0,0 +1,76 @@
+"""SearchScheduler: поиск вне событийного цикла, общие вычисления, вытеснение"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    calls = []
+
+    def search(query, limit, max_contexts):
+        calls.append((query, threading.get_ident()))
+        time.sleep(0.02)
+        return bot.SearchResults(total=1, hits=[bot.SearchHit(f"{query}.txt", 1.0, [])])
+
+    monkeypatch.setattr(bot.search_index, "search", search)
+    bot.search_cache.clear()
+    scheduler = bot.SearchScheduler(workers=2, debounce=0.0)
+    scheduler.calls = calls
+    yield scheduler
+    scheduler.shutdown()
+    bot.search_cache.clear()
+
+
+def test_page_fetch_runs_off_loop_and_shares_inflight_search(scheduler):
+    async def run():
+        return await asyncio.gather(scheduler.search(1, "nmap"), scheduler.fetch("nmap"))
+
+    first, second = asyncio.run(run())
+
+    assert first is second
+    assert [query for query, _ in scheduler.calls] == ["nmap"]
+    assert scheduler.calls[0][1] != threading.get_ident()
+
+
+def test_page_fetch_after_cache_miss_recomputes_once(scheduler):
+    async def run():
+        await scheduler.search(1, "kali")
+        bot.search_cache.clear()
+        return await asyncio.gather(*(scheduler.fetch("kali") for _ in range(3)))
+
+    results = asyncio.run(run())
+
+    assert all(r is results[0] for r in results)
+    assert [query for query, _ in scheduler.calls] == ["kali", "kali"]
+
+
+def test_page_fetch_is_not_superseded_by_new_search(scheduler):
+    async def run():
+        fetch = asyncio.ensure_future(scheduler.fetch("linux"))
+        await asyncio.sleep(0)
+        newer = await scheduler.search(1, "nmap")
+        return await fetch, newer
+
+    fetched, newer = asyncio.run(run())
+
+    assert fetched.hits[0].rel_path == "linux.txt"
+    assert newer.hits[0].rel_path == "nmap.txt"
+
+
+def test_newer_query_supersedes_older_one(scheduler):
+    async def run():
+        older = asyncio.ensure_future(scheduler.search(1, "атака"))
+        await asyncio.sleep(0.005)
+        newer = await scheduler.search(1, "атака фишинг")
+        return await older, newer
+
+    older, newer = asyncio.run(run())
+
+    assert older is None
+    assert newer.hits[0].rel_path == "атака фишинг.txt"
+    assert scheduler.superseded == 1
@@ -0,0 +1,94 @@
+"""Хранилища состояния: запись и загрузка, слияние прогресса, номера уроков"""
+import pytest
+
+import bot
+from conftest import write_lesson
+
+BACKENDS = ["sqlite", "journal"]
+
+
+def open_store(backend, tmp_path):
+    return bot.open_state_store(backend, str(tmp_path / f"state.{backend}"))
+
+
+def bits(*ordinals):
+    value = sum(1 << n for n in ordinals)
+    return value.to_bytes((value.bit_length() + 7) // 8, "little")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_round_trip(backend, tmp_path):
+    store = open_store(backend, tmp_path)
+    store.load()
+    store.write_batch(bot.StateBatch(
+        subscribers={1: True, 2: True},
+        progress={1: bits(0, 3)},
+        content_messages={1: [10, 11]},
+        ordinals={"a.txt": 0, "b.txt": 1},
+        meta={"content_version": "v1"},
+    ))
+    store.write_batch(bot.StateBatch(
+        subscribers={2: False},
+        content_messages={1: []},
+        meta={"content_version": "v2"},
+    ))
+    store.close()
+
+    snapshot = open_store(backend, tmp_path).load()
+
+    assert snapshot.subscribers == {1}
+    assert snapshot.progress == {1: bits(0, 3)}
+    assert snapshot.content_messages == {}
+    assert snapshot.ordinals == {"a.txt": 0, "b.txt": 1}
+    assert snapshot.meta == {"content_version": "v2"}
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_progress_from_stale_writer_is_merged_not_replaced(backend, tmp_path):
+    store = open_store(backend, tmp_path)
+    store.load()
+    store.write_batch(bot.StateBatch(progress={7: bits(0, 1)}))
+    store.write_batch(bot.StateBatch(progress={7: bits(5)}))
+    store.close()
+
+    assert open_store(backend, tmp_path).load().progress == {7: bits(0, 1, 5)}
+
+
+def test_sqlite_writers_in_two_connections_keep_each_others_marks(tmp_path):
+    path = tmp_path / "state.sqlite3"
+    first, second = bot.SQLiteStateStore(path), bot.SQLiteStateStore(path)
+    first.write_batch(bot.StateBatch(progress={7: bits(2)}))
+    second.write_batch(bot.StateBatch(progress={7: bits(4)}))
+
+    assert first.load().progress == {7: bits(2, 4)}
+
+
+def test_shard_key_is_the_user_not_the_chat():
+    group_message = {"update_id": 1, "message": {"chat": {"id": -100}, "from": {"id": 7}}}
+    private_callback = {"update_id": 2, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 7}}}}
+    channel_post = {"update_id": 3, "channel_post": {"chat": {"id": -200}}}
+
+    assert bot.update_shard_key(group_message) == bot.update_shard_key(private_callback) == 7
+    assert bot.update_shard_key(channel_post) == -200
+
+
+def test_follower_leaves_new_lessons_unnumbered_until_leader_assigns(info_root, tmp_path):
+    write_lesson(info_root, "A/01. Первый.txt")
+    write_lesson(info_root, "A/02. Второй.txt")
+    ordinals = bot.lesson_ordinals
+    ordinals.load({"A/01. Первый.txt": 0})
+    ordinals.assigning = False
+
+    catalog = bot.ContentCatalog.build(info_root)
+
+    assert dict(catalog.ordinals) == {"A/01. Первый.txt": 0}
+    assert catalog.dir_masks["A"] == (0, 1)
+    tracker = bot.ProgressTracker()
+    assert tracker.mark_studied(1, "A/02. Второй.txt") is False
+    assert tracker.mark_studied(1, "A/01. Первый.txt") is True
+
+    writer = bot.StateWriter(open_store("sqlite", tmp_path))
+    assert not writer._take_batch().ordinals
+
+    ordinals.merge({"A/02. Второй.txt": 1})
+    assert dict(bot.ContentCatalog.build(info_root).ordinals) == {"A/01. Первый.txt": 0, "A/02. Второй.txt": 1}
@@ -0,0 +1,115 @@
+"""События inotify -> ContentEvent и перечитывание каталога по ним"""
+import asyncio
+import os
+
+import pytest
+
+import bot
+from conftest import write_lesson
+
+requires_inotify = pytest.mark.skipif(not bot.InotifyWatcher.available(), reason="нужен inotify (Linux)")
+
+W = bot.InotifyWatcher
+
+
+def watch(root, *actions, timeout=3.0):
+    """Выполняет действия по одному и собирает пачку событий после каждого"""
+    async def run():
+        watcher = W(root, debounce=0.05)
+        watcher.start()
+        batches = []
+        try:
+            for action in actions:
+                action()
+                try:
+                    batches.append(await asyncio.wait_for(watcher.changes(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    batches.append([])
+        finally:
+            watcher.close()
+        return batches
+    return asyncio.run(run())
+
+
+def assert_matches_full_build(old, root, events):
+    rescanned = old.rescan(root, bot.affected_dirs(events))
+    full = bot.ContentCatalog.build(root)
+    assert sorted(rescanned.dirs) == sorted(full.dirs)
+    assert sorted(rescanned.files) == sorted(full.files)
+    assert rescanned.version == full.version
+
+
+@requires_inotify
+def test_move_between_directories_is_a_rename(info_root):
+    write_lesson(info_root, "A/sub/01. Урок.txt")
+    (info_root / "B").mkdir()
+    old = bot.ContentCatalog.build(info_root)
+
+    [events] = watch(info_root, lambda: os.rename(info_root / "A/sub", info_root / "B/sub"))
+
+    assert events == [bot.ContentEvent("rename", "B/sub", True, old_path="A/sub")]
+    assert_matches_full_build(old, info_root, events)
+
+
+@requires_inotify
+def test_moved_directory_keeps_reporting_under_new_path(info_root):
+    write_lesson(info_root, "A/sub/deep/01. Урок.txt")
+    (info_root / "B").mkdir()
+
+    _, events = watch(
+        info_root,
+        lambda: os.rename(info_root / "A/sub", info_root / "B/sub"),
+        lambda: write_lesson(info_root, "B/sub/deep/02. Новый.txt"),
+    )
+
+    assert [(e.kind, e.rel_path) for e in events] == [("add", "B/sub/deep/02. Новый.txt")]
+
+
+@requires_inotify
+def test_directory_moved_out_of_tree_is_deleted_and_unwatched(info_root, tmp_path):
+    write_lesson(info_root, "A/sub/01. Урок.txt")
+    outside = tmp_path / "outside"
+
+    moved, later = watch(
+        info_root,
+        lambda: os.rename(info_root / "A/sub", outside),
+        lambda: write_lesson(outside, "02. Чужой.txt"),
+        timeout=0.5,
+    )
+
+    assert moved == [bot.ContentEvent("delete", "A/sub", True)]
+    assert later == []
+
+
+@requires_inotify
+def test_file_events_mapping():
+    watcher = W(bot.INFO_ROOT)
+    watcher._wd_to_dir = {1: "", 2: "A"}
+    watcher._handle(2, W.IN_CREATE, 0, "01. Урок.txt")
+    watcher._handle(2, W.IN_CREATE, 0, "картинка.png")
+    watcher._handle(1, W.IN_CLOSE_WRITE, 0, "02. Правка.txt")
+    watcher._handle(2, W.IN_MOVED_FROM, 5, "03. Старое.txt")
+    watcher._handle(1, W.IN_MOVED_TO, 5, "03. Новое.txt")
+    watcher._handle(2, W.IN_MOVED_FROM, 6, "04. Ушёл.txt")
+    watcher._handle(2, W.IN_DELETE_SELF, 0, "")
+    watcher._flush()
+
+    assert watcher._queue.get_nowait() == [
+        bot.ContentEvent("add", "A/01. Урок.txt"),
+        bot.ContentEvent("modify", "02. Правка.txt"),
+        bot.ContentEvent("rename", "03. Новое.txt", old_path="A/03. Старое.txt"),
+        bot.ContentEvent("delete", "A/04. Ушёл.txt"),
+    ]
+
+
+@requires_inotify
+def test_queue_overflow_forces_full_rescan():
+    watcher = W(bot.INFO_ROOT)
+    watcher._wd_to_dir = {1: ""}
+    watcher._handle(1, W.IN_CREATE, 0, "01. Урок.txt")
+    watcher._handle(-1, W.IN_Q_OVERFLOW, 0, "")
+    watcher._flush()
+
+    events = watcher._queue.get_nowait()
+    assert events == [bot.ContentEvent("overflow", "")]
+    assert bot.affected_dirs(events) is None